@@ -1,14 +1,99 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import time
+_PHASE_STARTED = time.perf_counter()  # start of the startup report, see STARTUP_SECONDS
+
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 from datetime import datetime, timedelta
-import csv
+import atexit
+import json
+from collections import namedtuple
 import os
 import secrets
-import joblib
-import pandas as pd
+import sys
+
+import app_logging
+from dashboard_stats import COUNT_NAMES, REQUEST_FIELDS, DashboardStats
+from dataset_sink import DEDUP_STATE_PATH, DatasetDeduper, dataset_row
+from event_log import EventLogWriter
+from detection_middleware import MAX_BODY, DetectionMiddleware, Prefilter
+from event_stream import EventPublisher, format_event
+from features import extract_feature_vector, extract_features_batch, get_scanner
+from inference import bad_probability
+from model_registry import ModelRegistry
+from metrics import CONTENT_TYPE, MetricsRegistry
+from normalize import LRUCache, body_key, parse_body
+from rate_tracker import RateTracker, Velocity
+from shared_counters import SharedCounters
+from signatures import describe
+from storage import STORAGE_DB_PATH, CsvStorage, open_storage
+
+# Seconds spent in each startup phase, logged once the module has loaded and
+# exported as sqli_startup_seconds. Nothing here imports pandas or sklearn: the
+# model comes from the compiled forest, and those libraries are only pulled in
+# by the pickle fallback (or by training and the Streamlit app).
+STARTUP_SECONDS = {}
+HEAVY_MODULES = ('pandas', 'sklearn', 'scipy', 'joblib')
+
+
+def _startup_phase(name):
+    global _PHASE_STARTED
+    now = time.perf_counter()
+    STARTUP_SECONDS[name] = STARTUP_SECONDS.get(name, 0.0) + now - _PHASE_STARTED
+    _PHASE_STARTED = now
+
+
+_startup_phase('imports')
+
+# Session cookies are signed with SECRET_KEY. It has to be the same in every
+# worker process and across restarts, or users are logged out whenever their
+# request lands elsewhere: set SECRET_KEY (the same value on every host), or a
+# random key is generated on first start and kept in SECRET_KEY_PATH (mode 0600).
+SECRET_KEY_PATH = os.environ.get('SECRET_KEY_PATH', 'secret_key')
+
+
+def _secret_key():
+    key = os.environ.get('SECRET_KEY', '')
+    if key:
+        return key
+    try:
+        fd = os.open(SECRET_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another process may have just created it and not written it yet
+        for _ in range(50):
+            with open(SECRET_KEY_PATH, 'r', encoding='ascii') as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.01)
+        raise RuntimeError(f'{SECRET_KEY_PATH} is empty; delete it or set SECRET_KEY')
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(key)
+    return key
 
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)  # Generate secure session key
+app.secret_key = _secret_key()
+
+# Leveled logging to stderr (see app_logging.py). LOG_SAMPLE_RATE is the share of
+# DEBUG records that are actually emitted; per-request lines never carry the
+# password or the raw body.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+LOG = app_logging.configure('app', LOG_LEVEL, LOG_SAMPLE_RATE)
+
+# Prometheus metrics served on /metrics. Gauges (queue depths, cache ratios,
+# model version) are registered further down, next to what they read. When
+# METRICS_TOKEN is set, scrapers must send it as a bearer token.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS = MetricsRegistry('sqli_')
+REQUESTS_TOTAL = METRICS.counter('requests_total', 'Scored requests by endpoint and verdict.',
+                                 ['endpoint', 'verdict'])
+ALERTS_TOTAL = METRICS.counter('alerts_total', 'Alerts written, by what raised them.', ['reason'])
+REQUEST_SECONDS = METRICS.histogram('request_seconds', 'Detection time per request, by endpoint.',
+                                    ['endpoint'])
+STAGE_SECONDS = METRICS.histogram('stage_seconds', 'Time spent in each detection stage.', ['stage'])
+LOG_FLUSH_SECONDS = METRICS.histogram('event_log_flush_seconds', 'Time to append one batch to a log file.',
+                                      ['sink'])
 
 # File paths
 REQUEST_CSV = 'http_requests.csv'
@@ -20,50 +105,343 @@ ADMIN_USERS = {'admin': 'admin123', 'root': 'root123'}
 # Toggle so the app accepts any credentials as admin when True
 ALLOW_ANY_LOGIN = True
 
+# Micro-batching for model scoring: requests arriving within INFERENCE_MAX_WAIT_MS
+# of each other are scored together, up to INFERENCE_MAX_BATCH_SIZE bodies per call
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 64))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 2.0))
+
+# Probability of the 'bad' class at or above which a body is flagged
+BAD_THRESHOLD = 0.5
+
+# /api/bulk-score: records scored per vectorized chunk, and the shared secret
+# reverse proxies send in X-Ingest-Token (token auth is off when unset)
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 4096))
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN', '')
+
+# Verdicts for repeated payloads (credential stuffing, scanners) are reused from a
+# bounded LRU cache keyed on a hash of the raw body, skipping feature extraction,
+# signature scanning and model scoring entirely
+VERDICT_CACHE_SIZE = int(os.environ.get('VERDICT_CACHE_SIZE', 10000))
+VERDICT_CACHE = LRUCache(VERDICT_CACHE_SIZE)
+
 # Load ML model (if present). Keep failures non-fatal.
-MODEL = None
-FEATURE_COLS = None
-if os.path.exists('login_classifier.pkl') and os.path.exists('feature_columns.pkl'):
-    try:
-        MODEL = joblib.load('login_classifier.pkl')
-        FEATURE_COLS = joblib.load('feature_columns.pkl')
-        print('ML model loaded. Feature columns:', FEATURE_COLS)
-    except Exception as e:
-        print('Failed to load ML model or feature columns:', e)
-
-
-def extract_features_from_body(body):
-    s = str(body)
-    features = {
-        'body_length': len(s),
-        'has_special_chars': 1 if any(c in s for c in ["'", '"', '-', ';', '*']) else 0,
-        'has_sql_keywords': 1 if any(kw in s.lower() for kw in ['union', 'select', 'drop', 'insert', 'update', 'delete', 'exec', 'script']) else 0,
-        'has_path_traversal': 1 if '..' in s else 0,
-        'body_contains_slash': s.count('/'),
-        # placeholders for f1-f3 used in training
-        'f1': 0,
-        'f2': 0,
-        'f3': 0,
-    }
-    return features
-
-
-# Ensure CSVs exist
-if not os.path.exists(REQUEST_CSV):
-    with open(REQUEST_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp', 'method', 'url', 'body'])
-
-if not os.path.exists(LOGIN_DATASET_CSV):
-    # create with no header (existing dataset had no header)
-    open(LOGIN_DATASET_CSV, 'a', encoding='utf-8').close()
+# Prefer the compiled forest exported by train_model.py: it scores one row in
+# microseconds and does not need sklearn at all. The pickle is the fallback.
+# The registry also swaps in retrained artifacts while the server runs: they are
+# checked every MODEL_WATCH_INTERVAL seconds (0 turns the watcher off) or on
+# POST /api/model/reload, and must score at least MODEL_MIN_ACCURACY on a pinned
+# sample of login_dataset.csv (and not much worse than the active model).
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 5.0))
+MODEL_MIN_ACCURACY = float(os.environ.get('MODEL_MIN_ACCURACY', 0.9))
+
+
+def _on_model_swap(bundle):
+    # Cached verdicts came from the old model
+    VERDICT_CACHE.clear()
+
+
+_startup_phase('setup')
+REGISTRY = ModelRegistry(LOGIN_DATASET_CSV, min_accuracy=MODEL_MIN_ACCURACY, on_swap=_on_model_swap,
+                         scorer_options={'max_batch_size': INFERENCE_MAX_BATCH_SIZE,
+                                         'max_wait_ms': INFERENCE_MAX_WAIT_MS})
+try:
+    if REGISTRY.load() is not None:
+        LOG.info('Model loaded from %s. Feature columns: %s', REGISTRY.current().source,
+                 REGISTRY.current().feature_cols)
+except Exception as e:
+    LOG.error('Failed to load ML model or feature columns: %s', e)
+_startup_phase('model')
+if MODEL_WATCH_INTERVAL > 0:
+    REGISTRY.watch(MODEL_WATCH_INTERVAL)
+
+
+# Login velocity per client IP and username (see rate_tracker.py). The counts are
+# stored in the dataset rows (f4..f6) and passed to models trained with
+# USE_VELOCITY_FEATURES=1; reaching a limit writes an alert.
+RATE_TRACKING = os.environ.get('RATE_TRACKING', '1') == '1'
+RATE_BURST_WINDOW = float(os.environ.get('RATE_BURST_WINDOW', 10))
+RATE_WINDOW = float(os.environ.get('RATE_WINDOW', 60))
+RATE_IP_BURST_LIMIT = int(os.environ.get('RATE_IP_BURST_LIMIT', 20))
+RATE_IP_LIMIT = int(os.environ.get('RATE_IP_LIMIT', 60))
+RATE_USER_LIMIT = int(os.environ.get('RATE_USER_LIMIT', 10))
+RATE_MAX_KEYS = int(os.environ.get('RATE_MAX_KEYS', 100000))
+RATES = None
+if RATE_TRACKING:
+    RATES = RateTracker(RATE_BURST_WINDOW, RATE_WINDOW, RATE_IP_BURST_LIMIT, RATE_IP_LIMIT, RATE_USER_LIMIT,
+                        max_keys=RATE_MAX_KEYS)
+NO_VELOCITY = Velocity(0, 0, 0)
+
+
+# features: model feature vector (None without a model); classification:
+# 'good'/'bad' (None without a model); matches: signature rule hits
+Verdict = namedtuple('Verdict', ['features', 'classification', 'probability', 'matches'])
+
+
+def _analyze(body, bundle, velocity):
+    features = classification = probability = None
+    if bundle is not None:
+        started = time.perf_counter()
+        features = extract_feature_vector(body, bundle.feature_cols, velocity, ngram=bundle.ngram)[0]
+        scored = time.perf_counter()
+        STAGE_SECONDS.observe(scored - started, 'features')
+        if bundle.scorer is not None:
+            probability = bundle.scorer.score(features)
+        else:
+            probability = bundle.model.score_row(features)
+        STAGE_SECONDS.observe(time.perf_counter() - scored, 'score')
+        classification = 'bad' if probability >= BAD_THRESHOLD else 'good'
+    started = time.perf_counter()
+    scanner = get_scanner()
+    matches = tuple(scanner.scan(body)) if scanner.rules else ()
+    STAGE_SECONDS.observe(time.perf_counter() - started, 'signatures')
+    return Verdict(features, classification, probability, matches)
+
+
+def analyze_body(body, velocity=NO_VELOCITY):
+    """Score a raw body with the loaded model and the signature rules, using the cache."""
+    bundle = REGISTRY.current()
+    version = bundle.version if bundle is not None else 0
+    if bundle is not None and bundle.uses_velocity:
+        # The model splits on the velocity features, so they are part of the input
+        key = body_key(f'{body}\x00{tuple(velocity)}')
+    else:
+        velocity = NO_VELOCITY
+        key = body_key(body)
+    cached = VERDICT_CACHE.get(key)
+    # Entries remember the model version, so a verdict stored by a request that
+    # straddled a reload is never served for the new model
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    verdict = _analyze(body, bundle, velocity)
+    VERDICT_CACHE.put(key, (version, verdict))
+    return verdict
+
 
 # Detected alerts file for later review
 DETECTED_ALERTS_CSV = 'detected_alerts.csv'
-if not os.path.exists(DETECTED_ALERTS_CSV):
-    with open(DETECTED_ALERTS_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp', 'endpoint', 'raw_body', 'classification', 'notes'])
+
+# Buffered event log: handlers enqueue rows, a background thread appends them in
+# batches every LOG_FLUSH_INTERVAL_MS (or LOG_FLUSH_BATCH_SIZE rows), so request
+# latency does not depend on disk I/O. Set LOG_FSYNC=1 to fsync every batch.
+LOG_FLUSH_BATCH_SIZE = int(os.environ.get('LOG_FLUSH_BATCH_SIZE', 512))
+LOG_FLUSH_INTERVAL_MS = float(os.environ.get('LOG_FLUSH_INTERVAL_MS', 50.0))
+LOG_FSYNC = os.environ.get('LOG_FSYNC', '0') == '1'
+
+# Where the request history and alerts are kept (see storage.py): 'csv' appends
+# to http_requests.csv / detected_alerts.csv as before, 'sqlite' stores them in
+# STORAGE_DB_PATH with indexes, so time range and verdict filters do not scan.
+# The training dataset stays a CSV either way; training, the dedup filter and the
+# columnar copy all read it incrementally by byte offset.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'csv')
+STORAGE_DB_PATH = os.environ.get('STORAGE_DB_PATH', STORAGE_DB_PATH)
+STORAGE = open_storage(STORAGE_BACKEND, {'requests': REQUEST_CSV, 'alerts': DETECTED_ALERTS_CSV},
+                       db_path=STORAGE_DB_PATH, fsync=LOG_FSYNC)
+DATASET_STORAGE = CsvStorage({'dataset': LOGIN_DATASET_CSV}, fsync=LOG_FSYNC)
+
+EVENT_LOG = EventLogWriter(batch_size=LOG_FLUSH_BATCH_SIZE, flush_interval_ms=LOG_FLUSH_INTERVAL_MS)
+EVENT_LOG.add_sink('requests', STORAGE)
+EVENT_LOG.add_sink('dataset', DATASET_STORAGE)
+EVENT_LOG.add_sink('alerts', STORAGE)
+
+# Training rows are deduplicated before they reach login_dataset.csv: a body
+# (normalized) is written once per label, repeats are only counted, and novel
+# benign bodies are kept at DATASET_BENIGN_SAMPLE_RATE. DATASET_DEDUP_CAPACITY is
+# the number of distinct rows the Bloom filter is sized for.
+DATASET_DEDUP = os.environ.get('DATASET_DEDUP', '1') == '1'
+DATASET_DEDUP_CAPACITY = int(os.environ.get('DATASET_DEDUP_CAPACITY', 1000000))
+DATASET_BENIGN_SAMPLE_RATE = float(os.environ.get('DATASET_BENIGN_SAMPLE_RATE', 1.0))
+DATASET_FILTER = None
+if DATASET_DEDUP:
+    _startup_phase('setup')
+    DATASET_FILTER = DatasetDeduper(LOGIN_DATASET_CSV, state_path=DEDUP_STATE_PATH,
+                                    expected_items=DATASET_DEDUP_CAPACITY,
+                                    benign_sample_rate=DATASET_BENIGN_SAMPLE_RATE)
+    DATASET_FILTER.load()
+    _startup_phase('dataset_filter')
+
+
+def record_dataset_row(method, url, body, label, velocity=NO_VELOCITY):
+    """Queue a training row for login_dataset.csv unless the dedup filter drops it.
+
+    Returns how many times the body has been seen with this label (1 without the filter).
+    """
+    admitted, seen = DATASET_FILTER.record(body, label, velocity) if DATASET_FILTER is not None else (True, 1)
+    if admitted:
+        EVENT_LOG.write('dataset', dataset_row(method, url, body, label, velocity))
+    return seen
+
+
+# Dashboard counters and recent-request ring, updated as the log writer flushes.
+# Restored on startup from STATS_CHECKPOINT plus whatever was appended since.
+# The counters sit in shared memory with one slot per serve.py worker (WORKERS,
+# set by serve.py) plus slot 0 for this process, so every worker reports the
+# totals of all of them.
+WORKERS = max(1, int(os.environ.get('WORKERS', 1)))
+STATS_CHECKPOINT = 'dashboard_stats.json'
+DASHBOARD_RECENT_LIMIT = 10
+REQUESTS_PAGE_MAX = 500
+ALERTS_PAGE_MAX = 1000
+_startup_phase('setup')
+STATS = DashboardStats(STORAGE, LOGIN_DATASET_CSV, checkpoint_path=STATS_CHECKPOINT,
+                       counters=SharedCounters(COUNT_NAMES, slots=WORKERS + 1))
+STATS.rebuild()
+_startup_phase('dashboard_stats')
+EVENT_LOG.add_listener(STATS.on_rows)
+
+# Live dashboard feed (GET /api/stream, server-sent events). Logged rows are
+# published once per writer batch and fanned out to every connected dashboard;
+# a client more than STREAM_CLIENT_QUEUE events behind is disconnected (its
+# browser reconnects and gets a fresh snapshot). STREAM_HEARTBEAT is the idle
+# keepalive interval in seconds.
+STREAM_MAX_CLIENTS = int(os.environ.get('STREAM_MAX_CLIENTS', 20))
+STREAM_CLIENT_QUEUE = int(os.environ.get('STREAM_CLIENT_QUEUE', 1000))
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))
+STREAM = EventPublisher(max_clients=STREAM_MAX_CLIENTS, client_queue=STREAM_CLIENT_QUEUE,
+                        heartbeat=STREAM_HEARTBEAT)
+ALERT_FIELDS = ['timestamp', 'endpoint', 'raw_body', 'classification', 'notes']
+
+
+def _publish_rows(sink, rows):
+    # Runs on the log writer thread after STATS.on_rows, so the counts sent
+    # include exactly the batches written so far
+    if not STREAM.has_subscribers():
+        return
+    if sink == 'requests':
+        STREAM.publish('requests', [dict(zip(REQUEST_FIELDS, row)) for row in rows])
+    elif sink == 'alerts':
+        STREAM.publish('alerts', [dict(zip(ALERT_FIELDS, row)) for row in rows])
+    elif sink == 'dataset':
+        delta = {'total': len(rows), 'good': 0, 'bad': 0, 'unknown': 0}
+        for row in rows:
+            label = row[-1] if row[-1] in ('good', 'bad') else 'unknown'
+            delta[label] += 1
+        # Absolute counts too, so a client that subscribed mid-batch never double counts
+        STREAM.publish('stats', {'delta': delta, 'counts': STATS.snapshot(0)[0]})
+
+
+EVENT_LOG.add_listener(_publish_rows)
+EVENT_LOG.add_flush_observer(lambda sink, seconds, n_rows: LOG_FLUSH_SECONDS.observe(seconds, sink))
+
+
+def _model_gauge(field):
+    bundle = REGISTRY.current()
+    return getattr(bundle, field) if bundle is not None else None
+
+
+def _inference_pending():
+    bundle = REGISTRY.current()
+    return bundle.scorer.pending() if bundle is not None and bundle.scorer is not None else 0
+
+
+# Read at scrape time only
+METRICS.gauge('event_log_queue_depth', 'Rows waiting for the log writer.', EVENT_LOG.pending)
+METRICS.gauge('inference_queue_depth', 'Rows waiting for the micro-batching scorer.', _inference_pending)
+METRICS.gauge('model_version', 'Version of the active model (0 before the first load).',
+              lambda: _model_gauge('version') or 0)
+METRICS.gauge('model_accuracy', 'Accuracy of the active model on the pinned sample.',
+              lambda: _model_gauge('accuracy'))
+METRICS.gauge('model_info', 'Artifact the active model was loaded from.',
+              lambda: {_model_gauge('source'): 1} if REGISTRY.current() is not None else None, ['source'])
+METRICS.gauge('verdict_cache_size', 'Entries in the verdict cache.', lambda: VERDICT_CACHE.stats()['size'])
+METRICS.gauge('verdict_cache_hit_ratio', 'Share of verdict cache lookups that hit.',
+              lambda: VERDICT_CACHE.stats()['hit_ratio'])
+METRICS.gauge('verdict_cache_lookups_total', 'Verdict cache lookups by result.',
+              lambda: {'hit': VERDICT_CACHE.hits, 'miss': VERDICT_CACHE.misses}, ['result'], kind='counter')
+if DATASET_FILTER is not None:
+    METRICS.gauge('dataset_rows_total', 'Training rows seen by the dedup filter, by outcome.',
+                  lambda: {k: v for k, v in DATASET_FILTER.stats().items() if k != 'seen'}, ['outcome'],
+                  kind='counter')
+METRICS.gauge('stream_clients', 'Dashboards connected to /api/stream.', STREAM.clients)
+METRICS.gauge('stream_dropped_total', 'Stream clients disconnected for falling behind.',
+              lambda: STREAM.dropped_total, kind='counter')
+METRICS.gauge('startup_seconds', 'Time spent in each startup phase.', lambda: dict(STARTUP_SECONDS), ['phase'])
+if RATES is not None:
+    METRICS.gauge('rate_tracker_keys', 'IPs and usernames currently tracked.',
+                  lambda: len(RATES.ip) + len(RATES.user))
+
+
+def _shutdown():
+    # Drain the log first so the checkpoint covers every row written
+    EVENT_LOG.close()
+    STATS.save_checkpoint()
+    if DATASET_FILTER is not None:
+        if WORKERS > 1:
+            # serve.py workers appended rows this process never saw
+            DATASET_FILTER.sync()
+        DATASET_FILTER.save()
+    REGISTRY.close()
+    STORAGE.close()
+    DATASET_STORAGE.close()
+
+
+atexit.register(_shutdown)
+
+
+def worker_init(slot):
+    """Prepare a worker forked by serve.py or gunicorn: restart the background threads fork left behind.
+
+    The model, the feature tables and the dedup filter are used as inherited.
+    """
+    # The checkpoints are the parent's job, also for workers that exit through sys.exit
+    atexit.unregister(_shutdown)
+    app_logging.after_fork()
+    STORAGE.after_fork()
+    DATASET_STORAGE.after_fork()
+    EVENT_LOG.after_fork()
+    REGISTRY.after_fork()
+    STATS.after_fork(slot)
+
+
+def worker_shutdown():
+    """Drain a worker's log and stop its threads; the checkpoints are left to the parent."""
+    EVENT_LOG.close()
+    REGISTRY.close()
+    STORAGE.close()
+    DATASET_STORAGE.close()
+    app_logging.stop()
+
+
+# Every route is scored by a WSGI middleware before Flask sees the request (see
+# detection_middleware.py): the query string and the first DETECTION_MAX_BODY
+# bytes of the body. With DETECTION_BLOCK=1 requests the model flags get a 403
+# and an alert; otherwise the verdict is only attached to the request
+# (environ['sqli.verdict']) and alerts are written for routes that do not log
+# their own. The admin analysis form and streaming endpoints are not scored.
+DETECTION_MIDDLEWARE = os.environ.get('DETECTION_MIDDLEWARE', '1') == '1'
+DETECTION_BLOCK = os.environ.get('DETECTION_BLOCK', '0') == '1'
+DETECTION_MAX_BODY = int(os.environ.get('DETECTION_MAX_BODY', MAX_BODY))
+DETECTION_EXEMPT = ('/static/', '/metrics', '/api/stream', '/api/bulk-score', '/api/http-request')
+# Views that score and log the body themselves
+SELF_LOGGED_PATHS = {'/api/login'}
+MIDDLEWARE_TOTAL = METRICS.counter('middleware_requests_total',
+                                   'Requests seen by the detection middleware, by outcome.', ['outcome'])
+
+
+def _middleware_analyze(text):
+    verdict = analyze_body(text)
+    detail = 'detected by ML' if verdict.classification == 'bad' else ''
+    if verdict.matches:
+        detail = (detail + '; ' if detail else '') + 'rules: ' + describe(verdict.matches)
+    return verdict.classification == 'bad', detail
+
+
+def _on_middleware_verdict(environ, verdict, blocked):
+    if not verdict['scored']:
+        MIDDLEWARE_TOTAL.inc('clean')
+        return
+    MIDDLEWARE_TOTAL.inc('blocked' if blocked else 'bad' if verdict['bad'] else 'scored')
+    path = environ.get('PATH_INFO', '')
+    if verdict['bad'] and (blocked or path not in SELF_LOGGED_PATHS):
+        notes = ('blocked' if blocked else 'flagged') + f" by middleware ({verdict['part']}); {verdict['detail']}"
+        EVENT_LOG.write('alerts', [datetime.now().isoformat(), path, verdict['text'], 'bad', notes])
+
+
+if DETECTION_MIDDLEWARE:
+    app.wsgi_app = DetectionMiddleware(app.wsgi_app, _middleware_analyze, block=DETECTION_BLOCK,
+                                       max_body=DETECTION_MAX_BODY, exempt_prefixes=DETECTION_EXEMPT,
+                                       on_verdict=_on_middleware_verdict,
+                                       prefilter=Prefilter(r.pattern for r in get_scanner().rules)
+                                       if get_scanner().rules else None)
 
 
 @app.route('/')
@@ -76,47 +454,64 @@ def index():
 @app.route('/api/login', methods=['POST'])
 def login():
     try:
+        started = time.perf_counter()
         # Capture raw request body exactly as received by the server
         raw_request = request.get_data(as_text=True)
-        print('DEBUG RAW_REQUEST:', raw_request)
 
-        # Parse username/password from the raw body only for session/auth purposes
-        parsed = {}
-        try:
-            for pair in raw_request.split('&'):
-                if '=' in pair:
-                    k, v = pair.split('=', 1)
-                    parsed[k] = v
-        except Exception:
-            parsed = {}
-
-        username = parsed.get('username', '').strip()
-        password = parsed.get('password', '').strip()
+        # Parse username/password (form or JSON body) only for session/auth purposes
+        parsed = parse_body(raw_request, request.content_type)
+        username = str(parsed.get('username', '')).strip()
+        password = str(parsed.get('password', '')).strip()
         timestamp = datetime.now().isoformat()
 
         # Build the body string exactly as received (do NOT sanitize/modify)
         body = raw_request if raw_request else f'username={username}&password={password}'
-
-        # Classification logic: check if credentials match the actual admin credentials
-        # If they match admin/admin123, mark as 'good'; otherwise mark as 'bad'
-        classification = 'good' if (username == 'admin' and password == 'admin123') else 'bad'
-        print('DEBUG ML_CLASSIFICATION:', classification, 'credentials_match:', username == 'admin' and password == 'admin123')
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'parse')
+
+        # Count the attempt against the client IP and the username
+        client_ip = request.remote_addr or ''
+        velocity = RATES.hit(client_ip, username) if RATES is not None else NO_VELOCITY
+
+        # Classification logic: score the raw body with the ML model. Without a model,
+        # fall back to the credential rule (admin/admin123 is 'good', anything else 'bad')
+        verdict = analyze_body(body, velocity)
+        classification = verdict.classification
+        if classification is None:
+            classification = 'good' if (username == 'admin' and password == 'admin123') else 'bad'
+        STREAM.publish('verdict', {'timestamp': timestamp, 'endpoint': '/api/login', 'classification': classification})
+        LOG.debug('login user=%r body_bytes=%d classification=%s probability=%s rules=%d velocity=%s',
+                  username, len(body), classification, verdict.probability, len(verdict.matches), tuple(velocity))
 
         # Log the request and dataset with the classifier result (good/bad)
-        with open(REQUEST_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, 'POST', '/api/login', body])
+        logged = time.perf_counter()
+        EVENT_LOG.write('requests', [timestamp, 'POST', '/api/login', body])
 
         # Append to training dataset with the classifier label so we keep raw payloads
-        with open(LOGIN_DATASET_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['POST', '/login', body, 0, 0, 0, 0, 0, 0, classification])
-
-        # If malicious, also add to a detected alerts file for later review
-        if classification == 'bad':
-            with open(DETECTED_ALERTS_CSV, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([timestamp, '/api/login', body, 'bad', 'detected by ML'])
+        seen = record_dataset_row('POST', '/login', body, classification, velocity)
+
+        # If malicious (or any signature rule fired, or the source crossed a rate
+        # limit), also add to a detected alerts file for later review; the notes
+        # list the rules hit and their offsets, the limits crossed, and how often
+        # the payload has been seen before when it is a replay
+        matches = verdict.matches
+        violations = RATES.violations(client_ip, username, velocity) if RATES is not None else []
+        if classification == 'bad' or matches or violations:
+            if classification == 'bad':
+                notes = 'detected by ML'
+            else:
+                notes = 'signature match' if matches else 'rate limit'
+            ALERTS_TOTAL.inc(notes)
+            if matches:
+                notes += '; rules: ' + describe(matches)
+            if violations:
+                notes += '; velocity: ' + ', '.join(violations)
+            if seen > 1:
+                notes += f'; seen {seen} times'
+            EVENT_LOG.write('alerts', [timestamp, '/api/login', body, classification, notes])
+        finished = time.perf_counter()
+        STAGE_SECONDS.observe(finished - logged, 'log')
+        REQUEST_SECONDS.observe(finished - started, '/api/login')
+        REQUESTS_TOTAL.inc('/api/login', classification)
 
         # If configured to accept any credentials, create admin session (we already logged above)
         if ALLOW_ANY_LOGIN:
@@ -140,7 +535,7 @@ def login():
         return jsonify({'success': False, 'message': 'Invalid credentials', 'classification': classification}), 401
 
     except Exception as e:
-        print('Error during login processing:', e)
+        LOG.exception('Error during login processing: %s', e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -156,21 +551,9 @@ def get_dashboard_data():
     if 'user' not in session or session.get('role') != 'admin':
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     try:
-        # Read HTTP requests from CSV
-        requests_data = []
-        if os.path.exists(REQUEST_CSV):
-            with open(REQUEST_CSV, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                requests_data = list(reader)[-10:] if reader else []
-
-        # Read login dataset
-        dataset_stats = {'total': 0, 'good': 0, 'bad': 0}
-        if os.path.exists(LOGIN_DATASET_CSV):
-            with open(LOGIN_DATASET_CSV, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                dataset_stats['total'] = len(lines)
-                dataset_stats['good'] = sum(1 for line in lines if 'good' in line)
-                dataset_stats['bad'] = sum(1 for line in lines if 'bad' in line)
+        # Served from in-memory counters and ring buffer (under serve.py the
+        # latest requests come from storage, which every worker writes to)
+        dataset_stats, requests_data = STATS.snapshot(DASHBOARD_RECENT_LIMIT)
 
         return jsonify({
             'success': True,
@@ -181,6 +564,59 @@ def get_dashboard_data():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/stream')
+def dashboard_stream():
+    """Server-sent events: a snapshot, then requests, verdicts, alerts and counter updates as they happen."""
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    subscriber = STREAM.subscribe()
+    if subscriber is None:
+        return jsonify({'success': False, 'message': 'Too many dashboard streams'}), 503
+    # Subscribed first, so nothing written after the snapshot is missed
+    dataset_stats, requests_data = STATS.snapshot(DASHBOARD_RECENT_LIMIT)
+    snapshot = format_event('snapshot', {'dataset_stats': dataset_stats, 'recent_requests': requests_data})
+    return Response(stream_with_context(STREAM.frames(subscriber, [snapshot])), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/requests')
+def get_requests_page():
+    """Page backwards through http_requests.csv: ?limit=N&before=<cursor from the previous page>."""
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), REQUESTS_PAGE_MAX)
+        before = request.args.get('before', type=int)
+        # Rows still queued in the log writer show up on the next call
+        records, cursor = STORAGE.recent('requests', limit, before=before)
+        return jsonify({
+            'success': True,
+            'requests': [dict(zip(REQUEST_FIELDS, row)) for row in reversed(records)],
+            'next_before': cursor,
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/alerts')
+def get_alerts():
+    """Alerts newest first, filtered by ?since=&until= (ISO timestamps), ?hours=, ?classification= and ?endpoint=."""
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), ALERTS_PAGE_MAX)
+        since = request.args.get('since')
+        hours = request.args.get('hours', type=float)
+        if hours is not None:
+            since = (datetime.now() - timedelta(hours=hours)).isoformat()
+        filters = {name: request.args[name] for name in ('classification', 'endpoint') if request.args.get(name)}
+        alerts = STORAGE.query('alerts', since=since, until=request.args.get('until'), limit=limit, **filters)
+        total = STORAGE.count('alerts', since=since, until=request.args.get('until'), **filters)
+        return jsonify({'success': True, 'alerts': alerts, 'total': total}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @app.route('/api/logout', methods=['POST'])
 def logout():
     session.clear()
@@ -197,22 +633,150 @@ def submit_http_request():
         url = data.get('url', '')
         body = data.get('body', '')
         timestamp = datetime.now().isoformat()
+        started = time.perf_counter()
+        classification = analyze_body(body).classification or 'unknown'
+        STREAM.publish('verdict', {'timestamp': timestamp, 'endpoint': url, 'classification': classification})
 
         # Save to CSV
-        with open(REQUEST_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, method, url, body])
+        logged = time.perf_counter()
+        EVENT_LOG.write('requests', [timestamp, method, url, body])
 
         # Also append to the main login_dataset.csv for training
-        with open(LOGIN_DATASET_CSV, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([method, url, body, 0, 0, 0, 0, 0, 0, 'unknown'])
+        record_dataset_row(method, url, body, classification)
+        finished = time.perf_counter()
+        STAGE_SECONDS.observe(finished - logged, 'log')
+        REQUEST_SECONDS.observe(finished - started, '/api/http-request')
+        REQUESTS_TOTAL.inc('/api/http-request', classification)
 
-        return jsonify({'success': True, 'message': 'HTTP Request recorded successfully'}), 200
+        return jsonify({'success': True, 'message': 'HTTP Request recorded successfully', 'classification': classification}), 200
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def _bulk_verdicts(lines):
+    """Score NDJSON records chunk by chunk, yielding one NDJSON verdict line per record."""
+    chunk = []
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        chunk.append((index, line))
+        index += 1
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            yield _score_bulk_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield _score_bulk_chunk(chunk)
+
+
+def _score_bulk_chunk(chunk):
+    bundle = REGISTRY.current()
+    records = []
+    out = {}
+    for index, line in chunk:
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('record must be a JSON object')
+            records.append((index, record))
+        except ValueError as e:
+            out[index] = {'i': index, 'error': str(e)}
+
+    if records:
+        # Identical bodies inside a chunk are scored once
+        bodies = [str(r.get('body', '')) for _, r in records]
+        unique = list(dict.fromkeys(bodies))
+        started = time.perf_counter()
+        X = extract_features_batch(unique, bundle.feature_cols, ngram=bundle.ngram)
+        scored = time.perf_counter()
+        probs = dict(zip(unique, bad_probability(bundle.batch_model, X, bundle.feature_cols).tolist()))
+        STAGE_SECONDS.observe(scored - started, 'bulk_features')
+        STAGE_SECONDS.observe(time.perf_counter() - scored, 'bulk_score')
+        timestamp = datetime.now().isoformat()
+        n_bad = 0
+        for (index, record), body in zip(records, bodies):
+            probability = probs[body]
+            classification = 'bad' if probability >= BAD_THRESHOLD else 'good'
+            n_bad += classification == 'bad'
+            verdict = {'i': index, 'classification': classification, 'probability': round(probability, 4)}
+            if 'id' in record:
+                verdict['id'] = record['id']
+            out[index] = verdict
+            if classification == 'bad':
+                EVENT_LOG.write('alerts', [timestamp, str(record.get('url', '')), body, 'bad', 'detected by ML (bulk)'])
+        REQUESTS_TOTAL.inc('/api/bulk-score', 'bad', amount=n_bad)
+        REQUESTS_TOTAL.inc('/api/bulk-score', 'good', amount=len(records) - n_bad)
+        if n_bad:
+            ALERTS_TOTAL.inc('detected by ML (bulk)', amount=n_bad)
+
+    return ''.join(json.dumps(out[index]) + '\n' for index, _ in chunk)
+
+
+@app.route('/api/bulk-score', methods=['POST'])
+def bulk_score():
+    """Score newline-delimited JSON {method,url,body[,id]} records, streaming verdicts back.
+
+    The request body is read line by line while verdicts are written, so neither
+    side is ever held in memory as a whole. Authorized by an admin session or by
+    an `X-Ingest-Token` header matching INGEST_TOKEN.
+    """
+    token = request.headers.get('X-Ingest-Token')
+    authorized = (INGEST_TOKEN and token and secrets.compare_digest(token, INGEST_TOKEN)) or \
+        ('user' in session and session.get('role') == 'admin')
+    if not authorized:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    if REGISTRY.current() is None:
+        return jsonify({'success': False, 'message': 'No model loaded'}), 503
+
+    lines = (raw.decode('utf-8', 'replace') for raw in request.stream)
+    return Response(stream_with_context(_bulk_verdicts(lines)), mimetype='application/x-ndjson')
+
+
+@app.route('/api/model', methods=['GET'])
+def model_status():
+    """Active and previous model, plus the outcome of the last reload (admin only)."""
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    return jsonify({'success': True, **REGISTRY.status()}), 200
+
+
+@app.route('/api/model/reload', methods=['POST'])
+def model_reload():
+    """Load the artifacts on disk in the background; poll /api/model for the result."""
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    started = REGISTRY.reload_async()
+    message = 'Reload started' if started else 'A reload is already running'
+    return jsonify({'success': True, 'message': message, **REGISTRY.status()}), 202
+
+
+@app.route('/api/model/rollback', methods=['POST'])
+def model_rollback():
+    if 'user' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    if REGISTRY.rollback() is None:
+        return jsonify({'success': False, 'message': 'No previous model to roll back to'}), 409
+    return jsonify({'success': True, **REGISTRY.status()}), 200
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the counters, latency histograms and gauges."""
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
+
+_startup_phase('setup')
+LOG.info('Started in %.0f ms (%s); heavy modules loaded: %s',
+         sum(STARTUP_SECONDS.values()) * 1000,
+         ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in STARTUP_SECONDS.items()),
+         ', '.join(m for m in HEAVY_MODULES if m in sys.modules) or 'none')
+
 if __name__ == '__main__':
+    # Development server, one process; serve.py runs several workers
     app.run(debug=False, port=5000)
 
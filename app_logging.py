@@ -0,0 +1,74 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+# Logging for app.py. Records go through a QueueHandler, so a request thread only
+# enqueues them; one listener thread does the formatting and the stderr writes.
+# DEBUG records are additionally sampled (LOG_SAMPLE_RATE), which keeps per-request
+# debug lines affordable when they are switched on in production. Modules used
+# by the app log to children of the 'app' logger ('app.event_log', ...), whose
+# records propagate to the same queue; elsewhere (train_model.py, Streamlit)
+# their warnings reach stderr through logging's last-resort handler.
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# (QueueHandler, QueueListener) pairs set up by configure(), for after_fork()
+_QUEUES = []
+
+
+class SampleFilter(logging.Filter):
+    """Let through every record at INFO and above, and `rate` of the DEBUG ones."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+def configure(name='app', level='INFO', sample_rate=0.01):
+    """Return the named logger, writing asynchronously to stderr."""
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    logger.propagate = False
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(SampleFilter(sample_rate))
+    logger.addHandler(handler)
+
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    _QUEUES.append((handler, listener))
+    return logger
+
+
+def _stop_listener(listener):
+    if listener._thread is not None:
+        listener.stop()
+
+
+def after_fork():
+    """Give each listener a fresh queue and thread in a forked child."""
+    for handler, listener in _QUEUES:
+        handler.queue = listener.queue = queue.SimpleQueue()
+        listener._thread = None
+        listener.start()
+
+
+def stop():
+    """Flush and stop the listeners (a worker leaving through os._exit skips atexit).
+
+    Safe to call again, so a gunicorn worker that exits through sys.exit does
+    not fail in the atexit handler.
+    """
+    for _, listener in _QUEUES:
+        _stop_listener(listener)
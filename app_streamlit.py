@@ -1,8 +1,16 @@
 import streamlit as st
 import pandas as pd
-import joblib
+import numpy as np
+import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from columnar_store import DATASET_STORE, ColumnarDataset
+from dashboard_stats import REQUEST_FIELDS, DatasetSummary
+from dataset_sink import DatasetDeduper, append_dataset_row
+from features import extract_features
+from model_registry import load_model_files
+from storage import STORAGE_DB_PATH, CsvStorage, open_storage
 
 # Page configuration
 st.set_page_config(
@@ -40,49 +48,85 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Load trained model
+# Load trained model: the compiled forest when there is one, so sklearn is only
+# imported when the pickle is the newest (or only) artifact
 @st.cache_resource
 def load_model():
-    if os.path.exists('login_classifier.pkl'):
-        model = joblib.load('login_classifier.pkl')
-        feature_cols = joblib.load('feature_columns.pkl')
-        return model, feature_cols
-    return None, None
-
-# Extract features from HTTP request body
-def extract_features(body):
-    features = {
-        'body_length': len(str(body)),
-        'has_special_chars': 1 if any(c in str(body) for c in ["'", '"', '-', ';', '*']) else 0,
-        'has_sql_keywords': 1 if any(kw in str(body).lower() for kw in ['union', 'select', 'drop', 'insert', 'update', 'delete', 'exec', 'script']) else 0,
-        'has_path_traversal': 1 if '..' in str(body) else 0,
-        'body_contains_slash': str(body).count('/'),
-        'f1': 0,
-        'f2': 0,
-        'f3': 0,
+    loaded = load_model_files()
+    if loaded is None:
+        return None, None
+    return loaded[0], loaded[1]
+
+# Test scores of the saved model, written by train_model.py (None if it has not run
+# since model_report.json was introduced)
+def load_model_report():
+    if not os.path.exists('model_report.json'):
+        return None
+    with open('model_report.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def percent(value):
+    return f"{value * 100:.1f}%" if value is not None else "n/a"
+
+# Dedup filter in front of login_dataset.csv (see dataset_sink.py). Built from
+# the CSV once per Streamlit server; the Flask app keeps its own filter
+@st.cache_resource
+def load_dataset_filter():
+    dataset_filter = DatasetDeduper('login_dataset.csv')
+    dataset_filter.load()
+    return dataset_filter
+
+# The same flock-guarded appender app.py's event log writes the dataset with
+@st.cache_resource
+def load_dataset_storage():
+    return CsvStorage({'dataset': 'login_dataset.csv'})
+
+# Request history and alerts, on the backend app.py writes to (STORAGE_BACKEND).
+# With 'sqlite' the filters below are index lookups; with 'csv' they scan the file.
+@st.cache_resource
+def load_storage():
+    return open_storage(os.environ.get('STORAGE_BACKEND', 'csv'),
+                        {'requests': 'http_requests.csv', 'alerts': 'detected_alerts.csv'},
+                        db_path=os.environ.get('STORAGE_DB_PATH', STORAGE_DB_PATH))
+
+# Running counts over login_dataset.csv. Streamlit reruns this script on every
+# interaction; the object survives reruns and only parses bytes appended since
+# the previous one (see dashboard_stats.DatasetSummary)
+@st.cache_resource
+def load_dataset_tracker():
+    return DatasetSummary('login_dataset.csv')
+
+@st.cache_resource
+def load_columnar_store():
+    return ColumnarDataset(DATASET_STORE)
+
+# Computed once per data version (the arguments), not once per rerun
+@st.cache_data(max_entries=4)
+def columnar_summary(store_path, rows):
+    store = ColumnarDataset(store_path)
+    label_counts = pd.Series(store.label_counts())
+    return {
+        'total': len(store),
+        'label_counts': label_counts[label_counts > 0],
+        'sql_count': int(sum(np.count_nonzero(seg.column('has_sql_keywords')) for seg in store.segments)),
     }
-    return features
-
-# Load HTTP requests from CSV
-def load_requests_from_csv():
-    if os.path.exists('http_requests.csv'):
-        try:
-            df = pd.read_csv('http_requests.csv')
-            return df
-        except:
-            return pd.DataFrame()
-    return pd.DataFrame()
-
-# Load login_dataset.csv
-def load_login_dataset():
-    if os.path.exists('login_dataset.csv'):
-        try:
-            df = pd.read_csv('login_dataset.csv', header=None)
-            df.columns = ['method', 'endpoint', 'body', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'label']
-            return df
-        except:
-            return pd.DataFrame()
-    return pd.DataFrame()
+
+@st.cache_data(max_entries=4)
+def csv_summary(path, version):
+    summary = load_dataset_tracker().snapshot()
+    summary['label_counts'] = pd.Series(summary['label_counts'], dtype=int).sort_values(ascending=False)
+    return summary
+
+# Totals for the Statistics and History pages. With a columnar store
+# (columnar_store.py) only the label and has_sql_keywords columns are read;
+# otherwise the CSV's appended records are folded into running counts.
+def load_dataset_summary():
+    if os.path.isdir(DATASET_STORE):
+        store = load_columnar_store()
+        if os.path.exists('login_dataset.csv'):
+            store.sync('login_dataset.csv')
+        return columnar_summary(DATASET_STORE, len(store))
+    return csv_summary('login_dataset.csv', load_dataset_tracker().refresh())
 
 # Main App
 st.markdown("# 🔐 Login Security Classifier")
@@ -114,10 +158,8 @@ else:
         
         if st.button("🔎 Classify", key="classify_btn"):
             if method and url and body:
-                # Extract features from body
+                # Base features of the body, shown in the Feature Analysis panel
                 features_dict = extract_features(body)
-                features_df = pd.DataFrame([features_dict])
-                features_df = features_df[feature_cols]
 
                 # Parse username/password from body (do not sanitize — match backend behavior)
                 parsed = {}
@@ -171,18 +213,15 @@ else:
 
                 # Save to history
                 if st.button("💾 Save to History"):
-                    with open('http_requests.csv', 'a') as f:
-                        import csv
-                        writer = csv.writer(f)
-                        writer.writerow([datetime.now().isoformat(), method, url, body])
+                    load_storage().append('requests', [[datetime.now().isoformat(), method, url, body]])
                     st.success("✅ Request saved to history!")
 
-                # Also append to login_dataset.csv
-                with open('login_dataset.csv', 'a') as f:
-                    import csv
-                    writer = csv.writer(f)
-                    label = "good" if prediction == 0 else "bad"
-                    writer.writerow([method, url, body, 0, 0, 0, 0, 0, 0, label])
+                # Also append to login_dataset.csv, unless this body was already
+                # recorded with the same label (every rerun of the page lands here)
+                label = "good" if prediction == 0 else "bad"
+                dataset_filter = load_dataset_filter()
+                dataset_filter.sync()
+                append_dataset_row(load_dataset_storage(), dataset_filter, method, url, body, label)
 
             else:
                 st.warning("⚠️ Please enter all fields: Method, URL, and Body")
@@ -190,43 +229,62 @@ else:
     elif page == "View History":
         st.subheader("📜 HTTP Requests History")
         
-        requests_df = load_requests_from_csv()
-        dataset_df = load_login_dataset()
+        storage = load_storage()
+        # Only the last 20 records are read (from the end of the file, or by row id)
+        records, _ = storage.recent('requests', 20)
+        requests_df = pd.DataFrame(records, columns=REQUEST_FIELDS)
+        summary = load_dataset_summary()
 
         col1, col2 = st.columns([1, 1])
 
         with col1:
-            st.write(f"**Total Saved Requests:** {len(requests_df)}")
+            st.write(f"**Latest Saved Requests:** {len(requests_df)}")
             if len(requests_df) > 0:
-                st.dataframe(requests_df.tail(20), use_container_width=True)
+                st.dataframe(requests_df, use_container_width=True)
+
+        with col2:
+            st.write(f"**Total Dataset Records:** {summary['total']}")
+            if summary['total'] > 0:
+                st.bar_chart(summary['label_counts'])
 
+        st.subheader("🚨 Alerts")
+        col1, col2 = st.columns(2)
+        with col1:
+            window = st.selectbox("Time range", ["Last hour", "Last 24 hours", "Last 7 days", "All time"])
         with col2:
-            st.write(f"**Total Dataset Records:** {len(dataset_df)}")
-            if len(dataset_df) > 0:
-                label_counts = dataset_df['label'].value_counts()
-                st.bar_chart(label_counts)
+            verdict = st.selectbox("Classification", ["bad", "good", "Any"])
+        hours = {"Last hour": 1, "Last 24 hours": 24, "Last 7 days": 24 * 7}.get(window)
+        since = (datetime.now() - timedelta(hours=hours)).isoformat() if hours else None
+        filters = {} if verdict == "Any" else {'classification': verdict}
+        st.write(f"**Matching Alerts:** {storage.count('alerts', since=since, **filters)}")
+        alerts = storage.query('alerts', since=since, limit=100, **filters)
+        if alerts:
+            st.dataframe(pd.DataFrame(alerts), use_container_width=True)
 
     elif page == "Statistics":
         st.subheader("📊 Dataset Statistics")
 
-        dataset_df = load_login_dataset()
+        summary = load_dataset_summary()
+        total = summary['total']
 
-        if len(dataset_df) > 0:
+        if total > 0:
             col1, col2, col3, col4 = st.columns(4)
 
             with col1:
-                st.metric("Total Records", len(dataset_df))
+                st.metric("Total Records", total)
 
             with col2:
-                good_count = len(dataset_df[dataset_df['label'] == 'good'])
-                st.metric("Legitimate Logins", good_count, delta=f"{good_count/len(dataset_df)*100:.1f}%")
+                good_count = int(summary['label_counts'].get('good', 0))
+                st.metric("Legitimate Logins", good_count, delta=f"{good_count/total*100:.1f}%")
 
             with col3:
-                bad_count = len(dataset_df[dataset_df['label'] == 'bad'])
-                st.metric("Suspicious Logins", bad_count, delta=f"{bad_count/len(dataset_df)*100:.1f}%")
+                bad_count = int(summary['label_counts'].get('bad', 0))
+                st.metric("Suspicious Logins", bad_count, delta=f"{bad_count/total*100:.1f}%")
 
             with col4:
-                st.metric("Model Accuracy", "100%")
+                report = load_model_report() or {}
+                st.metric("Model Accuracy", percent(report.get('test_accuracy')),
+                          help="Accuracy on the held-out test split when the model was trained")
 
             st.markdown("---")
 
@@ -235,15 +293,14 @@ else:
 
             with col1:
                 st.subheader("Distribution of Login Types")
-                label_counts = dataset_df['label'].value_counts()
-                st.bar_chart(label_counts)
+                st.bar_chart(summary['label_counts'])
 
             with col2:
                 st.subheader("Feature Analysis")
                 st.write("**SQL Keywords in Credentials:**")
-                sql_count = len(dataset_df[dataset_df['body'].str.contains('union|select|drop|insert|update|delete|exec|script', case=False, na=False)])
+                sql_count = summary['sql_count']
                 st.write(f"- Detected: {sql_count}")
-                st.write(f"- Clean: {len(dataset_df) - sql_count}")
+                st.write(f"- Clean: {total - sql_count}")
 
     elif page == "About":
         st.subheader("ℹ️ About This Application")
@@ -266,11 +323,6 @@ else:
         - **Path Traversal:** Detection of directory traversal attempts (..)
         - **Slashes:** Count of forward slashes (/)
 
-        #### Model Performance
-        - **Training Accuracy:** 100%
-        - **Test Accuracy:** 100%
-        - **Algorithm:** Random Forest Classifier
-
         #### How to Use
         1. Select an HTTP method (GET, POST, PUT, DELETE, etc.)
         2. Enter the URL/endpoint path
@@ -282,6 +334,24 @@ else:
         All HTTP requests are stored locally in `http_requests.csv` and are not shared with external services.
         """)
 
+        st.markdown("#### Model Performance")
+        report = load_model_report()
+        if report is None:
+            st.write("No model report yet. Run `python train_model.py` to write `model_report.json`.")
+        else:
+            st.markdown(f"""
+            - **Training Accuracy:** {percent(report['train_accuracy'])}
+            - **Test Accuracy:** {percent(report['test_accuracy'])}
+            - **Test Recall (bad):** {percent(report['test_recall'])}
+            - **Algorithm:** {report['model']} (trained {report['created']}, mode `{report['mode']}`)
+            """)
+            if 'search' in report:
+                search = report['search']
+                st.write(f"Model search: {search['folds']}-fold cross-validation, recall floor "
+                         f"{search['min_recall']}, selected **{search['selected']}**")
+                st.dataframe(pd.DataFrame(search['candidates']).drop(columns=['kind', 'params']),
+                             use_container_width=True)
+
         st.info("🔒 This is a demonstration application. In production, implement proper security measures.")
 
     st.markdown("---")
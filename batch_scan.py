@@ -0,0 +1,259 @@
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from columnar_store import _complete_prefix
+from compiled_forest import COMPILED_MODEL_PATH
+from features import extract_features_batch
+from inference import bad_probability
+from model_registry import MODEL_PATH, load_batch_model, load_model_files
+from ngram_hashing import load_ngram_model
+
+# Offline scanner for historical traffic. The input is cut into byte ranges that
+# start and end on record boundaries; a pool of worker processes scores the
+# ranges independently (each loads the model once) and the parent appends their
+# output in input order. Workers read their range in BLOCK_BYTES pieces, so memory
+# stays bounded by (workers x BLOCK_BYTES) whatever the input size.
+#
+# Formats:
+#   csv     http_requests.csv rows: timestamp,method,url,body (header optional)
+#   ndjson  one {"timestamp","method","url","body"} object per line
+#   access  Common/Combined Log Format lines; the query string is scored as the body
+FORMATS = ['csv', 'ndjson', 'access']
+ALERT_HEADER = ['timestamp', 'endpoint', 'raw_body', 'classification', 'notes']
+
+CHUNK_BYTES = 64 * 1024 * 1024
+BLOCK_BYTES = 8 * 1024 * 1024
+BAD_THRESHOLD = 0.5
+
+_ACCESS_RE = re.compile(r'^\S+ \S+ \S+ \[([^\]]*)\] "(\S+) (\S+)[^"]*"')
+
+# Per-process state set up by _init_worker
+_MODEL = None
+_FEATURE_COLS = None
+_NGRAM = None
+
+
+def load_model(path=None):
+    """(model, feature_columns) chosen as the server chooses them (model_registry.load_model_files).
+
+    `path` replaces the default .npz or .pkl artifact; the staleness and format
+    version checks between the two still apply. Like /api/bulk-score, batches
+    go to the pickle when the compiled forest is slower at them.
+    """
+    compiled_path, model_path = COMPILED_MODEL_PATH, MODEL_PATH
+    if path is not None and path.endswith('.npz'):
+        compiled_path = path
+    elif path is not None:
+        model_path = path
+    loaded = load_model_files(compiled_path=compiled_path, model_path=model_path)
+    if loaded is None:
+        raise FileNotFoundError('No model artifacts found; run train_model.py first')
+    model, feature_cols = loaded[:2]
+    return load_batch_model(model, feature_cols, compiled_path, model_path), feature_cols
+
+
+def _has_header(path):
+    with open(path, 'rb') as f:
+        return f.readline().startswith(b'timestamp,')
+
+
+def chunk_ranges(path, fmt, chunk_bytes=CHUNK_BYTES, block_bytes=BLOCK_BYTES):
+    """Yield (start, end) byte ranges of about `chunk_bytes` cut on record boundaries.
+
+    NDJSON and access logs are cut at the first newline past each target offset.
+    CSV bodies may hold quoted newlines, so a newline only ends a record when the
+    number of quotes before it is even; that needs one sequential pass counting
+    quotes, which runs at memory speed and holds one block at a time.
+    """
+    size = os.path.getsize(path)
+    start = 0
+    if fmt == 'csv' and _has_header(path):
+        with open(path, 'rb') as f:
+            start = len(f.readline())
+    with open(path, 'rb') as f:
+        quotes = 0  # quotes in [0, block_start)
+        block_start = start
+        f.seek(start)
+        block = f.read(block_bytes)
+        target = start + chunk_bytes
+        while target < size:
+            # Bring the block up to the target offset
+            while block_start + len(block) <= target:
+                if fmt == 'csv':
+                    quotes += block.count(b'"')
+                block_start += len(block)
+                block = f.read(block_bytes)
+            pos = target - block_start
+            cut = None
+            while cut is None:
+                nl = block.find(b'\n', pos)
+                if nl < 0:
+                    more = f.read(block_bytes)
+                    if not more:
+                        break
+                    pos = len(block)
+                    block += more
+                    continue
+                if fmt != 'csv' or (quotes + block.count(b'"', 0, nl)) % 2 == 0:
+                    cut = block_start + nl + 1
+                pos = nl + 1
+            if cut is None or cut >= size:
+                break
+            yield start, cut
+            start = cut
+            target = cut + chunk_bytes
+        if start < size:
+            yield start, size
+
+
+def _parse_records(data, fmt):
+    """List of (timestamp, method, url, body) for the whole records in `data`."""
+    text = data.decode('utf-8', 'replace')
+    records = []
+    if fmt == 'csv':
+        for row in csv.reader(io.StringIO(text, newline='')):
+            if row:
+                row = (row + ['', '', '', ''])[:4]
+                records.append(tuple(row))
+    elif fmt == 'ndjson':
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(obj, dict):
+                records.append((str(obj.get('timestamp', '')), str(obj.get('method', '')),
+                                str(obj.get('url', '')), str(obj.get('body', ''))))
+    else:
+        for line in text.splitlines():
+            m = _ACCESS_RE.match(line)
+            if m:
+                parts = urlsplit(m.group(3))
+                records.append((m.group(1), m.group(2), parts.path, parts.query))
+    return records
+
+
+def _init_worker(model_path):
+    global _MODEL, _FEATURE_COLS, _NGRAM
+    _MODEL, _FEATURE_COLS = load_model(model_path)
+    _NGRAM = load_ngram_model(_FEATURE_COLS)
+
+
+def _scan_range(task):
+    """Score one byte range; returns (part_path, records, alerts)."""
+    path, fmt, start, end, out_dir, index, columnar, write_all, block_bytes = task
+    part_path = os.path.join(out_dir, f'part-{index:06d}')
+    total = alerts = 0
+    probs_parts = []
+    with open(path, 'rb') as f, open(part_path + '.csv', 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        f.seek(start)
+        pending = b''
+        offset = start
+        while offset < end or pending:
+            data = f.read(min(block_bytes, end - offset)) if offset < end else b''
+            if not data:
+                end = offset  # file shrank under us
+            offset += len(data)
+            pending += data
+            if offset < end:
+                usable = _complete_prefix(pending) if fmt == 'csv' else pending.rfind(b'\n') + 1
+                if usable == 0:
+                    continue
+            else:
+                usable = len(pending)
+            records = _parse_records(pending[:usable], fmt)
+            pending = pending[usable:]
+            if not records:
+                continue
+            bodies = [r[3] for r in records]
+            X = extract_features_batch(bodies, _FEATURE_COLS, ngram=_NGRAM)
+            probs = bad_probability(_MODEL, X, _FEATURE_COLS)
+            total += len(records)
+            bad = probs >= BAD_THRESHOLD
+            alerts += int(bad.sum())
+            if columnar:
+                probs_parts.append(probs.astype(np.float32))
+            for record, p, is_bad in zip(records, probs.tolist(), bad.tolist()):
+                if is_bad or write_all:
+                    writer.writerow([record[0], record[2], record[3], 'bad' if is_bad else 'good',
+                                     f'batch scan p={p:.4f}'])
+    if columnar:
+        np.save(part_path + '.npy', np.concatenate(probs_parts) if probs_parts else np.zeros(0, np.float32))
+    return part_path, total, alerts
+
+
+def scan(path, fmt='csv', output='detected_alerts.csv', columnar_dir=None, workers=None,
+         chunk_bytes=CHUNK_BYTES, block_bytes=BLOCK_BYTES, model_path=None, write_all=False):
+    """Score every record of `path`; appends alerts to `output` and returns (records, alerts)."""
+    workers = workers or os.cpu_count() or 1
+    # A worker whose initializer fails is replaced forever, so a missing model fails here
+    load_model(model_path)
+    tmp_dir = tempfile.mkdtemp(prefix='batch_scan-', dir=os.path.dirname(os.path.abspath(output)))
+    columnar = columnar_dir is not None
+    if columnar:
+        os.makedirs(columnar_dir, exist_ok=True)
+    tasks = ((path, fmt, start, end, tmp_dir, i, columnar, write_all, block_bytes)
+             for i, (start, end) in enumerate(chunk_ranges(path, fmt, chunk_bytes, block_bytes)))
+    total = alerts = 0
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    try:
+        with open(output, 'a', newline='', encoding='utf-8') as out, \
+                multiprocessing.Pool(workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+            if new_file:
+                csv.writer(out).writerow(ALERT_HEADER)
+            # imap keeps input order, so parts are merged as soon as the next one is done
+            for part_path, n, a in pool.imap(_scan_range, tasks):
+                with open(part_path + '.csv', 'r', newline='', encoding='utf-8') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(part_path + '.csv')
+                if columnar:
+                    os.replace(part_path + '.npy',
+                               os.path.join(columnar_dir, os.path.basename(part_path) + '.npy'))
+                total += n
+                alerts += a
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return total, alerts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score a historical request log with the trained model.')
+    parser.add_argument('path', help='input log file')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='input format (default: csv)')
+    parser.add_argument('--output', default='detected_alerts.csv', help='alerts CSV to append to')
+    parser.add_argument('--columnar', metavar='DIR',
+                        help='also write per-record bad probabilities as part-*.npy files in DIR')
+    parser.add_argument('--all', action='store_true', help='write every verdict, not only bad ones')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 2 ** 20,
+                        help='input bytes per work item (default: 64)')
+    parser.add_argument('--model', default=None,
+                        help='login_classifier.npz or .pkl to use instead of the default (same checks as app.py)')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    total, alerts = scan(args.path, args.format, args.output, args.columnar, args.workers,
+                         int(args.chunk_mb * 2 ** 20), model_path=args.model, write_all=args.all)
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0.0
+    print(f'Scanned {total} records in {elapsed:.1f}s ({rate:,.0f}/s); {alerts} flagged bad -> {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,544 @@
+import argparse
+import csv
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from generated_login_dataset import gen_bad_requests, gen_good_requests
+
+# Benchmarks for the detection hot path. Every case reports throughput, p50/p99
+# latency per operation and the peak Python heap (tracemalloc, NumPy included)
+# measured in a separate, shorter pass so tracing does not skew the timings.
+# Results are written as JSON and can be compared against a saved baseline:
+#
+#   python benchmark.py --quick --save-baseline        # record benchmark_baseline.json
+#   python benchmark.py --quick                        # compare against it
+#
+# The app-level cases run in a scratch directory holding copies of the model
+# artifacts, so the real CSV logs are never touched.
+RESULTS_PATH = 'benchmark_results.json'
+BASELINE_PATH = 'benchmark_baseline.json'
+ARTIFACTS = ['login_classifier.npz', 'login_classifier.pkl', 'feature_columns.pkl', 'ngram_model.npz',
+             'signatures.rules']
+DASHBOARD_SIZES = [10000, 1000000, 10000000]
+QUICK_DASHBOARD_SIZES = [10000, 100000]
+
+# Metrics compared against the baseline, and whether higher is better
+COMPARED = {'throughput': True, 'p50_us': False, 'p99_us': False, 'peak_mb': False}
+# (case, reference): the case must be at least as fast as the reference in the
+# same run. The compiled forest replaced sklearn, so its batch walk must keep up.
+MUST_KEEP_UP = [('score.compiled_batch_10k', 'score.sklearn_batch_10k')]
+
+
+def synthetic_rows(n, seed=1234):
+    """n login_dataset.csv rows from the dataset generators, half good and half bad, shuffled."""
+    random.seed(seed)
+    rows = gen_good_requests(n - n // 2) + gen_bad_requests(n // 2)
+    random.shuffle(rows)
+    return rows
+
+
+def print_result(name, result):
+    print(f"{name:<34} {result['throughput'] or 0:>14,.0f} items/s  p50 {result['p50_us']:>11,.1f}us  "
+          f"p99 {result['p99_us']:>11,.1f}us  peak {result['peak_mb']:>9,.2f}MB")
+
+
+def measure(name, op, iterations, items_per_op=1, memory_iterations=None, setup=None, quiet=False):
+    """Time `op` (called with the iteration index) and return (name, result record)."""
+    if setup is not None:
+        setup()
+    gc.collect()
+    latencies = np.empty(iterations, dtype=np.float64)
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for i in range(iterations):
+        t0 = perf_counter()
+        op(i)
+        latencies[i] = perf_counter() - t0
+    elapsed = perf_counter() - started
+
+    memory_iterations = min(iterations, memory_iterations or 200)
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    for i in range(memory_iterations):
+        op(i)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        'ops': iterations,
+        'items_per_op': items_per_op,
+        'seconds': round(elapsed, 6),
+        'throughput': round(iterations * items_per_op / elapsed, 2) if elapsed else None,
+        'p50_us': round(float(np.percentile(latencies, 50)) * 1e6, 3),
+        'p99_us': round(float(np.percentile(latencies, 99)) * 1e6, 3),
+        'peak_mb': round(peak / 2 ** 20, 3),
+    }
+    if not quiet:
+        print_result(name, result)
+    return name, result
+
+
+def bench_features(rows, results, n):
+    from features import extract_feature_vector, extract_features_batch
+
+    bodies = [r[2] for r in rows]
+    results.append(measure('features.single', lambda i: extract_feature_vector(bodies[i % len(bodies)]), n))
+    batch = bodies[:10000]
+    results.append(measure('features.batch_10k', lambda i: extract_features_batch(batch), max(3, n // 2000),
+                           items_per_op=len(batch), memory_iterations=2))
+
+    # Hashed character n-grams (the ngram_score column), with random weights:
+    # the cost does not depend on what the regression learned
+    from ngram_hashing import NGRAM_FEATURES, NgramScorer
+    ngram = NgramScorer(np.random.default_rng(0).normal(size=NGRAM_FEATURES), 0.0)
+    results.append(measure('features.ngram_single', lambda i: ngram.score(bodies[i % len(bodies)]), n))
+    results.append(measure('features.ngram_batch_10k', lambda i: ngram.score_batch(batch), max(3, n // 2000),
+                           items_per_op=len(batch), memory_iterations=2))
+
+
+def bench_scoring(rows, results, n):
+    from compiled_forest import CompiledForest
+    from features import FEATURE_COLUMNS, extract_features_batch
+    from inference import bad_probability
+
+    X = extract_features_batch([r[2] for r in rows], FEATURE_COLUMNS)
+    batch = X[:10000]
+    if os.path.exists('login_classifier.pkl'):
+        import joblib
+        import warnings
+        warnings.filterwarnings('ignore')
+        model = joblib.load('login_classifier.pkl')
+        cols = joblib.load('feature_columns.pkl')
+        results.append(measure('score.sklearn_single',
+                               lambda i: bad_probability(model, X[i % len(X):][:1], cols), max(20, n // 50)))
+        results.append(measure('score.sklearn_batch_10k', lambda i: bad_probability(model, batch, cols),
+                               max(3, n // 2000), items_per_op=len(batch), memory_iterations=2))
+    if os.path.exists('login_classifier.npz'):
+        compiled = CompiledForest.load('login_classifier.npz')
+        rows_list = X.tolist()
+        results.append(measure('score.compiled_single',
+                               lambda i: compiled.score_row(rows_list[i % len(rows_list)]), n))
+        results.append(measure('score.compiled_batch_10k', lambda i: compiled.predict_proba(batch),
+                               max(3, n // 2000), items_per_op=len(batch), memory_iterations=2))
+
+
+def app_cases(n):
+    """/api/login end to end and /api/dashboard-data through Flask's test client; [(name, result)]."""
+    import app as app_module
+
+    client = app_module.app.test_client()
+    bodies = [r[2] for r in synthetic_rows(20000)]
+    form = 'application/x-www-form-urlencoded'
+
+    def login(i):
+        client.post('/api/login', data=bodies[i % len(bodies)], content_type=form,
+                    environ_base={'REMOTE_ADDR': f'10.0.{i % 250}.{i % 199}'})
+
+    def login_repeated(i):
+        client.post('/api/login', data=bodies[0], content_type=form)
+
+    cases = [measure('app.login', login, n, quiet=True),
+             measure('app.login_repeated_body', login_repeated, n, quiet=True)]
+    cases.append(dashboard_data_case(client, 'app.dashboard_data', max(50, n // 10)))
+    return cases
+
+
+def dashboard_data_case(client, name, iterations):
+    """GET /api/dashboard-data as a logged-in admin; (name, result)."""
+    with client.session_transaction() as sess:
+        sess['user'] = 'bench'
+        sess['role'] = 'admin'
+    return measure(name, lambda i: client.get('/api/dashboard-data'), iterations, quiet=True)
+
+
+def dashboard_endpoint_cases(name, n):
+    """/api/dashboard-data against the logs already in the working directory; [(name, result)]."""
+    import app as app_module
+
+    return [dashboard_data_case(app_module.app.test_client(), name, n)]
+
+
+# Run in a fresh interpreter so app's atexit handler (checkpoint, dedup state)
+# fires inside the scratch directory and never in the caller's working tree
+APP_SCRIPT = '''
+import json, sys
+import benchmark
+print(json.dumps(benchmark.app_cases(int(sys.argv[1]))))
+'''
+
+# Same, for the dashboard endpoint at one log size (app.py reads the logs when imported)
+DASHBOARD_SCRIPT = '''
+import json, sys
+import benchmark
+print(json.dumps(benchmark.dashboard_endpoint_cases(sys.argv[1], int(sys.argv[2]))))
+'''
+
+
+def _run_app_cases(results, script, *args, **env):
+    """Run `script` in the scratch directory and collect the cases it prints as JSON."""
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), **env)
+    out = subprocess.run([sys.executable, '-c', script, *map(str, args)], capture_output=True, text=True,
+                         check=True, env=env, cwd=os.getcwd())
+    cases = [tuple(case) for case in json.loads(out.stdout.strip().splitlines()[-1])]
+    for name, result in cases:
+        print_result(name, result)
+    results.extend(cases)
+
+
+def bench_app(rows, results, n):
+    """/api/login end to end and /api/dashboard-data, in a subprocess running in the scratch directory."""
+    _run_app_cases(results, APP_SCRIPT, n)
+
+
+# Run in a fresh interpreter: import app, then serve one login through the test client
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+app.app.test_client().post('/api/login', data='username=a&password=b',
+                           content_type='application/x-www-form-urlencoded')
+first_request = time.perf_counter() - started
+app._shutdown()
+print(json.dumps({'first_request': first_request, 'phases': app.STARTUP_SECONDS,
+                  'heavy': [m for m in app.HEAVY_MODULES if m in sys.modules]}))
+'''
+
+
+def bench_startup(rows, results, n):
+    """Cold start to the first /api/login, each run in a new interpreter."""
+    reports = []
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+
+    def start(i):
+        out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                             env=env)
+        reports.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    name, result = measure('startup.first_request', start, 3 if n <= 2000 else 10, memory_iterations=1)
+    report = reports[-1]
+    phases = ', '.join(f'{k} {v * 1000:.0f}ms' for k, v in report['phases'].items())
+    print(f"{'':<34} {phases}; heavy modules: {', '.join(report['heavy']) or 'none'}")
+    results.append((name, result))
+
+
+def _login_client(args):
+    """Post `count` logins over one keep-alive connection; (start, end, latencies)."""
+    import http.client
+
+    port, bodies, count = args
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t0 = time.perf_counter()
+        conn.request('POST', '/api/login', body=bodies[i % len(bodies)], headers=headers)
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - t0)
+    finished = time.perf_counter()
+    conn.close()
+    return started, finished, latencies
+
+
+def _pss_mb(pid):
+    """Proportional set size of a process (shared pages split between their users), Linux only."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def bench_serve(rows, results, n):
+    """Login throughput of serve.py over real HTTP with one worker and with one per CPU.
+
+    Clients run in their own processes, two per worker, so on a small machine
+    they compete with the server for the same cores. peak_mb is the summed PSS
+    of the parent and its workers: pages shared after fork count once overall.
+    """
+    import multiprocessing
+
+    cpus = os.cpu_count() or 1
+    bodies = [r[2] for r in rows]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')
+    for workers in sorted({1, max(2, cpus)}):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen([sys.executable, script, '--workers', str(workers), '--port', str(port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError('serve.py did not start')
+                    time.sleep(0.1)
+            clients = 2 * workers
+            per_client = max(50, n // clients)
+            with multiprocessing.get_context('fork').Pool(clients) as pool:
+                pool.map(_login_client, [(port, bodies, 10)] * clients)  # warm up every worker
+                runs = pool.map(_login_client, [(port, bodies[c::clients], per_client) for c in range(clients)])
+            children = subprocess.run(['pgrep', '-P', str(server.pid)], capture_output=True, text=True).stdout
+            pss = _pss_mb(server.pid) + sum(_pss_mb(int(pid)) for pid in children.split())
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+        elapsed = max(r[1] for r in runs) - min(r[0] for r in runs)
+        latencies = np.concatenate([r[2] for r in runs])
+        name = f'serve.login_{workers}_workers'
+        result = {
+            'ops': len(latencies),
+            'items_per_op': 1,
+            'seconds': round(elapsed, 6),
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_us': round(float(np.percentile(latencies, 50)) * 1e6, 3),
+            'p99_us': round(float(np.percentile(latencies, 99)) * 1e6, 3),
+            'peak_mb': round(pss, 3),
+        }
+        print_result(name, result)
+        results.append((name, result))
+
+
+def bench_event_log(rows, results, n):
+    from event_log import EventLogWriter
+    from storage import CsvStorage, SqliteStorage
+
+    for backend, path in (('csv', 'bench_log.csv'), ('sqlite', 'bench_log.db')):
+        storage = CsvStorage({'dataset': path}) if backend == 'csv' else SqliteStorage(path, tables=['dataset'])
+        writer = EventLogWriter()
+        writer.add_sink('dataset', storage)
+        name = 'event_log.write' if backend == 'csv' else 'event_log.write_sqlite'
+        results.append(measure(name, lambda i: writer.write('dataset', rows[i % len(rows)]), n * 10,
+                               memory_iterations=2000))
+        started = time.perf_counter()
+        writer.close()
+        drain = time.perf_counter() - started
+        storage.close()
+        size = os.path.getsize(path)
+        print(f"{'event_log.drain_' + backend:<34} {size / 2 ** 20:>10,.1f} MB written, drained in {drain * 1000:,.1f}ms")
+        for leftover in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def bench_alert_queries(rows, results, n):
+    """'Bad logins in the last hour' over 100k alerts, CSV scan vs SQLite index."""
+    from storage import CsvStorage, SqliteStorage
+
+    alerts = [[f'2025-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}', '/api/login',
+               rows[i % len(rows)][2], rows[i % len(rows)][-1], 'x'] for i in range(100000)]
+    for backend, path in (('csv', 'bench_alerts.csv'), ('sqlite', 'bench_alerts.db')):
+        storage = CsvStorage({'alerts': path}) if backend == 'csv' else SqliteStorage(path, tables=['alerts'])
+        storage.append('alerts', alerts)
+        results.append(measure(f'storage.bad_last_hour_{backend}',
+                               lambda i: storage.count('alerts', since='2025-01-01T23:00:00', classification='bad',
+                                                       endpoint='/api/login'),
+                               max(3, n // 2000) if backend == 'csv' else max(50, n // 20), memory_iterations=3))
+        storage.close()
+        for leftover in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def _write_logs(size, rows, requests_path, dataset_path):
+    """Fill the request log and the dataset with `size` rows each, by repeating a block."""
+    block_rows = rows[:min(len(rows), 10000)]
+    with open(dataset_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(block_rows)
+    dataset_block = open(dataset_path, 'rb').read()
+    with open(requests_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([['2025-01-01T00:00:00', r[0], r[1], r[2]] for r in block_rows])
+    requests_block = open(requests_path, 'rb').read()
+    for path, block, header in ((dataset_path, dataset_block, b''),
+                                (requests_path, requests_block, b'timestamp,method,url,body\r\n')):
+        with open(path, 'wb') as f:
+            f.write(header)
+            written = 0
+            while written < size:
+                take = min(len(block_rows), size - written)
+                if take == len(block_rows):
+                    f.write(block)
+                else:
+                    f.write(b''.join(block.splitlines(keepends=True)[:take]))
+                written += take
+
+
+def bench_dashboard_sizes(rows, results, sizes, n):
+    """Dashboard state at growing log sizes: full rebuild, checkpoint restore, snapshot, and the endpoint."""
+    from dashboard_stats import DashboardStats
+    from storage import CsvStorage
+
+    for size in sizes:
+        _write_logs(size, rows, 'bench_requests.csv', 'bench_dataset.csv')
+        label = f'{size // 1000}k' if size < 1000000 else f'{size // 1000000}M'
+        requests_store = CsvStorage({'requests': 'bench_requests.csv'})
+        stats = DashboardStats(requests_store, 'bench_dataset.csv', checkpoint_path='bench_stats.json')
+        results.append(measure(f'dashboard.rebuild_full_{label}', lambda i: stats.rebuild(), 1,
+                               items_per_op=size, memory_iterations=1))
+        stats.save_checkpoint()
+        results.append(measure(f'dashboard.rebuild_checkpoint_{label}', lambda i: stats.rebuild(), 5,
+                               memory_iterations=1))
+        results.append(measure(f'dashboard.snapshot_{label}', lambda i: stats.snapshot(10), 10000))
+        requests_store.close()
+        # The endpoint as the app serves it: the logs moved to the paths app.py
+        # reads, the dedup filter off (indexing the dataset is not what is timed)
+        os.replace('bench_requests.csv', 'http_requests.csv')
+        os.replace('bench_dataset.csv', 'login_dataset.csv')
+        _run_app_cases(results, DASHBOARD_SCRIPT, f'app.dashboard_data_{label}', max(50, n // 10),
+                       DATASET_DEDUP='0')
+        for path in ('http_requests.csv', 'login_dataset.csv', 'bench_stats.json', 'dashboard_stats.json'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def check_keep_up(results, tolerance):
+    """Print MUST_KEEP_UP pairs; returns the cases slower than their reference."""
+    slower = []
+    for name, reference in MUST_KEEP_UP:
+        if name not in results or reference not in results:
+            continue
+        ratio = results[name]['throughput'] / results[reference]['throughput']
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  SLOWER'
+            slower.append(name)
+        print(f'  {name:<34} {ratio:.2f}x the throughput of {reference}{flag}')
+    return slower
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline; returns the names of regressed benchmarks."""
+    regressions = []
+    print(f"\nComparison with baseline ({baseline.get('created', '?')}, commit {baseline.get('commit') or '?'}):")
+    for name, result in results.items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            print(f'  {name:<34} (new)')
+            continue
+        changes = []
+        regressed = False
+        for metric, higher_is_better in COMPARED.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            # Peak memory below 1 MB is too noisy to judge
+            if worse > tolerance and not (metric == 'peak_mb' and max(old, new) < 1):
+                regressed = True
+            changes.append(f'{metric} {change:+.1%}')
+        flag = '  REGRESSION' if regressed else ''
+        print(f"  {name:<34} {', '.join(changes)}{flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the detection hot path.')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations and dashboard sizes up to 100k')
+    parser.add_argument('--sizes', help='comma-separated dashboard log sizes (default: 10000,1000000,10000000)')
+    parser.add_argument('--only', help='comma-separated groups: features,scoring,app,startup,serve,event_log,storage,dashboard')
+    parser.add_argument('--output', default=RESULTS_PATH, help=f'results JSON (default: {RESULTS_PATH})')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help=f'baseline JSON (default: {BASELINE_PATH})')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative slowdown (default: 0.10)')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on a regression')
+    args = parser.parse_args(argv)
+
+    n = 2000 if args.quick else 20000
+    sizes = [int(s) for s in args.sizes.split(',')] if args.sizes else (
+        QUICK_DASHBOARD_SIZES if args.quick else DASHBOARD_SIZES)
+    groups = args.only.split(',') if args.only else [
+        'features', 'scoring', 'app', 'startup', 'serve', 'event_log', 'storage', 'dashboard']
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    for name in ARTIFACTS:
+        if os.path.exists(os.path.join(repo, name)):
+            shutil.copy(os.path.join(repo, name), workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # No file watcher and no verdict-cache warmup from earlier runs
+    os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+
+    rows = synthetic_rows(20000)
+    results = []
+    try:
+        if 'features' in groups:
+            bench_features(rows, results, n)
+        if 'scoring' in groups:
+            bench_scoring(rows, results, n)
+        if 'app' in groups:
+            bench_app(rows, results, n)
+        if 'startup' in groups:
+            bench_startup(rows, results, n)
+        if 'serve' in groups:
+            bench_serve(rows, results, n)
+        if 'event_log' in groups:
+            bench_event_log(rows, results, n)
+        if 'storage' in groups:
+            bench_alert_queries(rows, results, n)
+        if 'dashboard' in groups:
+            bench_dashboard_sizes(rows, results, sizes, n)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'quick': args.quick,
+        'benchmarks': dict(results),
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    print('\nAgainst the code they replace:')
+    regressions = check_keep_up(report['benchmarks'], args.tolerance)
+    if args.save_baseline:
+        shutil.copy(output, baseline_path)
+        print(f'Baseline saved to {baseline_path}')
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            regressions += compare(report['benchmarks'], json.load(f), args.tolerance)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single writer assumed
+    fcntl = None
+
+from features import FEATURE_COLUMNS, PLACEHOLDER_COLUMNS, extract_features_batch
+
+# Column-oriented copy of login_dataset.csv: a directory of append-only segments,
+# each holding one .npy file per feature column (opened with np.memmap through
+# np.load(mmap_mode='r')), int8 label codes and offsets+bytes blobs for the
+# raw strings. Segments are derived from the CSV and remember which byte range
+# of it they cover, so syncing only parses what was appended since.
+DATASET_STORE = 'login_dataset.col'
+DATASET_COLUMNS = ['method', 'endpoint', 'body', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'label']
+LABELS = ['good', 'bad', 'unknown']
+STRING_COLUMNS = ['method', 'endpoint', 'body']
+FORMAT_VERSION = 1
+
+# Narrowest dtype that holds each feature column
+COLUMN_DTYPES = {'body_length': np.int32, 'body_contains_slash': np.int32}
+
+# CSV bytes parsed per segment during conversion
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def _complete_prefix(data):
+    """Length of the longest prefix of `data` made of whole CSV records."""
+    quotes = data.count(b'"')
+    end = len(data)
+    while True:
+        nl = data.rfind(b'\n', 0, end)
+        if nl < 0:
+            return 0
+        # Quotes before the newline must be balanced for it to end a record
+        quotes -= data.count(b'"', nl + 1, end)
+        if quotes % 2 == 0:
+            return nl + 1
+        end = nl
+
+
+def _write_blob(seg_dir, name, strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(seg_dir, f'{name}_offsets.npy'), offsets)
+    with open(os.path.join(seg_dir, f'{name}.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.rows = self.meta['rows']
+
+    def column(self, name):
+        """Memory-mapped view of a fixed-width column (features or 'label')."""
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def strings(self, name):
+        offsets = np.load(os.path.join(self.path, f'{name}_offsets.npy'), mmap_mode='r')
+        blob = np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=np.uint8, mode='r') if offsets[-1] else b''
+        data = memoryview(blob)
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            yield bytes(data[start:end]).decode('utf-8')
+
+
+class ColumnarDataset:
+    def __init__(self, path=DATASET_STORE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._load_segments()
+
+    def _load_segments(self):
+        path = self.path
+        self.segments = [
+            Segment(os.path.join(path, name))
+            for name in sorted(os.listdir(path))
+            if name.startswith('seg-') and not name.endswith('.tmp')
+            and os.path.exists(os.path.join(path, name, 'meta.json'))
+        ]
+
+    def __len__(self):
+        return sum(seg.rows for seg in self.segments)
+
+    @property
+    def source_offset(self):
+        return self.segments[-1].meta['source_end'] if self.segments else 0
+
+    def column(self, name):
+        """Whole column; zero-copy memmap when the store has a single segment."""
+        parts = [seg.column(name) for seg in self.segments]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+    def features(self, columns=None):
+        columns = columns or FEATURE_COLUMNS
+        X = np.empty((len(self), len(columns)), dtype=np.float64)
+        row = 0
+        for seg in self.segments:
+            for i, col in enumerate(columns):
+                X[row:row + seg.rows, i] = seg.column(col)
+            row += seg.rows
+        return X
+
+    def labels(self):
+        return self.column('label')
+
+    def label_counts(self):
+        counts = np.zeros(len(LABELS), dtype=np.int64)
+        for seg in self.segments:
+            counts += np.bincount(seg.column('label'), minlength=len(LABELS))
+        return dict(zip(LABELS, counts.tolist()))
+
+    def strings(self, name):
+        for seg in self.segments:
+            yield from seg.strings(name)
+
+    def append_frame(self, df, source_start, source_end):
+        """Write one new segment from a parsed DataFrame of dataset rows."""
+        name = f'seg-{len(self.segments):06d}'
+        final_dir = os.path.join(self.path, name)
+        seg_dir = final_dir + '.tmp'
+        os.makedirs(seg_dir, exist_ok=True)
+
+        bodies = df['body'].tolist()
+        X = extract_features_batch(bodies, FEATURE_COLUMNS,
+                                   extra={c: df[c].to_numpy() for c in PLACEHOLDER_COLUMNS})
+        for i, col in enumerate(FEATURE_COLUMNS):
+            np.save(os.path.join(seg_dir, f'{col}.npy'), X[:, i].astype(COLUMN_DTYPES.get(col, np.int8)))
+        codes = df['label'].map({label: i for i, label in enumerate(LABELS)}).fillna(LABELS.index('unknown'))
+        np.save(os.path.join(seg_dir, 'label.npy'), codes.to_numpy(dtype=np.int8))
+        for col in STRING_COLUMNS:
+            _write_blob(seg_dir, col, df[col].tolist())
+
+        meta = {'version': FORMAT_VERSION, 'rows': len(df), 'columns': FEATURE_COLUMNS,
+                'source_start': source_start, 'source_end': source_end}
+        with open(os.path.join(seg_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(seg_dir, final_dir)
+        self.segments.append(Segment(final_dir))
+
+    def sync(self, csv_path, chunk_bytes=CHUNK_BYTES):
+        """Append segments for the CSV records written since the last sync; returns rows added."""
+        with open(os.path.join(self.path, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            # Another process may have synced while we waited for the lock
+            self._load_segments()
+            return self._sync_locked(csv_path, chunk_bytes)
+
+    def _sync_locked(self, csv_path, chunk_bytes):
+        import pandas as pd
+
+        added = 0
+        offset = self.source_offset
+        size = os.path.getsize(csv_path) if os.path.exists(csv_path) else 0
+        if size < offset:
+            raise ValueError(f'{csv_path} is shorter than the store expects; rebuild {self.path}')
+        with open(csv_path, 'rb') as f:
+            f.seek(offset)
+            pending = b''
+            while offset + len(pending) < size:
+                pending += f.read(min(chunk_bytes, size - offset - len(pending)))
+                usable = _complete_prefix(pending)
+                if usable == 0:
+                    continue
+                df = pd.read_csv(io.BytesIO(pending[:usable]), header=None, names=DATASET_COLUMNS,
+                                 dtype={c: str for c in STRING_COLUMNS + ['label']},
+                                 keep_default_na=False, skip_blank_lines=True)
+                for col in PLACEHOLDER_COLUMNS:
+                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+                self.append_frame(df, offset, offset + usable)
+                added += len(df)
+                offset += usable
+                pending = pending[usable:]
+        return added
+
+
+def convert_csv(csv_path='login_dataset.csv', store_path=DATASET_STORE, chunk_bytes=CHUNK_BYTES):
+    store = ColumnarDataset(store_path)
+    store.sync(csv_path, chunk_bytes)
+    return store
+
+
+if __name__ == '__main__':
+    # Usage: python columnar_store.py [login_dataset.csv] [login_dataset.col]
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else 'login_dataset.csv'
+    store_path = sys.argv[2] if len(sys.argv) > 2 else DATASET_STORE
+    store = ColumnarDataset(store_path)
+    added = store.sync(csv_path)
+    print(f"Synced {added} new rows into '{store_path}' ({len(store)} rows in {len(store.segments)} segments)")
+    print('Label counts:', store.label_counts())
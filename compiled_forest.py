@@ -0,0 +1,277 @@
+import sys
+
+import numpy as np
+
+# Flat, sklearn-free export of the trained RandomForestClassifier.
+# train_model.py writes it next to login_classifier.pkl; app.py scores with it.
+# Loading it needs only NumPy, so the server never imports sklearn or pandas.
+COMPILED_MODEL_PATH = 'login_classifier.npz'
+
+# Bumped whenever the arrays below change meaning; load() refuses other versions
+FORMAT_VERSION = 1
+# name -> (dtype kind, ndim) of every array in the file
+SCHEMA = {
+    'format_version': ('i', 0),
+    'feature': ('i', 1),
+    'threshold': ('f', 1),
+    'left': ('i', 1),
+    'right': ('i', 1),
+    'value': ('f', 2),
+    'roots': ('i', 1),
+    'classes': ('i', 1),
+    'feature_columns': ('U', 1),
+}
+
+
+def export_forest(model, feature_cols, path=COMPILED_MODEL_PATH):
+    """Write every tree of a fitted forest as concatenated node arrays.
+
+    Child indices are rewritten to global node ids so all trees live in one
+    set of arrays; `roots` holds the first node of each tree. `value` holds
+    each node's normalized class probabilities, as DecisionTreeClassifier
+    computes them in predict_proba.
+    """
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    for est in model.estimators_:
+        tree = est.tree_
+        leaf = tree.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(leaf, -1, tree.children_left + offset))
+        right.append(np.where(leaf, -1, tree.children_right + offset))
+        proba = tree.value[:, 0, :].astype(np.float64)
+        normalizer = proba.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value.append(proba / normalizer)
+        offset += tree.node_count
+
+    np.savez(
+        path,
+        format_version=np.asarray(FORMAT_VERSION, dtype=np.int32),
+        feature=np.concatenate(feature).astype(np.int32),
+        threshold=np.concatenate(threshold).astype(np.float64),
+        left=np.concatenate(left).astype(np.int32),
+        right=np.concatenate(right).astype(np.int32),
+        value=np.concatenate(value),
+        roots=np.asarray(roots, dtype=np.int32),
+        classes=np.asarray(model.classes_),
+        feature_columns=np.asarray(list(feature_cols), dtype=str),
+    )
+
+
+def check_schema(arrays, path=COMPILED_MODEL_PATH):
+    """Raise ValueError unless `arrays` is a forest this version of the scorer can walk."""
+    version = arrays.get('format_version')
+    if version is None or version.shape != () or int(version) != FORMAT_VERSION:
+        found = 'none' if version is None else version.tolist()
+        raise ValueError(f'{path}: format version {found}, expected {FORMAT_VERSION} '
+                         '(re-export it with train_model.py or compiled_forest.py)')
+    missing = sorted(set(SCHEMA) - set(arrays))
+    if missing:
+        raise ValueError(f'{path}: missing arrays {", ".join(missing)}')
+    for name, (kind, ndim) in SCHEMA.items():
+        array = arrays[name]
+        if array.dtype.kind != kind or array.ndim != ndim:
+            raise ValueError(f'{path}: {name} is {array.dtype}[{array.ndim}d], expected {kind}[{ndim}d]')
+    n_nodes = len(arrays['feature'])
+    classes = arrays['classes'].tolist()
+    if any(len(arrays[name]) != n_nodes for name in ('threshold', 'left', 'right', 'value')):
+        raise ValueError(f'{path}: node arrays differ in length')
+    if arrays['value'].shape[1] != len(classes) or 1 not in classes:
+        raise ValueError(f'{path}: classes {classes} do not match the leaf values')
+    for name, lowest in (('left', -1), ('right', -1), ('roots', 0)):
+        array = arrays[name]
+        if len(array) and (array.min() < lowest or array.max() >= n_nodes):
+            raise ValueError(f'{path}: {name} points outside the {n_nodes} nodes')
+    leaf = arrays['left'] == -1
+    if np.any(~leaf & ((arrays['feature'] < 0) | (arrays['feature'] >= len(arrays['feature_columns'])))):
+        raise ValueError(f'{path}: split features outside the {len(arrays["feature_columns"])} feature columns')
+
+
+# A tree is walked node by node (a few NumPy calls per node) when it has at
+# most this many inner nodes per level of depth, else level by level (a dozen
+# calls per level on every row still walking)
+SPLIT_NODES_PER_LEVEL = 4
+
+
+class CompiledForest:
+    """Scores rows by walking the exported node arrays directly.
+
+    Inputs are rounded to float32 before comparing with thresholds, exactly
+    like sklearn does, so probabilities match RandomForestClassifier.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, feature_columns):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.feature_columns = [str(c) for c in feature_columns]
+        self.n_trees = len(roots)
+        # Plain lists are much faster than NumPy scalars for the one-row walk
+        self._feature = feature.tolist()
+        self._threshold = threshold.tolist()
+        self._left = left.tolist()
+        self._right = right.tolist()
+        self._bad = value[:, list(classes).index(1)].tolist()
+        self._roots = roots.tolist()
+        # Batch walk per tree: node by node while the tree is small for its
+        # depth, level by level over the rows for bushy, deep trees
+        self._walkers = []
+        for root in self._roots:
+            inner, depth = self._tree_shape(root)
+            self._walkers.append(self._tree_leaves if inner <= SPLIT_NODES_PER_LEVEL * depth else self._walk_leaves)
+        # Whether every tree takes the node-by-node walk, which keeps up with
+        # sklearn's batch predict_proba; the level walk is several times slower
+        self.fast_batches = all(walker == self._tree_leaves for walker in self._walkers)
+
+    def _tree_shape(self, root):
+        """(inner nodes, depth) of the tree starting at `root`."""
+        left, right = self._left, self._right
+        inner = depth = 0
+        stack = [(root, 0)]
+        while stack:
+            node, level = stack.pop()
+            if left[node] == -1:
+                depth = max(depth, level)
+            else:
+                inner += 1
+                stack.append((left[node], level + 1))
+                stack.append((right[node], level + 1))
+        return inner, depth
+
+    @classmethod
+    def load(cls, path=COMPILED_MODEL_PATH):
+        """Read an exported forest; raises ValueError if the file does not match SCHEMA."""
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {k: data[k] for k in data.files}
+        check_schema(arrays, path)
+        del arrays['format_version']
+        return cls(**arrays)
+
+    def score_row(self, row):
+        """Return the 'bad' class probability for one feature row (a sequence)."""
+        x = np.asarray(row, dtype=np.float32).tolist()
+        feature, threshold, left, right = self._feature, self._threshold, self._left, self._right
+        total = 0.0
+        for node in self._roots:
+            while left[node] != -1:
+                node = left[node] if x[feature[node]] <= threshold[node] else right[node]
+            total += self._bad[node]
+        return total / self.n_trees
+
+    def _columns(self, X):
+        """X rounded to float32 like sklearn, one contiguous float64 array per feature."""
+        return np.ascontiguousarray(np.asarray(X, dtype=np.float32).T, dtype=np.float64)
+
+    def _tree_leaves(self, columns, root, out):
+        """Store in `out` the leaf each row reaches in the tree starting at `root`.
+
+        The rows are split node by node, so each node costs a few NumPy calls on
+        just the rows that reach it and the work per tree grows with its depth,
+        not with the number of rows times trees.
+        """
+        feature, threshold, left, right = self._feature, self._threshold, self._left, self._right
+        stack = [(root, None)]  # None: every row
+        while stack:
+            node, rows = stack.pop()
+            if left[node] == -1:
+                if rows is None:
+                    out[:] = node
+                else:
+                    out[rows] = node
+                continue
+            column = columns[feature[node]]
+            if rows is None:
+                go_left = column <= threshold[node]
+                split = np.flatnonzero(go_left), np.flatnonzero(~go_left)
+            else:
+                go_left = column.take(rows) <= threshold[node]
+                split = rows[go_left], rows[~go_left]
+            for child, child_rows in zip((left[node], right[node]), split):
+                if child_rows.size:
+                    stack.append((child, child_rows))
+
+    def _walk_leaves(self, columns, root, out):
+        """Like _tree_leaves, but all rows step down one level at a time.
+
+        Costs a dozen NumPy calls per level whatever the number of nodes, which
+        beats splitting node by node on deep, fully grown trees.
+        """
+        n_rows = columns.shape[1]
+        flat = columns.ravel()
+        out[:] = root
+        if self._left[root] == -1:
+            return
+        rows = np.arange(n_rows)
+        node = out.copy()
+        while rows.size:
+            values = flat.take(self.feature.take(node) * n_rows + rows)
+            node = np.where(values <= self.threshold.take(node), self.left.take(node), self.right.take(node))
+            out[rows] = node
+            inner = self.left.take(node) != -1
+            rows, node = rows[inner], node[inner]
+
+    def apply(self, X):
+        """Return the leaf index reached in every tree, shape (n_rows, n_trees)."""
+        columns = self._columns(X)
+        leaves = np.empty((self.n_trees, columns.shape[1]), dtype=np.intp)
+        for tree, (root, walk) in enumerate(zip(self._roots, self._walkers)):
+            walk(columns, root, leaves[tree])
+        return leaves.T
+
+    def predict_proba(self, X):
+        columns = self._columns(X)
+        proba = np.zeros((columns.shape[1], self.value.shape[1]))
+        leaves = np.empty(columns.shape[1], dtype=np.intp)
+        # Accumulate tree by tree, in the same order sklearn sums them
+        for root, walk in zip(self._roots, self._walkers):
+            walk(columns, root, leaves)
+            proba += self.value.take(leaves, axis=0)
+        return proba / self.n_trees
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def verify(model, compiled, X):
+    """Check the compiled forest against model.predict_proba on X; returns max abs diff."""
+    expected = model.predict_proba(X)
+    batch = compiled.predict_proba(np.asarray(X))
+    single = np.array([compiled.score_row(row) for row in np.asarray(X)])
+    bad = list(model.classes_).index(1)
+    diff = max(np.abs(expected - batch).max(), np.abs(expected[:, bad] - single).max())
+    if diff > 1e-12 or not np.array_equal(model.predict(X), compiled.predict(np.asarray(X))):
+        raise AssertionError(f'Compiled forest disagrees with sklearn (max diff {diff})')
+    return diff
+
+
+def dataset_features(feature_cols, path='login_dataset.csv'):
+    """Feature frame of every row of the dataset, in `feature_cols` order (for verify)."""
+    import pandas as pd
+    from features import dataset_extra, extract_features_batch
+
+    df = pd.read_csv(path, header=None)
+    df.columns = ['method', 'endpoint', 'body', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'label']
+    return pd.DataFrame(
+        extract_features_batch(df['body'], feature_cols, extra=dataset_extra(df)),
+        columns=feature_cols,
+    )
+
+
+if __name__ == '__main__':
+    # Re-export an existing login_classifier.pkl and check it on login_dataset.csv
+    import joblib
+
+    model = joblib.load(sys.argv[1] if len(sys.argv) > 1 else 'login_classifier.pkl')
+    feature_cols = joblib.load('feature_columns.pkl')
+    export_forest(model, feature_cols)
+
+    X = dataset_features(feature_cols)
+    diff = verify(model, CompiledForest.load(), X)
+    print(f"Compiled forest saved as '{COMPILED_MODEL_PATH}' ({len(X)} rows verified, max diff {diff:.2e})")
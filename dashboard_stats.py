@@ -0,0 +1,231 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from columnar_store import _complete_prefix
+from features import SQL_KEYWORDS
+from shared_counters import SharedCounters
+
+LOG = logging.getLogger('app.dashboard_stats')
+REQUEST_FIELDS = ['timestamp', 'method', 'url', 'body']
+COUNT_NAMES = ('total', 'good', 'bad', 'unknown')
+
+# Bytes at the start of a log hashed into the checkpoint, so a regenerated file
+# is never mistaken for the one the checkpoint was taken from
+_HEAD_BYTES = 4096
+
+
+def _head_digest(path, size):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(size, _HEAD_BYTES))).hexdigest()
+
+
+def _read_rows(path, offset=0):
+    """Yield CSV records of `path` starting at byte `offset` (a record boundary)."""
+    with open(path, 'rb') as raw:
+        raw.seek(offset)
+        yield from csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+
+
+class DashboardStats:
+    """Running dataset label counters and a ring buffer of the latest requests.
+
+    Kept up to date from the event log writer (see EventLogWriter.add_listener),
+    so /api/dashboard-data costs O(1) however large the logs grow. On startup
+    the counts are rebuilt from a checkpoint plus the dataset bytes appended
+    since, or with one streaming pass when there is no usable checkpoint; the
+    latest requests are read back from the request log's storage (storage.py).
+
+    The counts live in a SharedCounters block (`counters`, by default a private
+    one with a single slot). Under serve.py every worker adds its own batches to
+    its own slot of one block created before fork; see after_fork().
+    """
+
+    def __init__(self, requests_store, dataset_path, checkpoint_path=None, recent_size=100,
+                 checkpoint_interval=60.0, counters=None):
+        self.requests_store = requests_store
+        self.dataset_path = dataset_path
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.monotonic()
+        self.counters = counters if counters is not None else SharedCounters(COUNT_NAMES)
+        self.recent = deque(maxlen=recent_size)
+        self._recent_from_store = False
+        self._lock = threading.Lock()
+
+    def _count_label(self, row):
+        label = row[-1].strip() if row else ''
+        if label not in ('good', 'bad'):
+            label = 'unknown'
+        self.counters.add('total')
+        self.counters.add(label)
+
+    def _add_request(self, row):
+        self.recent.append(dict(zip(REQUEST_FIELDS, row)))
+
+    def on_rows(self, sink, rows):
+        """EventLogWriter listener: fold freshly written rows into the state."""
+        with self._lock:
+            if sink == 'dataset':
+                for row in rows:
+                    self._count_label(row)
+            elif sink == 'requests':
+                for row in rows:
+                    self._add_request(row)
+        # Runs on the writer thread right after the batch hit the disk, so the
+        # current file sizes match exactly what has been counted
+        if self.checkpoint_path and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def after_fork(self, slot):
+        """Switch a forked worker to its own counter slot.
+
+        The worker stops taking checkpoints (the parent saves one at shutdown,
+        once every worker has drained its log), and the latest requests are read
+        from storage, since the local ring only sees this worker's requests.
+        """
+        self.counters.select_slot(slot)
+        self.checkpoint_path = None
+        self._recent_from_store = True
+
+    def snapshot(self, limit=10):
+        if self._recent_from_store:
+            records = self.requests_store.recent('requests', limit)[0] if limit else []
+            return self.counters.snapshot(), [dict(zip(REQUEST_FIELDS, row)) for row in records]
+        with self._lock:
+            recent = list(self.recent)[-limit:] if limit else []
+            return self.counters.snapshot(), recent
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            offset = checkpoint['dataset']['offset']
+            if not os.path.exists(self.dataset_path) or os.path.getsize(self.dataset_path) < offset:
+                return None
+            if _head_digest(self.dataset_path, offset) != checkpoint['dataset']['head']:
+                return None
+            return checkpoint
+        except Exception as e:
+            LOG.warning('Ignoring unreadable stats checkpoint: %s', e)
+            return None
+
+    def rebuild(self):
+        """Restore the counts from the checkpoint plus dataset tail (or a full pass) and the recent requests."""
+        checkpoint = self._load_checkpoint()
+        with self._lock:
+            self.counters.reset()
+            self.recent.clear()
+            dataset_offset = 0
+            if checkpoint is not None:
+                self.counters.reset({k: v for k, v in checkpoint['counts'].items() if k in COUNT_NAMES})
+                dataset_offset = checkpoint['dataset']['offset']
+
+            if os.path.exists(self.dataset_path):
+                for row in _read_rows(self.dataset_path, dataset_offset):
+                    if row:
+                        self._count_label(row)
+            records, _ = self.requests_store.recent('requests', self.recent.maxlen)
+            for row in records:
+                self._add_request(row)
+        return checkpoint is not None
+
+    def save_checkpoint(self):
+        """Persist the state with the current log sizes; call once the log writer is flushed."""
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            path = self.dataset_path
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            checkpoint = {'counts': self.counters.snapshot(),
+                          'dataset': {'offset': size,
+                                      'head': _head_digest(path, size) if size else hashlib.sha1().hexdigest()}}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+
+# Bodies counted as "SQL keywords" on the Streamlit Statistics page (the keywords
+# of the has_sql_keywords feature)
+SQL_KEYWORDS_RE = re.compile('|'.join(map(re.escape, SQL_KEYWORDS)), re.IGNORECASE)
+
+
+class DatasetSummary:
+    """Label and SQL-keyword counts of login_dataset.csv, kept current incrementally.
+
+    refresh() costs one stat() when the file is unchanged. When it has grown,
+    only the appended (complete) records are parsed and added to the counts;
+    when it shrank or its first bytes changed (the file was regenerated), the
+    counts are rebuilt from scratch. `version` changes whenever the counts do.
+    """
+
+    def __init__(self, path, chunk_bytes=8 * 1024 * 1024):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.version = 0
+        self._stat = None  # (size, mtime_ns) the counts reflect
+        self._reset()
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.labels = Counter()
+        self.sql_count = 0
+        self._offset = 0
+        self._head = None
+
+    def _add_rows(self, data):
+        for row in csv.reader(io.StringIO(data.decode('utf-8', 'replace'), newline='')):
+            if len(row) < 3:
+                continue
+            self.labels[row[-1].strip()] += 1
+            if SQL_KEYWORDS_RE.search(row[2]):
+                self.sql_count += 1
+
+    def refresh(self):
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if self._stat is not None:
+                    self._reset()
+                    self._stat = None
+                    self.version += 1
+                return self.version
+            stat = (st.st_size, st.st_mtime_ns)
+            if stat == self._stat:
+                return self.version
+            size = st.st_size
+            if size < self._offset or (self._head is not None and
+                                       _head_digest(self.path, min(self._offset, _HEAD_BYTES)) != self._head):
+                self._reset()
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                pending = b''
+                while self._offset + len(pending) < size:
+                    pending += f.read(min(self.chunk_bytes, size - self._offset - len(pending)))
+                    usable = _complete_prefix(pending)
+                    if usable:
+                        self._add_rows(pending[:usable])
+                        self._offset += usable
+                        pending = pending[usable:]
+            # A record still being written is picked up by the next refresh
+            self._head = _head_digest(self.path, min(self._offset, _HEAD_BYTES))
+            self._stat = stat
+            self.version += 1
+            return self.version
+
+    def snapshot(self):
+        with self._lock:
+            return {'total': sum(self.labels.values()), 'label_counts': dict(self.labels),
+                    'sql_count': self.sql_count}
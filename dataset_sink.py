@@ -0,0 +1,244 @@
+import csv
+import hashlib
+import io
+import logging
+import math
+import os
+import threading
+from array import array
+
+import numpy as np
+
+from dashboard_stats import _head_digest
+from normalize import normalize_text
+
+LOG = logging.getLogger('app.dataset_sink')
+
+# Admission filter in front of login_dataset.csv. Every login would otherwise
+# append a row, so an attack replaying one payload grows the file without bound.
+# Bodies are normalized (see normalize.normalize_text) and hashed together with
+# their label. A Bloom filter tells whether that pair has been written before,
+# so only novel pairs are admitted; a count-min sketch keeps how often each one
+# has been seen, which app.py adds to the login alert notes. Benign bodies can
+# further be sampled at a fixed rate, decided by the hash so a given body is
+# always either kept or dropped.
+#
+# Rows carry the login velocity (f4..f6, see rate_tracker.Velocity), so the Bloom
+# key also holds each count's power-of-two bucket: a payload replayed at a higher
+# rate than before is admitted again, once per bucket, and models trained with
+# USE_VELOCITY_FEATURES=1 see the fast attempts and not just the first one. The
+# sketch counts the body and label alone, whatever the rate.
+DEDUP_STATE_PATH = 'login_dataset.dedup.npz'
+
+
+def velocity_bucket(velocity):
+    """Power-of-two buckets of the velocity counts: 0, 1, 2-3, 4-7, ... map to 0, 1, 2, 3, ..."""
+    return tuple(int(v).bit_length() for v in velocity) if velocity else (0, 0, 0)
+
+
+def _digest_pair(data):
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def _key_hashes(body, label):
+    """Two independent 64-bit hashes of the normalized body and its label."""
+    return _digest_pair(f'{normalize_text(body)}\x1f{label}'.encode('utf-8', 'surrogatepass'))
+
+
+def _bucket_hashes(h1, h2, velocity):
+    """The key hashes mixed with the velocity bucket; unchanged when every count is 0."""
+    bucket = velocity_bucket(velocity)
+    if not any(bucket):
+        return h1, h2
+    return _digest_pair(b'%d,%d,%d,%d,%d' % (h1, h2, *bucket))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over pre-hashed keys (double hashing, h1 + i*h2)."""
+
+    def __init__(self, expected_items=1000000, error_rate=0.001):
+        n = max(1, int(expected_items))
+        m = int(math.ceil(-n * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, int(round(m / n * math.log(2))))
+        # bytearray rather than a NumPy array: single-byte indexing is much cheaper
+        self.bits = bytearray((m + 7) // 8)
+        self.m = len(self.bits) * 8
+
+    def _positions(self, h1, h2):
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, h1, h2):
+        """Set the key's bits; returns True if the key was (probably) not there before."""
+        new = False
+        bits = self.bits
+        for pos in self._positions(h1, h2):
+            byte, mask = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        return new
+
+    def __contains__(self, hashes):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(*hashes))
+
+
+class CountMinSketch:
+    """Approximate per-key counters in depth x width uint32 cells (never undercounts)."""
+
+    def __init__(self, width=1 << 18, depth=4):
+        self.depth, self.width = depth, width
+        # Flat row-major table; array item access is far cheaper than NumPy scalars
+        self.table = array('I', bytes(4 * depth * width))
+
+    def _cells(self, h1, h2):
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, h1, h2, count=1):
+        """Count the key; returns its new estimate."""
+        table = self.table
+        cells = self._cells(h1, h2)
+        for cell in cells:
+            table[cell] += count
+        return min(table[cell] for cell in cells)
+
+    def estimate(self, h1, h2):
+        return min(self.table[cell] for cell in self._cells(h1, h2))
+
+
+def dataset_row(method, url, body, label, velocity=None):
+    """A login_dataset.csv row; f1..f3 stay 0 and f4..f6 hold the velocity counts."""
+    return [method, url, body, 0, 0, 0, *(velocity or (0, 0, 0)), label]
+
+
+def append_dataset_row(storage, deduper, method, url, body, label, velocity=None):
+    """Append one row to the storage's 'dataset' table unless the deduper (if any) drops it.
+
+    For writers outside app.py's event log: CsvStorage.append takes the same
+    flock as the app's writer, so rows never interleave. Returns how many times
+    the body has been seen with this label.
+    """
+    admitted, seen = deduper.record(body, label, velocity) if deduper is not None else (True, 1)
+    if admitted:
+        storage.append('dataset', [dataset_row(method, url, body, label, velocity)])
+    return seen
+
+
+def _row_velocity(row):
+    """The f4..f6 velocity counts of a dataset row, or None for short or malformed rows."""
+    if len(row) < 10:
+        return None
+    try:
+        return [int(float(v)) for v in row[6:9]]
+    except ValueError:
+        return None
+
+
+class DatasetDeduper:
+    def __init__(self, dataset_path, state_path=None, expected_items=1000000, error_rate=0.001,
+                 benign_sample_rate=1.0, cms_width=1 << 18, cms_depth=4):
+        self.dataset_path = dataset_path
+        self.state_path = state_path
+        self.benign_sample_rate = benign_sample_rate
+        self.bloom = BloomFilter(expected_items, error_rate)
+        self.sketch = CountMinSketch(cms_width, cms_depth)
+        self.counts = {'seen': 0, 'admitted': 0, 'duplicates': 0, 'sampled_out': 0}
+        self._offset = 0  # dataset bytes indexed so far
+        self._lock = threading.Lock()
+
+    def _sampled_out(self, label, h1):
+        # Top 53 bits of h1 as a uniform number in [0, 1)
+        return label == 'good' and (h1 >> 11) * 2.0 ** -53 >= self.benign_sample_rate
+
+    def record(self, body, label, velocity=None):
+        """Record one observation; (should the row be appended, times seen including this one)."""
+        h1, h2 = _key_hashes(body, label)
+        b1, b2 = _bucket_hashes(h1, h2, velocity)
+        with self._lock:
+            self.counts['seen'] += 1
+            seen = self.sketch.add(h1, h2)
+            if self._sampled_out(label, h1):
+                self.counts['sampled_out'] += 1
+                return False, seen
+            if not self.bloom.add(b1, b2):
+                self.counts['duplicates'] += 1
+                return False, seen
+            self.counts['admitted'] += 1
+            return True, seen
+
+    def admit(self, body, label, velocity=None):
+        """Record one observation; True if the row should be appended to the dataset."""
+        return self.record(body, label, velocity)[0]
+
+    def count(self, body, label):
+        """How many times (at least) this body has been seen with this label."""
+        with self._lock:
+            return self.sketch.estimate(*_key_hashes(body, label))
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _index_rows(self, offset, size, count=True):
+        """Add the dataset rows from byte `offset` on to the filter (and the sketch).
+
+        Rows appended past `size` while this runs may be indexed twice later on,
+        which the Bloom filter does not mind.
+        """
+        with open(self.dataset_path, 'rb') as raw:
+            raw.seek(offset)
+            for row in csv.reader(io.TextIOWrapper(raw, encoding='utf-8', errors='replace', newline='')):
+                if len(row) >= 3:
+                    h1, h2 = _key_hashes(row[2], row[-1].strip())
+                    self.bloom.add(*_bucket_hashes(h1, h2, _row_velocity(row)))
+                    if count:
+                        self.sketch.add(h1, h2)
+        self._offset = size
+
+    def sync(self):
+        """Index rows another process appended since load(); they are not counted again."""
+        size = os.path.getsize(self.dataset_path) if os.path.exists(self.dataset_path) else 0
+        with self._lock:
+            if size > self._offset:
+                self._index_rows(self._offset, size, count=False)
+
+    def _head(self, size):
+        return _head_digest(self.dataset_path, size) if size else hashlib.sha1().hexdigest()
+
+    def load(self):
+        """Restore the saved state (plus rows appended since), or index the whole dataset."""
+        size = os.path.getsize(self.dataset_path) if os.path.exists(self.dataset_path) else 0
+        offset = 0
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with np.load(self.state_path) as state:
+                    saved_offset = int(state['offset'])
+                    # The head digest ties the state to this dataset file, so a
+                    # regenerated login_dataset.csv is indexed from scratch
+                    if (saved_offset <= size and 'head' in state.files
+                            and str(state['head']) == self._head(saved_offset)
+                            and len(state['bloom']) == len(self.bloom.bits)
+                            and len(state['sketch']) == len(self.sketch.table)):
+                        self.bloom.bits[:] = state['bloom'].tobytes()
+                        self.sketch.table = array('I', state['sketch'].astype(np.uint32).tobytes())
+                        offset = saved_offset
+            except Exception as e:
+                LOG.warning('Ignoring unreadable dataset dedup state: %s', e)
+        with self._lock:
+            self._offset = offset
+            if size > offset:
+                self._index_rows(offset, size)
+
+    def save(self):
+        """Persist the filter with the current dataset size; call once queued rows are written."""
+        if not self.state_path:
+            return
+        with self._lock:
+            size = os.path.getsize(self.dataset_path) if os.path.exists(self.dataset_path) else 0
+            tmp_path = self.state_path + '.tmp.npz'
+            np.savez(tmp_path, bloom=np.frombuffer(self.bloom.bits, dtype=np.uint8),
+                     sketch=np.frombuffer(self.sketch.table, dtype=np.uint32), offset=np.int64(size),
+                     head=np.array(self._head(size)))
+        os.replace(tmp_path, self.state_path)
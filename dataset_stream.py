@@ -0,0 +1,106 @@
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage
+    resource = None
+
+from columnar_store import DATASET_COLUMNS, LABELS, STRING_COLUMNS
+from features import dataset_extra, extract_features_batch
+
+# Out-of-core helpers for train_model.py: walk the login dataset in fixed-size
+# chunks (features computed into one reused buffer), keep a stratified reservoir
+# sample under a memory budget, and report time and peak RSS per stage.
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    yield
+    rss = peak_rss_mb()
+    rss_note = f', peak RSS {rss:.0f} MB' if rss is not None else ''
+    print(f'[{name}] {time.perf_counter() - started:.1f}s{rss_note}')
+
+
+def iter_chunks(columns, chunk_rows, csv_path='login_dataset.csv', store=None, dtype=np.float32):
+    """Yield (X, y) per chunk of at most `chunk_rows` dataset rows.
+
+    X is a view of one buffer allocated up front and refilled for every chunk,
+    so copy what must outlive the next iteration. y is 1 for 'bad', 0 otherwise.
+    Reads the columnar store when given, else parses the CSV chunk by chunk.
+    """
+    buffer = np.empty((chunk_rows, len(columns)), dtype=dtype)
+    if store is not None:
+        bad = LABELS.index('bad')
+        for seg in store.segments:
+            labels = seg.column('label')
+            for start in range(0, seg.rows, chunk_rows):
+                end = min(start + chunk_rows, seg.rows)
+                X = buffer[:end - start]
+                for i, col in enumerate(columns):
+                    X[:, i] = seg.column(col)[start:end]
+                yield X, (labels[start:end] == bad).astype(np.int8)
+        return
+
+    import pandas as pd
+    reader = pd.read_csv(csv_path, header=None, names=DATASET_COLUMNS, chunksize=chunk_rows,
+                         dtype={c: str for c in STRING_COLUMNS + ['label']})
+    for df in reader:
+        X = extract_features_batch(df['body'], columns, out=buffer,
+                                   extra=dataset_extra(df))
+        yield X, (df['label'] == 'bad').to_numpy(dtype=np.int8)
+
+
+class StratifiedReservoir:
+    """Uniform sample of at most `capacity` rows per class from a stream of chunks.
+
+    Algorithm R applied per class, vectorized over each chunk: row n of a class
+    (0-based, counted over the whole stream) takes slot n while the reservoir is
+    filling, then replaces a random slot with probability capacity / (n + 1).
+    """
+
+    def __init__(self, capacity, n_columns, n_classes=2, dtype=np.float32, seed=42):
+        self.capacity = int(capacity)
+        self.X = [np.empty((self.capacity, n_columns), dtype=dtype) for _ in range(n_classes)]
+        self.seen = [0] * n_classes
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, X, y):
+        for label, reservoir in enumerate(self.X):
+            rows = X[y == label]
+            if not len(rows):
+                continue
+            n = self.seen[label] + np.arange(len(rows))
+            slots = np.where(n < self.capacity, n, self._rng.integers(0, n + 1))
+            keep = slots < self.capacity
+            # Later rows win when two land on the same slot, as in the sequential algorithm
+            reservoir[slots[keep]] = rows[keep]
+            self.seen[label] += len(rows)
+
+    def __len__(self):
+        return sum(min(n, self.capacity) for n in self.seen)
+
+    def arrays(self):
+        """(X, y) of the sampled rows."""
+        parts = [res[:min(n, self.capacity)] for res, n in zip(self.X, self.seen)]
+        y = np.concatenate([np.full(len(p), label, dtype=np.int8) for label, p in enumerate(parts)])
+        return np.concatenate(parts), y
+
+
+def budget_rows(memory_mb, n_columns, itemsize=4, overhead=4):
+    """Rows of `n_columns` features that fit in `memory_mb`, leaving `overhead`x room for fitting."""
+    return max(1, int(memory_mb * 2 ** 20 // (n_columns * itemsize * overhead)))
+
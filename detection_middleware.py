@@ -0,0 +1,219 @@
+import io
+import json
+import re
+
+from features import SPECIAL_CHARS, SQL_KEYWORDS
+from signatures import _split_boundaries
+
+# WSGI middleware that scores the query string and body of every request before
+# the wrapped application sees it, so routes other than /api/login (or a
+# different WSGI app altogether) are covered too. The body is read once, up to
+# max_body bytes, and handed back to the application through a replacement
+# wsgi.input, so downstream code reads exactly the bytes the client sent.
+# Chunked bodies (no Content-Length) are read the same way when the server
+# marks wsgi.input as terminated; otherwise their length cannot be known and
+# the request is flagged without reading the body, so chunking is not a way
+# around the scorer.
+#
+# Most traffic is clean, so a bytes regex runs first: bodies with none of the
+# characters the feature extractor and the signature rules look for (quotes,
+# comment markers, slashes, percent escapes, non-ASCII, SQL keywords) skip the
+# scorer entirely and cost a few microseconds.
+
+# Characters the model's features count, plus the ones an encoded or obfuscated
+# payload needs; signature patterns with none of them are matched as words
+PREFILTER_CHARS = ''.join(SPECIAL_CHARS) + '#/\\<>()`%.'
+MAX_BODY = 64 * 1024
+
+# Verdict stored in environ['sqli.verdict'] for requests the prefilter passed
+CLEAN = {'bad': False, 'scored': False}
+# Verdict for a body whose length the middleware cannot determine (chunked
+# without wsgi.input_terminated, or a malformed Content-Length)
+UNKNOWN_LENGTH = {'bad': True, 'scored': True, 'part': 'body', 'detail': 'body length unknown', 'text': ''}
+
+
+def _trie_pattern(words):
+    """Regex source matching any of `words`, factored into a trie so the regex
+    engine tries one branch per position instead of every word."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = None
+
+    def build(node):
+        if '' in node:
+            return ''  # a word ends here; longer ones add nothing to a search
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(node.items())]
+        return alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+
+    return build(trie)
+
+
+class Prefilter:
+    """Cheap test for bytes that might score as malicious.
+
+    Matches any prefilter character or non-ASCII byte in the raw bytes, or (in
+    the lower-cased bytes) an SQL keyword or a signature pattern made only of
+    letters, digits and spaces, so skipping the scorer never hides a match.
+    """
+
+    def __init__(self, patterns=()):
+        chars = re.compile('[' + re.escape(PREFILTER_CHARS) + ']')
+        words = set(SQL_KEYWORDS)
+        for pattern in patterns:
+            pattern = _split_boundaries(pattern)[0]  # the text the rule matches, without \b markers
+            if not chars.search(pattern) and not any(k in pattern for k in SQL_KEYWORDS):
+                words.add(pattern)
+                words.add(pattern.replace(' ', '+'))  # form encoding
+        self._chars = re.compile(('[\\x80-\\xff' + re.escape(PREFILTER_CHARS) + ']').encode('ascii'))
+        self._words = re.compile(_trie_pattern(words).encode('utf-8'))
+
+    def search(self, data):
+        return self._chars.search(data) is not None or self._words.search(data.lower()) is not None
+
+
+def model_analyzer(threshold=0.5):
+    """analyze(text) -> (bad, detail) from the model files and signature rules on disk.
+
+    For deployments in front of another WSGI app; app.py passes its own
+    analyzer, which shares the verdict cache and the hot-reloaded model.
+    Raises FileNotFoundError when there is no model to load.
+    """
+    from compiled_forest import CompiledForest
+    from features import extract_feature_vector, get_scanner
+    from inference import bad_probability
+    from model_registry import load_model_files
+    from ngram_hashing import load_ngram_model
+    from signatures import describe
+
+    loaded = load_model_files()
+    if loaded is None:
+        raise FileNotFoundError('No model artifacts found; run train_model.py first')
+    model, feature_cols = loaded[:2]
+    ngram = load_ngram_model(feature_cols)
+    scanner = get_scanner()
+
+    def analyze(text):
+        features = extract_feature_vector(text, feature_cols, ngram=ngram)
+        if isinstance(model, CompiledForest):
+            probability = model.score_row(features[0])
+        else:
+            # The pickle: a stale or other-version .npz, or a model-search winner that is no forest
+            probability = float(bad_probability(model, features, feature_cols)[0])
+        matches = scanner.scan(text)
+        detail = f'model p={probability:.2f}'
+        if matches:
+            detail += '; rules: ' + describe(matches)
+        return probability >= threshold, detail
+
+    return analyze
+
+
+class _ReplayInput:
+    """wsgi.input that returns the already-read `prefix` before the rest of `stream`."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = io.BytesIO(prefix)
+        self._stream = stream
+
+    def read(self, size=-1):
+        data = self._prefix.read(size)
+        if size is None or size < 0:
+            return data + self._stream.read()
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+    def readline(self, size=-1):
+        line = self._prefix.readline(size)
+        if line.endswith(b'\n') or (size is not None and 0 <= size <= len(line)):
+            return line
+        rest = self._stream.readline(-1 if size is None or size < 0 else size - len(line))
+        return line + rest
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class DetectionMiddleware:
+    """Score each request's query string and body; annotate it or, in block mode, answer 403.
+
+    `analyze(text)` returns (bad, detail). The verdict ({'bad', 'scored',
+    'part', 'detail', 'text'}) is stored in environ['sqli.verdict'], and
+    `on_verdict(environ, verdict, blocked)` is called for every request.
+    Paths starting with one of `exempt_prefixes` are passed through unscored.
+    """
+
+    def __init__(self, app, analyze, block=False, max_body=MAX_BODY, exempt_prefixes=(), on_verdict=None,
+                 prefilter=None):
+        self.app = app
+        self.analyze = analyze
+        self.block = block
+        self.max_body = max_body
+        self.exempt_prefixes = tuple(exempt_prefixes)
+        self.on_verdict = on_verdict
+        self.prefilter = prefilter or Prefilter()
+
+    def _read_body(self, environ):
+        """The first max_body bytes of the body, or None when its length cannot be determined."""
+        if not environ.get('CONTENT_LENGTH'):
+            if environ.get('wsgi.input_terminated'):
+                # The server ends wsgi.input at the end of the (de-chunked) body
+                stream = environ['wsgi.input']
+                body = stream.read(self.max_body)
+                environ['wsgi.input'] = _ReplayInput(body, stream) if len(body) == self.max_body else io.BytesIO(body)
+                return body
+            if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+                return None
+            return b''
+        try:
+            length = int(environ['CONTENT_LENGTH'])
+        except ValueError:
+            return None
+        if length <= 0:
+            return b''
+        stream = environ['wsgi.input']
+        body = stream.read(min(length, self.max_body))
+        if len(body) < length:
+            # Only the first max_body bytes are scored; the app still gets all of them
+            environ['wsgi.input'] = _ReplayInput(body, stream)
+        else:
+            environ['wsgi.input'] = io.BytesIO(body)
+        return body
+
+    def _verdict(self, environ):
+        # Query string bytes arrive as latin-1 decoded text (PEP 3333)
+        query = environ.get('QUERY_STRING', '').encode('latin-1', 'replace')
+        body = self._read_body(environ)
+        if body is None:
+            return UNKNOWN_LENGTH
+        search = self.prefilter.search
+        verdict = CLEAN
+        for part, data in (('query', query), ('body', body)):
+            if data and search(data):
+                text = data.decode('utf-8', 'replace')
+                bad, detail = self.analyze(text)
+                verdict = {'bad': bad, 'scored': True, 'part': part, 'detail': detail, 'text': text}
+                if bad:
+                    break
+        return verdict
+
+    def __call__(self, environ, start_response):
+        if self.exempt_prefixes and environ.get('PATH_INFO', '').startswith(self.exempt_prefixes):
+            return self.app(environ, start_response)
+        verdict = self._verdict(environ)
+        environ['sqli.verdict'] = verdict
+        blocked = self.block and verdict['bad']
+        if self.on_verdict is not None:
+            self.on_verdict(environ, verdict, blocked)
+        if blocked:
+            payload = json.dumps({'success': False, 'message': 'Request blocked'}).encode('utf-8')
+            start_response('403 Forbidden', [('Content-Type', 'application/json'),
+                                             ('Content-Length', str(len(payload)))])
+            return [payload]
+        return self.app(environ, start_response)
@@ -0,0 +1,125 @@
+import logging
+import queue
+import threading
+import time
+
+LOG = logging.getLogger('app.event_log')
+
+# Sentinel pushed on the queue to stop the writer
+_STOP = object()
+
+
+class EventLogWriter:
+    """Group-committed log writer shared by all request handlers.
+
+    Handlers call write(sink, row), which only enqueues the row. A background
+    thread collects rows and hands each sink's rows to its storage backend
+    (see storage.py) in one append() per batch, once `batch_size` rows are
+    pending or `flush_interval_ms` has passed, whichever comes first. The CSV
+    backend writes a batch under an exclusive flock and the SQLite backend in
+    one transaction, so several worker processes never interleave rows.
+    """
+
+    def __init__(self, batch_size=512, flush_interval_ms=50.0, max_queue=100000):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval_ms)) / 1000.0
+        self._sinks = {}
+        self._listeners = []
+        self._flush_observers = []
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Restart the writer in a forked child, where only the forking thread survives.
+
+        Rows the parent had queued stay with the parent; the child starts empty.
+        """
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._closed = False
+        self._start()
+
+    def add_sink(self, name, storage):
+        """Route rows written to `name` to the storage's table of the same name."""
+        if name not in storage.tables:
+            raise KeyError(f'{type(storage).__name__} has no table {name}')
+        self._sinks[name] = storage
+
+    def add_listener(self, callback):
+        """Call callback(sink, rows) from the writer thread after each batch is written."""
+        self._listeners.append(callback)
+
+    def add_flush_observer(self, callback):
+        """Call callback(sink, seconds, n_rows) with the time each batch took to write."""
+        self._flush_observers.append(callback)
+
+    def write(self, sink, row):
+        if sink not in self._sinks:
+            raise KeyError(f'Unknown log sink: {sink}')
+        self._queue.put((sink, row))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Drain every queued row to storage (closing the storage is up to the caller)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _flush(self, batch):
+        by_sink = {}
+        for sink, row in batch:
+            by_sink.setdefault(sink, []).append(row)
+        for sink, rows in by_sink.items():
+            started = time.perf_counter()
+            try:
+                self._sinks[sink].append(sink, rows)
+            except Exception as e:
+                LOG.error('Failed to write %d rows to %s: %s', len(rows), sink, e)
+                continue
+            elapsed = time.perf_counter() - started
+            for callback in self._flush_observers:
+                callback(sink, elapsed, len(rows))
+            for callback in self._listeners:
+                try:
+                    callback(sink, rows)
+                except Exception as e:
+                    LOG.error('Event log listener failed: %s', e)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # Drain anything enqueued after the stop request was seen
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
@@ -0,0 +1,112 @@
+import json
+import queue
+import threading
+
+# In-process fan-out for /api/stream (server-sent events). Each event is encoded
+# once, however many dashboards are connected, and pushed onto every client's
+# bounded queue without blocking. A client that lets its queue fill up (a slow
+# or stalled connection) is dropped rather than holding up the publisher or
+# growing memory; its browser reconnects and starts over from a snapshot.
+
+# Sentinel pushed on a dropped client's queue so its stream ends promptly
+_DROPPED = object()
+
+
+def format_event(event, data):
+    """One SSE frame: `event` name and JSON `data`."""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class Subscriber:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = False
+
+    def push(self, frame):
+        """Queue a frame; False if the queue is full (the client is too slow)."""
+        if self.dropped:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            return False
+
+
+class EventPublisher:
+    def __init__(self, max_clients=20, client_queue=1000, heartbeat=15.0, retry_ms=3000):
+        self.max_clients = max_clients
+        self.client_queue = client_queue
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self.dropped_total = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """A new Subscriber, or None when max_clients are already connected."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = Subscriber(self.client_queue)
+            self._subscribers = self._subscribers + [subscriber]
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+    def clients(self):
+        return len(self._subscribers)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event, data):
+        """Send an event to every connected client; costs nothing when none are."""
+        subscribers = self._subscribers  # replaced, never mutated, so no lock needed
+        if not subscribers:
+            return
+        frame = format_event(event, data)
+        for subscriber in subscribers:
+            if not subscriber.push(frame):
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        with self._lock:
+            if subscriber.dropped:
+                return
+            subscriber.dropped = True
+            self.dropped_total += 1
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+        # Make room for the sentinel so the stream generator wakes up and ends
+        # (a publisher racing with the drop may have slipped one more frame in)
+        while True:
+            try:
+                while True:
+                    subscriber.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.queue.put_nowait(_DROPPED)
+                return
+            except queue.Full:
+                continue
+
+    def frames(self, subscriber, first=()):
+        """SSE text for one client: the `first` frames, then events until it disconnects or is dropped."""
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            yield from first
+            while True:
+                try:
+                    frame = subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'  # also how a closed connection gets noticed
+                    continue
+                if frame is _DROPPED:
+                    yield format_event('dropped', {'reason': 'client too slow'})
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,163 @@
+import os
+import re
+from itertools import repeat
+
+import numpy as np
+
+# Shared feature extraction for app.py, train_model.py and app_streamlit.py.
+# The column order here must match feature_columns.pkl written by train_model.py.
+FEATURE_COLUMNS = ['body_length', 'has_special_chars', 'has_sql_keywords', 'has_path_traversal',
+                   'body_contains_slash', 'f1', 'f2', 'f3']
+
+# Columns taken from the dataset row instead of the body (always 0 online)
+PLACEHOLDER_COLUMNS = ['f1', 'f2', 'f3']
+
+# Optional login velocity columns (see rate_tracker.Velocity), stored in the
+# dataset's f4..f6 fields: requests from the client IP in the burst window,
+# requests from the IP and attempts on the username in the longer window.
+# Online they come from app.py's rate tracker; rows logged before it have 0.
+VELOCITY_COLUMNS = ['ip_burst', 'ip_window', 'user_window']
+VELOCITY_DATASET_FIELDS = ['f4', 'f5', 'f6']
+
+SPECIAL_CHARS = ["'", '"', '-', ';', '*']
+SQL_KEYWORDS = ['union', 'select', 'drop', 'insert', 'update', 'delete', 'exec', 'script']
+
+# Optional column holding the probability the character n-gram model (see
+# ngram_hashing.py) gives the body; computed by the NgramScorer passed as `ngram`
+NGRAM_COLUMN = 'ngram_score'
+
+# Optional signature columns: 'sig_<category>' counts the distinct rules of that
+# category (see signatures.rules) hit by the normalized body
+SIGNATURE_PREFIX = 'sig_'
+
+# Compiled once; used by both the single-body and the batch path
+SPECIAL_CHARS_RE = re.compile('[' + re.escape(''.join(SPECIAL_CHARS)) + ']')
+SQL_KEYWORDS_RE = re.compile('|'.join(SQL_KEYWORDS))
+
+
+def extract_features(body, f1=0, f2=0, f3=0):
+    s = str(body)
+    return {
+        'body_length': len(s),
+        'has_special_chars': 1 if SPECIAL_CHARS_RE.search(s) else 0,
+        'has_sql_keywords': 1 if SQL_KEYWORDS_RE.search(s.lower()) else 0,
+        'has_path_traversal': 1 if '..' in s else 0,
+        'body_contains_slash': s.count('/'),
+        'f1': f1,
+        'f2': f2,
+        'f3': f3,
+    }
+
+
+_scanner = None
+
+
+def get_scanner():
+    """Signature scanner shared by every caller, built on first use.
+
+    Without a rules file it has no rules, so callers can test `scanner.rules`
+    instead of looking for the file on every request.
+    """
+    global _scanner
+    if _scanner is None:
+        from signatures import RULES_PATH, SignatureScanner
+        _scanner = SignatureScanner.from_file() if os.path.exists(RULES_PATH) else SignatureScanner(())
+    return _scanner
+
+
+def signature_features(body):
+    scanner = get_scanner()
+    counts = scanner.category_counts(scanner.scan(body))
+    return {SIGNATURE_PREFIX + c: int(n) for c, n in zip(scanner.categories, counts)}
+
+
+def _require_ngram(ngram):
+    if ngram is None:
+        raise ValueError(f'{NGRAM_COLUMN} needs the n-gram model (see ngram_hashing.load_ngram_model)')
+    return ngram
+
+
+def extract_feature_vector(body, columns=None, velocity=None, ngram=None):
+    columns = columns or FEATURE_COLUMNS
+    features = extract_features(body)
+    features.update(zip(VELOCITY_COLUMNS, velocity or (0, 0, 0)))
+    if any(c.startswith(SIGNATURE_PREFIX) for c in columns):
+        features.update(signature_features(body))
+    if NGRAM_COLUMN in columns:
+        features[NGRAM_COLUMN] = _require_ngram(ngram).score(body)
+    return np.array([[features[c] for c in columns]], dtype=np.float64)
+
+
+def signature_columns():
+    return [SIGNATURE_PREFIX + c for c in get_scanner().categories]
+
+
+def _signature_matrix(strs):
+    """(n_rows, n_categories) distinct-rule hit counts; each body is scanned once."""
+    scanner = get_scanner()
+    S = np.zeros((len(strs), len(scanner.categories)), dtype=np.float64)
+    for i, s in enumerate(strs):
+        matches = scanner.scan(s)
+        if matches:
+            S[i] = scanner.category_counts(matches)
+    return S
+
+
+def dataset_extra(df):
+    """Per-row values of the non-body columns in a parsed login_dataset.csv frame."""
+    extra = {c: df[c].to_numpy() for c in PLACEHOLDER_COLUMNS}
+    extra.update({c: df[f].to_numpy() for c, f in zip(VELOCITY_COLUMNS, VELOCITY_DATASET_FIELDS)})
+    return extra
+
+
+def _as_strings(bodies):
+    # Same coercion as str(body) in the per-body path (NaN -> 'nan')
+    if hasattr(bodies, 'tolist'):
+        bodies = bodies.tolist()
+    return [b if type(b) is str else str(b) for b in bodies]
+
+
+def extract_features_batch(bodies, columns=None, extra=None, out=None, ngram=None):
+    """Return an (n_rows, n_columns) float64 matrix for a list/Series of bodies.
+
+    Every base column is computed with one C-level pass (compiled regex / str
+    methods driven by map) so no Python code runs per row; sig_* columns scan
+    each body once with the signature automaton. `extra` maps
+    placeholder and velocity column names to per-row values (see
+    dataset_extra); missing ones are filled with 0. The ngram_score column
+    comes from `extra` when given there, else from the NgramScorer `ngram`,
+    which hashes the whole batch at once. `out` is an optional
+    preallocated array with at least n_rows rows to fill (any float dtype);
+    the returned matrix is then a view of it.
+    """
+    columns = columns or FEATURE_COLUMNS
+    strs = _as_strings(bodies)
+    n = len(strs)
+    extra = extra or {}
+    computed = {
+        'body_length': lambda: map(len, strs),
+        'has_special_chars': lambda: map(bool, map(SPECIAL_CHARS_RE.search, strs)),
+        'has_sql_keywords': lambda: map(bool, map(SQL_KEYWORDS_RE.search, map(str.lower, strs))),
+        'has_path_traversal': lambda: map(str.__contains__, strs, repeat('..')),
+        'body_contains_slash': lambda: map(str.count, strs, repeat('/')),
+    }
+
+    signatures = None
+    if any(c.startswith(SIGNATURE_PREFIX) for c in columns):
+        signatures = dict(zip(signature_columns(), _signature_matrix(strs).T))
+
+    X = np.zeros((n, len(columns)), dtype=np.float64) if out is None else out[:n]
+    for i, col in enumerate(columns):
+        if col in computed:
+            X[:, i] = np.fromiter(computed[col](), dtype=np.float64, count=n)
+        elif col in extra:
+            X[:, i] = np.asarray(extra[col], dtype=np.float64)
+        elif signatures is not None and col in signatures:
+            X[:, i] = signatures[col]
+        elif col == NGRAM_COLUMN:
+            X[:, i] = _require_ngram(ngram).score_batch(strs)
+        elif col in PLACEHOLDER_COLUMNS or col in VELOCITY_COLUMNS:
+            X[:, i] = 0
+        else:
+            raise KeyError(f'Unknown feature column: {col}')
+    return X
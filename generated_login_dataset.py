@@ -70,12 +70,13 @@ def gen_bad_requests(n=500):
 # ============================
 # CREATE DATASET
 # ============================
-good = gen_good_requests(500)
-bad = gen_bad_requests(500)
+if __name__ == "__main__":
+    good = gen_good_requests(500)
+    bad = gen_bad_requests(500)
 
-with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    for row in good + bad:
-        writer.writerow(row)
+    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for row in good + bad:
+            writer.writerow(row)
 
-print("Dataset created:", OUTPUT_FILE)
+    print("Dataset created:", OUTPUT_FILE)
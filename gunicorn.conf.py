@@ -0,0 +1,45 @@
+import gc
+import os
+
+# gunicorn settings for app.py; gunicorn reads this file from the working
+# directory, so `gunicorn app:app` is enough. It mirrors serve.py: app.py is
+# imported once in the master (preload_app) and gc.freeze() keeps the loaded
+# model's pages shared copy-on-write; each worker takes its own dashboard
+# counter slot and restarts app.py's background threads in post_fork; the
+# master saves the dashboard checkpoint and the dedup state when it exits
+# (app._shutdown, registered with atexit), after every worker drained its log.
+workers = int(os.environ.get('WORKERS', 0)) or getattr(os, 'process_cpu_count', os.cpu_count)() or 1
+# app.py creates one counter slot per worker when it is imported
+os.environ['WORKERS'] = str(workers)
+bind = f"{os.environ.get('HOST', '127.0.0.1')}:{os.environ.get('PORT', 5000)}"
+backlog = int(os.environ.get('LISTEN_BACKLOG', 1024))
+preload_app = True
+# Threads per worker: every open /api/stream dashboard holds one
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 8))
+# No access log (gunicorn's default): app.py logs requests at DEBUG, sampled
+
+
+def when_ready(server):
+    gc.collect()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # The lowest slot no live worker holds, so a restarted worker takes over its predecessor's
+    taken = {getattr(w, 'slot', None) for w in server.WORKERS.values()}
+    free = sorted(set(range(1, workers + 1)) - taken)
+    if not free:
+        # More workers than WORKERS (TTIN): slots are sized at import, so share one
+        server.log.warning('No free dashboard counter slot; set WORKERS to the worker count')
+    worker.slot = free[0] if free else 1
+
+
+def post_fork(server, worker):
+    import app
+    app.worker_init(worker.slot)
+
+
+def worker_exit(server, worker):
+    import app
+    app.worker_shutdown()
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Sentinel pushed on the queue to stop the worker
+_STOP = object()
+
+
+def bad_probability(model, X, feature_cols):
+    """Probability of the 'bad' (1) class for each row of the feature matrix X."""
+    if hasattr(model, 'feature_names_in_'):
+        # Model was fitted on a DataFrame; keep sklearn's column check quiet
+        import pandas as pd
+        X = pd.DataFrame(X, columns=list(feature_cols))
+    bad_index = list(getattr(model, 'classes_', [0, 1])).index(1)
+    return model.predict_proba(X)[:, bad_index]
+
+
+class BatchScorer:
+    """Micro-batching front end for a fitted classifier.
+
+    Callers submit one feature row at a time; a background thread collects
+    whatever arrives within `max_wait_ms` (up to `max_batch_size` rows) and
+    scores it with a single predict_proba call. Each caller gets its own
+    probability back through a Future.
+    """
+
+    def __init__(self, model, feature_cols, max_batch_size=64, max_wait_ms=2.0):
+        self.model = model
+        self.feature_cols = list(feature_cols)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='batch-scorer', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Restart the worker thread in a forked child (a closed scorer stays closed)."""
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        if not self._closed:
+            self._start()
+
+    def submit(self, row):
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._queue.put((row, future))
+                return future
+        # Closed (e.g. a model that was swapped out): score inline
+        self._score_batch([(row, future)])
+        return future
+
+    def score(self, row, timeout=None):
+        """Return the probability that the feature row (in feature_cols order) is malicious."""
+        return self.submit(row).result(timeout)
+
+    def pending(self):
+        """Rows queued and not yet picked up by the worker."""
+        return self._queue.qsize()
+
+    def close(self):
+        """Stop the worker once everything already submitted has been scored."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _score_batch(self, batch):
+        try:
+            X = np.vstack([row for row, _ in batch]).astype(np.float64)
+            probs = bad_probability(self.model, X, self.feature_cols)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), p in zip(batch, np.asarray(probs, dtype=np.float64)):
+            future.set_result(float(p))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._score_batch(batch)
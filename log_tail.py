@@ -0,0 +1,67 @@
+import csv
+import io
+import os
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _header_end(f):
+    """Byte offset just past the header line (headers never contain quotes)."""
+    f.seek(0)
+    line = f.readline()
+    return len(line) if line.endswith(b'\n') else 0
+
+
+def read_tail(path, limit, before=None, has_header=True, block_size=BLOCK_SIZE):
+    """Return (records, cursor) for the last `limit` CSV records ending at `before`.
+
+    The file is read backwards in blocks and only the bytes holding the wanted
+    records are parsed, so the cost depends on `limit`, not on the file size.
+    A newline is a record boundary only when the bytes between it and the
+    (known good) end offset contain an even number of quote characters; csv
+    doubles quotes inside quoted fields, so this keeps multi-line quoted
+    bodies intact.
+
+    `before` is a byte offset previously returned as `cursor` (None means the
+    end of the file). `cursor` is the offset of the oldest returned record, or
+    None once the start of the data has been reached.
+    """
+    if limit <= 0 or not os.path.exists(path):
+        return [], None
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        floor = _header_end(f) if has_header else 0
+        end = size if before is None else max(floor, min(int(before), size))
+
+        buf = b''
+        buf_start = end
+        starts = []  # record start offsets, newest first
+        scan = 0  # index in buf below which newlines have not been checked yet
+        quotes = 0  # quotes between the last checked newline and `end`
+        while len(starts) < limit and buf_start > floor:
+            read_from = max(floor, buf_start - block_size)
+            f.seek(read_from)
+            chunk = f.read(buf_start - read_from)
+            buf = chunk + buf
+            scan += len(chunk)
+            buf_start = read_from
+            while len(starts) < limit:
+                nl = buf.rfind(b'\n', 0, scan)
+                if nl < 0:
+                    quotes += buf.count(b'"', 0, scan)
+                    scan = 0
+                    break
+                quotes += buf.count(b'"', nl + 1, scan)
+                scan = nl
+                start = buf_start + nl + 1
+                if quotes % 2 == 0 and start < end:
+                    starts.append(start)
+        if len(starts) < limit and buf_start <= floor and end > floor:
+            starts.append(floor)
+
+        if not starts:
+            return [], None
+        first = starts[-1]
+        text = buf[first - buf_start:end - buf_start].decode('utf-8')
+        records = [row for row in csv.reader(io.StringIO(text, newline='')) if row]
+        return records, (first if first > floor else None)
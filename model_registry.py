@@ -0,0 +1,304 @@
+import csv
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from compiled_forest import COMPILED_MODEL_PATH, CompiledForest
+from features import VELOCITY_COLUMNS, extract_features_batch
+from inference import BatchScorer, bad_probability
+from ngram_hashing import NGRAM_MODEL_PATH, load_ngram_model
+
+LOG = logging.getLogger('app.model_registry')
+
+# Holds the model app.py scores with and replaces it while the server runs.
+# Everything a request needs (model, feature columns, micro-batch scorer) lives in
+# one immutable ModelBundle; handlers take registry.current() once and use that
+# bundle to the end, so a swap is a single reference assignment and never blocks
+# or mixes two models inside one request. Loading and validation happen on a
+# background thread; the previous bundle is kept for rollback.
+MODEL_PATH = 'login_classifier.pkl'
+FEATURE_COLUMNS_PATH = 'feature_columns.pkl'
+
+# uses_velocity: whether the model takes the login velocity columns, i.e. whether
+# the rate tracker's counts passed at scoring time can change the verdict;
+# ngram: the NgramScorer behind the ngram_score column (None if the model has none);
+# batch_model: what whole matrices (/api/bulk-score) are scored with, see load_batch_model
+ModelBundle = namedtuple('ModelBundle', ['model', 'feature_cols', 'scorer', 'source', 'version',
+                                         'accuracy', 'loaded_at', 'uses_velocity', 'ngram', 'batch_model'])
+
+
+def load_model_files(compiled_path=COMPILED_MODEL_PATH, model_path=MODEL_PATH,
+                     columns_path=FEATURE_COLUMNS_PATH):
+    """(model, feature_cols, source) from the artifacts on disk, or None if there are none.
+
+    The compiled forest is preferred unless the pickle is clearly newer (a
+    retrained pickle dropped in without re-exporting). A checkout writes both
+    within moments of each other, hence the slack. A compiled file written by
+    another format version is skipped in favour of the pickle when there is
+    one; otherwise its ValueError is raised. Only the pickle path imports
+    joblib (and with it sklearn).
+    """
+    has_pickle = os.path.exists(model_path) and os.path.exists(columns_path)
+    if os.path.exists(compiled_path) and (
+            not has_pickle or os.path.getmtime(compiled_path) >= os.path.getmtime(model_path) - 2):
+        try:
+            model = CompiledForest.load(compiled_path)
+            return model, list(model.feature_columns), compiled_path
+        except ValueError as e:
+            if not has_pickle:
+                raise
+            LOG.warning('%s; falling back to %s', e, model_path)
+    if has_pickle:
+        import joblib
+        return joblib.load(model_path), list(joblib.load(columns_path)), model_path
+    return None
+
+
+def load_batch_model(model, feature_cols, compiled_path=COMPILED_MODEL_PATH, model_path=MODEL_PATH,
+                     columns_path=FEATURE_COLUMNS_PATH):
+    """The model to score whole batches with: `model`, or the pickle it was exported from.
+
+    The pickle is used when `model` is a compiled forest whose batch walk is
+    slower than sklearn (CompiledForest.fast_batches is False: deep, bushy
+    trees) and a pickle of the same training sits next to it, i.e. one not
+    older than the compiled file and with the same feature columns.
+    """
+    if not isinstance(model, CompiledForest) or model.fast_batches:
+        return model
+    if not (os.path.exists(model_path) and os.path.exists(columns_path)) or \
+            os.path.getmtime(model_path) < os.path.getmtime(compiled_path) - 2:
+        return model
+    import joblib
+    try:
+        if list(joblib.load(columns_path)) == list(feature_cols):
+            return joblib.load(model_path)
+    except Exception as e:
+        LOG.warning('Scoring batches with the compiled forest, %s failed to load: %s', model_path, e)
+    return model
+
+
+def load_pinned_sample(dataset_path, per_label=200):
+    """First `per_label` 'good' and 'bad' bodies of the dataset as (bodies, y)."""
+    bodies, labels = [], []
+    counts = {'good': 0, 'bad': 0}
+    if os.path.exists(dataset_path):
+        with open(dataset_path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+            for row in csv.reader(f):
+                label = row[-1].strip() if len(row) >= 3 else ''
+                if label in counts and counts[label] < per_label:
+                    counts[label] += 1
+                    bodies.append(row[2])
+                    labels.append(1 if label == 'bad' else 0)
+                    if min(counts.values()) >= per_label:
+                        break
+    return bodies, np.array(labels, dtype=np.int8)
+
+
+class ModelRegistry:
+    def __init__(self, dataset_path, compiled_path=COMPILED_MODEL_PATH, model_path=MODEL_PATH,
+                 columns_path=FEATURE_COLUMNS_PATH, ngram_path=NGRAM_MODEL_PATH, sample_per_label=200,
+                 min_accuracy=0.9, max_accuracy_drop=0.05, scorer_options=None, on_swap=None):
+        self.dataset_path = dataset_path
+        self.paths = (compiled_path, model_path, columns_path)
+        self.ngram_path = ngram_path
+        self.sample_per_label = sample_per_label
+        self.min_accuracy = min_accuracy
+        self.max_accuracy_drop = max_accuracy_drop
+        self.scorer_options = scorer_options or {}
+        self.on_swap = on_swap
+        self.last_error = None
+        self._active = None
+        self._previous = None
+        self._version = 0
+        self._sample = None
+        self._fingerprint = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watch_interval = None
+        self._stop = threading.Event()
+
+    def current(self):
+        """The bundle to score with (None when no model is loaded)."""
+        return self._active
+
+    def fingerprint(self):
+        """(path, mtime_ns, size) of each model artifact present; changes whenever one is rewritten."""
+        stats = []
+        for path in self.paths + (self.ngram_path,):
+            try:
+                st = os.stat(path)
+                stats.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stats.append((path, None, None))
+        return tuple(stats)
+
+    def _pinned_sample(self):
+        # Pinned at the first validation, so every candidate is judged on the same rows
+        if self._sample is None:
+            self._sample = load_pinned_sample(self.dataset_path, self.sample_per_label)
+        return self._sample
+
+    def _load(self):
+        """(model, feature_cols, source, ngram) from disk, or None if there is no model."""
+        loaded = load_model_files(*self.paths)
+        if loaded is None:
+            return None
+        return (*loaded, load_ngram_model(loaded[1], self.ngram_path))
+
+    def _validate(self, model, feature_cols, ngram):
+        """Accuracy of the candidate on the pinned sample; raises ValueError if it is unfit."""
+        bodies, y = self._pinned_sample()
+        if not len(y):
+            return None
+        X = extract_features_batch(bodies, feature_cols, ngram=ngram)
+        probs = np.asarray(bad_probability(model, X, feature_cols))
+        if probs.shape != y.shape or not np.all(np.isfinite(probs)) or probs.min() < 0 or probs.max() > 1:
+            raise ValueError('model returned invalid probabilities on the pinned sample')
+        return float(((probs >= 0.5) == y).mean())
+
+    def _build(self, loaded, accuracy):
+        model, feature_cols, source, ngram = loaded
+        scorer = None
+        if not isinstance(model, CompiledForest):
+            # The sklearn model goes through the micro-batching worker; the compiled
+            # forest is cheap enough to score inline on the request thread
+            scorer = BatchScorer(model, feature_cols, **self.scorer_options)
+        self._version += 1
+        uses_velocity = any(c in VELOCITY_COLUMNS for c in feature_cols)
+        batch_model = load_batch_model(model, feature_cols, *self.paths) if source == self.paths[0] else model
+        return ModelBundle(model, feature_cols, scorer, source, self._version, accuracy, time.time(),
+                           uses_velocity, ngram, batch_model)
+
+    def _swap(self, bundle):
+        retired = self._previous
+        self._previous = self._active
+        self._active = bundle
+        if retired is not None and retired.scorer is not None and retired is not bundle:
+            retired.scorer.close()
+        if self.on_swap is not None:
+            self.on_swap(bundle)
+
+    def load(self):
+        """Initial load at startup; the model is used even if validation finds it weak."""
+        with self._reload_lock:
+            self._fingerprint = self.fingerprint()
+            loaded = self._load()
+            if loaded is None:
+                return None
+            accuracy = None
+            try:
+                accuracy = self._validate(*loaded[:2], loaded[3])
+                if accuracy is not None and accuracy < self.min_accuracy:
+                    LOG.warning('%s scores %.3f on the pinned sample', loaded[2], accuracy)
+            except Exception as e:
+                LOG.warning('Model failed validation: %s', e)
+            self._swap(self._build(loaded, accuracy))
+            return self._active
+
+    def reload(self):
+        """Load, validate and swap in the artifacts on disk; returns the new bundle.
+
+        Raises ValueError (keeping the active model) when the candidate is missing
+        or scores worse than allowed on the pinned sample.
+        """
+        with self._reload_lock:
+            self._fingerprint = self.fingerprint()
+            try:
+                loaded = self._load()
+                if loaded is None:
+                    raise ValueError('no model artifacts found')
+                accuracy = self._validate(*loaded[:2], loaded[3])
+                if accuracy is not None:
+                    floor = self.min_accuracy
+                    active = self._active
+                    if active is not None and active.accuracy is not None:
+                        floor = max(floor, active.accuracy - self.max_accuracy_drop)
+                    if accuracy < floor:
+                        raise ValueError(f'accuracy {accuracy:.3f} on the pinned sample is below {floor:.3f}')
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                LOG.error('Model reload rejected: %s', self.last_error)
+                raise ValueError(self.last_error) from e
+            self.last_error = None
+            self._swap(self._build(loaded, accuracy))
+            LOG.warning('Model reloaded from %s (version %s, pinned-sample accuracy %s)', loaded[2], self._version, accuracy)
+            return self._active
+
+    def reload_async(self):
+        """Start reload() on a background thread; returns False if one is already running."""
+        if self._reload_lock.locked():
+            return False
+
+        def run():
+            try:
+                self.reload()
+            except ValueError:
+                pass  # recorded in last_error
+
+        threading.Thread(target=run, name='model-reload', daemon=True).start()
+        return True
+
+    def rollback(self):
+        """Swap the previous model back in; returns the restored bundle or None."""
+        with self._reload_lock:
+            if self._previous is None:
+                return None
+            # The bundle being replaced becomes 'previous', so rollback can be undone
+            self._active, self._previous = self._previous, self._active
+            if self.on_swap is not None:
+                self.on_swap(self._active)
+            return self._active
+
+    def watch(self, interval):
+        """Poll the artifacts every `interval` seconds and reload when they change."""
+        self._watch_interval = interval
+
+        def run():
+            seen = self.fingerprint()
+            while not self._stop.wait(interval):
+                current = self.fingerprint()
+                # Reload once the files have stopped changing for a full interval,
+                # so a half-written artifact is never picked up
+                if current == seen and current != self._fingerprint:
+                    try:
+                        self.reload()
+                    except ValueError:
+                        pass
+                seen = current
+
+        self._watcher = threading.Thread(target=run, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def after_fork(self):
+        """Restart the watcher and the scorers' worker threads in a forked child.
+
+        The loaded bundles themselves are kept: their arrays are the parent's
+        pages, shared copy-on-write. Each worker then watches and reloads on its
+        own, so they all pick up a retrained model within one interval.
+        """
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        for bundle in (self._active, self._previous):
+            if bundle is not None and bundle.scorer is not None:
+                bundle.scorer.after_fork()
+        if self._watch_interval is not None:
+            self.watch(self._watch_interval)
+
+    def close(self):
+        self._stop.set()
+        for bundle in (self._active, self._previous):
+            if bundle is not None and bundle.scorer is not None:
+                bundle.scorer.close()
+
+    def status(self):
+        def describe(bundle):
+            if bundle is None:
+                return None
+            return {'source': bundle.source, 'version': bundle.version, 'accuracy': bundle.accuracy,
+                    'loaded_at': bundle.loaded_at, 'feature_columns': bundle.feature_cols}
+        return {'active': describe(self._active), 'previous': describe(self._previous),
+                'last_error': self.last_error, 'reloading': self._reload_lock.locked()}
@@ -0,0 +1,228 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from compiled_forest import CompiledForest, export_forest
+from ngram_hashing import NGRAM_FEATURES, NGRAM_RANGE, hash_ngrams
+
+# Model comparison for train_model.py (TRAIN_MODE=search). Every candidate is
+# scored with stratified k-fold cross-validation; the fold fits run in a process
+# pool that receives the dataset once per worker (in this process when only one
+# worker is asked for or fork is unavailable). Each candidate is then fitted
+# on the whole training split and timed in this process, one at a time, the way
+# app.py would score it: the compiled forest for random forests, predict_proba
+# for the rest. The fastest candidate whose recall on the bad class reaches the
+# floor wins, since a small forest often catches exactly what a big one does.
+
+# (name, kind, parameters); forest_100 is the model the other modes train
+CANDIDATES = [
+    ('forest_10_d6', 'forest', {'n_estimators': 10, 'max_depth': 6}),
+    ('forest_20_d8', 'forest', {'n_estimators': 20, 'max_depth': 8}),
+    ('forest_20', 'forest', {'n_estimators': 20}),
+    ('forest_50', 'forest', {'n_estimators': 50}),
+    ('forest_100', 'forest', {'n_estimators': 100}),
+    ('forest_100_d8', 'forest', {'n_estimators': 100, 'max_depth': 8}),
+    ('gradient_boosting', 'gradient_boosting', {'n_estimators': 100, 'max_depth': 3}),
+    ('logreg_char_ngrams', 'ngram_logreg', {'ngram_range': NGRAM_RANGE, 'n_features': NGRAM_FEATURES, 'C': 10.0}),
+]
+
+# Rows per call for the batch latency
+LATENCY_BATCH_ROWS = 1000
+
+# Dataset shared by the fold fits of one pool worker (set by _init_worker)
+_DATA = {}
+
+
+def build_model(kind, params, seed=42):
+    """Unfitted estimator for a candidate; sklearn is imported here, not at module load."""
+    if kind == 'forest':
+        from sklearn.ensemble import RandomForestClassifier
+        # One core per fit: the pool already runs one fit per core
+        return RandomForestClassifier(random_state=seed, n_jobs=1, **params)
+    if kind == 'gradient_boosting':
+        from sklearn.ensemble import GradientBoostingClassifier
+        return GradientBoostingClassifier(random_state=seed, **params)
+    if kind == 'ngram_logreg':
+        # The same hashing as the ngram_score column (ngram_hashing.py)
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import FunctionTransformer
+        params = dict(params)
+        C = params.pop('C', 1.0)
+        return make_pipeline(FunctionTransformer(hashed_ngrams, kw_args=params, accept_sparse=True),
+                             LogisticRegression(C=C, max_iter=1000, random_state=seed))
+    raise ValueError(f'Unknown model kind: {kind!r}')
+
+
+def hashed_ngrams(bodies, n_features=NGRAM_FEATURES, ngram_range=NGRAM_RANGE):
+    """scipy CSR matrix of hashed n-grams (a module-level function, so pipelines pickle)."""
+    return hash_ngrams(bodies, n_features, tuple(ngram_range)).to_scipy()
+
+
+def uses_bodies(kind):
+    """Whether the candidate reads the raw body text instead of the feature columns."""
+    return kind == 'ngram_logreg'
+
+
+def _init_worker(X, y, bodies):
+    _DATA.update(X=X, y=y, bodies=bodies)
+
+
+def _inputs(kind, index):
+    if uses_bodies(kind):
+        bodies = _DATA['bodies']
+        return [bodies[i] for i in index]
+    return _DATA['X'][index]
+
+
+def _fit_fold(name, kind, params, train_index, test_index):
+    """Fit on one fold's training rows; (name, y_true, predicted) on its test rows."""
+    model = build_model(kind, params)
+    model.fit(_inputs(kind, train_index), _DATA['y'][train_index])
+    return name, _DATA['y'][test_index], model.predict(_inputs(kind, test_index))
+
+
+def _fit_full(name, kind, params):
+    model = build_model(kind, params)
+    everything = np.arange(len(_DATA['y']))
+    model.fit(_inputs(kind, everything), _DATA['y'])
+    return name, model
+
+
+def _scores(y_true, predicted):
+    true_bad = int(np.sum((predicted == 1) & (y_true == 1)))
+    flagged = int(np.sum(predicted == 1))
+    bad = int(np.sum(y_true == 1))
+    return {
+        'accuracy': float(np.mean(predicted == y_true)),
+        'precision': true_bad / flagged if flagged else 0.0,
+        'recall': true_bad / bad if bad else 1.0,
+    }
+
+
+def measure_latency(kind, model, X, bodies, repeats=200):
+    """(median seconds for one row, seconds per row in batches, artifact bytes) as app.py would serve it."""
+    from inference import bad_probability
+
+    if kind == 'forest':
+        fd, path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            export_forest(model, [str(i) for i in range(X.shape[1])], path)
+            size = os.path.getsize(path)
+            compiled = CompiledForest.load(path)
+        finally:
+            os.remove(path)
+        rows = X.tolist()
+        inputs = X
+
+        def score_one(i):
+            compiled.score_row(rows[i % len(rows)])
+
+        score_batch = compiled.predict_proba
+    else:
+        size = len(pickle.dumps(model))
+        inputs = np.asarray(bodies, dtype=object) if uses_bodies(kind) else X
+
+        def score_one(i):
+            bad_probability(model, inputs[i % len(inputs):][:1], None)
+
+        def score_batch(batch):
+            bad_probability(model, batch, None)
+
+    score_one(0)  # warm up
+    timings = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        score_one(i)
+        timings.append(time.perf_counter() - started)
+    batch = inputs[:LATENCY_BATCH_ROWS]
+    started = time.perf_counter()
+    for _ in range(3):
+        score_batch(batch)
+    per_row_batch = (time.perf_counter() - started) / (3 * len(batch))
+    return float(np.median(timings)), per_row_batch, size
+
+
+def select(results, min_recall):
+    """Fastest deployable candidate with cross-validated recall >= min_recall.
+
+    Falls back to the deployable candidate with the best recall when none
+    reaches the floor; returns (result, met_floor).
+    """
+    deployable = [r for r in results if r['deployable']]
+    if not deployable:
+        raise ValueError('no deployable candidate in the search')
+    passing = [r for r in deployable if r['recall'] >= min_recall]
+    if passing:
+        return min(passing, key=lambda r: (r['row_us'], -r['recall'], r['size_bytes'])), True
+    return max(deployable, key=lambda r: (r['recall'], r['accuracy'], -r['row_us'])), False
+
+
+def search(X, y, bodies=None, candidates=CANDIDATES, folds=5, workers=None, seed=42):
+    """Cross-validate and time every candidate; returns (results, fitted models by name).
+
+    X is the feature matrix, y the 0/1 labels and `bodies` the raw bodies, which
+    body-based candidates need (they are skipped without them).
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.int64)
+    candidates = [c for c in candidates if bodies is not None or not uses_bodies(c[1])]
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y))
+    predictions = {name: ([], []) for name, _, _ in candidates}
+
+    initargs = (X, y, list(bodies) if bodies is not None else None)
+    fold_args = [(name, kind, params, train, test) for name, kind, params in candidates for train, test in splits]
+    workers = workers or os.cpu_count() or 1
+    # train_model.py is a plain script, so workers must be forked: a spawned
+    # worker would import it as __main__ and start training all over again
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            fold_jobs = [pool.submit(_fit_fold, *args) for args in fold_args]
+            full_jobs = [pool.submit(_fit_full, *c) for c in candidates]
+            folds_done = [job.result() for job in fold_jobs]
+            models = dict(job.result() for job in full_jobs)
+    else:
+        _init_worker(*initargs)
+        folds_done = [_fit_fold(*args) for args in fold_args]
+        models = dict(_fit_full(*c) for c in candidates)
+        _DATA.clear()
+    for name, y_true, predicted in folds_done:
+        predictions[name][0].append(y_true)
+        predictions[name][1].append(predicted)
+
+    results = []
+    for name, kind, params in candidates:
+        y_true, predicted = (np.concatenate(part) for part in predictions[name])
+        row_seconds, batch_seconds, size = measure_latency(kind, models[name], X, bodies)
+        results.append({
+            'name': name,
+            'kind': kind,
+            'params': {k: list(v) if isinstance(v, tuple) else v for k, v in params.items()},
+            **_scores(y_true, predicted),
+            'row_us': round(row_seconds * 1e6, 2),
+            'batch_us_per_row': round(batch_seconds * 1e6, 3),
+            'size_bytes': size,
+            # app.py scores feature columns; the n-gram signal reaches it as the
+            # ngram_score column (USE_NGRAM_FEATURES=1), not as a model of its own
+            'deployable': not uses_bodies(kind),
+        })
+    return results, models
+
+
+def print_results(results, selected=None):
+    print(f"\n{'model':<20} {'accuracy':>9} {'precision':>9} {'recall':>7} {'row us':>9} "
+          f"{'batch us/row':>12} {'size KB':>8}")
+    for r in results:
+        flag = '  <- selected' if selected is not None and r['name'] == selected else (
+            '' if r['deployable'] else '  (not deployable)')
+        print(f"{r['name']:<20} {r['accuracy']:>9.4f} {r['precision']:>9.4f} {r['recall']:>7.4f} "
+              f"{r['row_us']:>9.1f} {r['batch_us_per_row']:>12.2f} {r['size_bytes'] / 1024:>8.1f}{flag}")
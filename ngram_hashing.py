@@ -0,0 +1,205 @@
+import math
+import os
+
+import numpy as np
+
+from features import NGRAM_COLUMN
+from normalize import normalize_text
+
+# Character n-gram features for the 'ngram_score' column (see features.py).
+# Every 2..4-character substring of the normalized body is hashed straight into
+# one of NGRAM_FEATURES buckets: there is no vocabulary to store or grow, memory
+# is fixed by the bucket count, and the same function featurizes the training
+# set and a single request. A batch is hashed in one vectorized pass into a CSR
+# matrix. A logistic regression over the buckets, trained by train_model.py
+# with USE_NGRAM_FEATURES=1, turns them into one probability that the model's
+# other columns sit next to; it is saved to NGRAM_MODEL_PATH.
+NGRAM_MODEL_PATH = 'ngram_model.npz'
+NGRAM_FEATURES = 2 ** 14
+NGRAM_RANGE = (2, 4)
+FORMAT_VERSION = 1
+
+# Bodies hashed together by NgramScorer.score_batch
+SCORE_SLICE_ROWS = 1024
+
+# 64-bit polynomial hashing: a seed, the FNV prime as the base, and a
+# splitmix64 finalizer so every bit of the bucket depends on every character
+_SEED = np.uint64(0x9E3779B97F4A7C15)
+_PRIME = np.uint64(0x100000001B3)
+_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+
+class CsrRows:
+    """Minimal CSR matrix (float64 data, int32 indices, int64 indptr) without scipy."""
+
+    def __init__(self, data, indices, indptr, n_features):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = (len(indptr) - 1, n_features)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def row_ids(self):
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def to_scipy(self):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def _codes(text):
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.uint64)
+
+
+def _ngram_hashes(codes, ngram_range):
+    """[(n, hash of the n-gram starting at each position)] for every n in ngram_range.
+
+    Each length is derived from the previous one with one multiply-add, so a
+    body costs a handful of array operations whatever its length.
+    """
+    lo, hi = ngram_range
+    hashes = []
+    h = codes + _SEED
+    with np.errstate(over='ignore'):
+        for n in range(1, hi + 1):
+            if n > 1:
+                h = h[:-1] * _PRIME + codes[n - 1:]
+            if not len(h):
+                break
+            if n >= lo:
+                hashes.append((n, h))
+    return hashes
+
+
+def _buckets(h, n_features):
+    with np.errstate(over='ignore'):
+        h = h ^ (h >> np.uint64(31))
+        h *= _MIX
+        h ^= h >> np.uint64(29)
+    if n_features & (n_features - 1) == 0:
+        return (h & np.uint64(n_features - 1)).astype(np.int64)
+    return (h % np.uint64(n_features)).astype(np.int64)
+
+
+def hash_ngrams(bodies, n_features=NGRAM_FEATURES, ngram_range=NGRAM_RANGE):
+    """L2-normalized n-gram bucket counts of each body, as CsrRows.
+
+    Bodies are joined into one code point array and hashed together; n-grams
+    that would span two bodies are dropped.
+    """
+    texts = [normalize_text(b) for b in bodies]
+    n_rows = len(texts)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n_rows)
+    codes = _codes('\0'.join(texts))
+    # Row of each position; the separator after each body gets -1
+    row_of = np.repeat(np.arange(n_rows, dtype=np.int64), lengths + 1)[:len(codes)]
+    row_of[np.cumsum(lengths + 1)[:-1] - 1] = -1
+
+    keys = []
+    for n, h in _ngram_hashes(codes, ngram_range):
+        start, end = row_of[:len(h)], row_of[n - 1:]
+        valid = (start == end) & (start >= 0)
+        keys.append(start[valid] * n_features + _buckets(h[valid], n_features))
+
+    keys, counts = np.unique(np.concatenate(keys) if keys else np.empty(0, np.int64), return_counts=True)
+    rows = keys // n_features
+    data = counts.astype(np.float64)
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=n_rows))
+    data /= norms[rows]
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return CsrRows(data, (keys % n_features).astype(np.int32), indptr, n_features)
+
+
+class NgramScorer:
+    """Logistic regression over hashed n-gram buckets; score() is the 'bad' probability."""
+
+    def __init__(self, weights, bias, ngram_range=NGRAM_RANGE):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.n_features = len(self.weights)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+
+    def transform(self, bodies):
+        return hash_ngrams(bodies, self.n_features, self.ngram_range)
+
+    def score_rows(self, rows):
+        z = np.bincount(rows.row_ids(), weights=self.weights[rows.indices] * rows.data, minlength=len(rows))
+        return 1.0 / (1.0 + np.exp(-(z + self.bias)))
+
+    def score_batch(self, bodies):
+        # Hashed in slices: the intermediate arrays grow with the characters hashed at once
+        if len(bodies) <= SCORE_SLICE_ROWS:
+            return self.score_rows(self.transform(bodies))
+        return np.concatenate([self.score_rows(self.transform(bodies[i:i + SCORE_SLICE_ROWS]))
+                               for i in range(0, len(bodies), SCORE_SLICE_ROWS)])
+
+    def score(self, body):
+        """score_batch([body])[0] without the batch bookkeeping (the per-request path)."""
+        hashes = _ngram_hashes(_codes(normalize_text(body)), self.ngram_range)
+        z = self.bias
+        if hashes:
+            buckets = _buckets(np.concatenate([h for _, h in hashes]), self.n_features)
+            buckets, counts = np.unique(buckets, return_counts=True)
+            counts = counts.astype(np.float64)
+            z += float(self.weights[buckets] @ counts) / math.sqrt(float(counts @ counts))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def save(self, path=NGRAM_MODEL_PATH):
+        np.savez(path, format_version=np.asarray(FORMAT_VERSION, dtype=np.int32), weights=self.weights,
+                 bias=np.asarray(self.bias), ngram_range=np.asarray(self.ngram_range, dtype=np.int32))
+
+    @classmethod
+    def load(cls, path=NGRAM_MODEL_PATH):
+        """Read a saved scorer; raises ValueError if the file is from another format version."""
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {k: data[k] for k in data.files}
+        version = arrays.get('format_version')
+        if version is None or int(version) != FORMAT_VERSION:
+            raise ValueError(f'{path}: format version {None if version is None else int(version)}, '
+                             f'expected {FORMAT_VERSION} (retrain with USE_NGRAM_FEATURES=1)')
+        weights, ngram_range = arrays.get('weights'), arrays.get('ngram_range')
+        if weights is None or weights.ndim != 1 or ngram_range is None or ngram_range.shape != (2,) \
+                or 'bias' not in arrays or not np.all(np.isfinite(weights)):
+            raise ValueError(f'{path}: not an n-gram model')
+        return cls(weights, arrays['bias'], ngram_range)
+
+
+def fit_ngram_scorer(bodies, y, n_features=NGRAM_FEATURES, ngram_range=NGRAM_RANGE, folds=5, C=10.0, seed=42):
+    """(scorer fitted on every row, out-of-fold probability for each row).
+
+    The out-of-fold probabilities are what the model's 'ngram_score' column is
+    trained on: each one comes from a regression that never saw its row, so the
+    model does not learn to trust a score that is only good on training data.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import StratifiedKFold
+
+    X = hash_ngrams(bodies, n_features, ngram_range).to_scipy()
+    y = np.asarray(y, dtype=np.int64)
+
+    def fit(rows):
+        # With classes (0, 1) the coefficients are those of class 1, 'bad'
+        regression = LogisticRegression(C=C, max_iter=1000, random_state=seed).fit(X[rows], y[rows])
+        return NgramScorer(regression.coef_[0], regression.intercept_[0], ngram_range)
+
+    out_of_fold = np.zeros(len(y))
+    for train, test in StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y):
+        out_of_fold[test] = fit(train).score_rows(_subset(X, test))
+    return fit(np.arange(len(y))), out_of_fold
+
+
+def _subset(X, rows):
+    part = X[rows]
+    return CsrRows(part.data, part.indices, part.indptr, part.shape[1])
+
+
+def load_ngram_model(feature_cols, path=NGRAM_MODEL_PATH):
+    """The NgramScorer a model with these feature columns needs (None if it needs none)."""
+    if NGRAM_COLUMN not in feature_cols:
+        return None
+    if not os.path.exists(path):
+        raise ValueError(f'the model uses {NGRAM_COLUMN} but {path} is missing')
+    return NgramScorer.load(path)
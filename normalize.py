@@ -0,0 +1,95 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from urllib.parse import parse_qsl, unquote_plus
+
+# Normalization stage in front of detection: decode the body the way the
+# application would see it, then fold it to one canonical form so encoded,
+# wide-char or mixed-case variants of a payload look the same to the scanners.
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def parse_body(raw, content_type=None):
+    """Return the body's fields as a dict (form-encoded or JSON); {} when neither.
+
+    Values are decoded (percent-escapes, '+') and JSON values are stringified.
+    """
+    raw = str(raw or '')
+    stripped = raw.lstrip()
+    is_json = (content_type or '').startswith('application/json') or stripped[:1] in ('{', '[')
+    if is_json:
+        try:
+            data = json.loads(raw)
+            if isinstance(data, dict):
+                return {str(k): v if isinstance(v, str) else json.dumps(v) for k, v in data.items()}
+        except ValueError:
+            pass
+    if '=' in raw:
+        return dict(parse_qsl(raw, keep_blank_values=True))
+    return {}
+
+
+def url_decode(s, rounds=2):
+    """Percent/plus-decode up to `rounds` times, stopping once the string is stable."""
+    for _ in range(rounds):
+        decoded = unquote_plus(s)
+        if decoded == s:
+            break
+        s = decoded
+    return s
+
+
+def normalize_text(body):
+    """URL-decode, Unicode NFKC + case fold, collapse whitespace."""
+    s = url_decode(str(body))
+    s = unicodedata.normalize('NFKC', s).casefold()
+    return _WHITESPACE_RE.sub(' ', s)
+
+
+def body_key(raw):
+    """Fixed-size cache key for a raw body."""
+    return hashlib.blake2b(str(raw).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU map with hit/miss counters."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = max(0, int(maxsize))
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0}
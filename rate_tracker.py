@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Per-source request counting for app.py. Each key (client IP, username) owns a
+# ring of time buckets covering the window; a hit advances the ring to the current
+# bucket (zeroing the buckets it skipped), so it costs O(1) and the window total
+# is kept as a running sum. Keys live in N shards, each with its own lock and an
+# LRU-ordered dict, so concurrent threads rarely wait on each other and idle keys
+# are evicted from the cold end as new ones arrive.
+
+Velocity = namedtuple('Velocity', ['ip_burst', 'ip_window', 'user_window'])
+
+
+class _Shard:
+    __slots__ = ('lock', 'entries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+
+class SlidingWindowCounter:
+    """Event counts per key over the last `window` seconds, in `buckets` slices."""
+
+    def __init__(self, window=60.0, buckets=60, shards=64, max_keys=100000, clock=time.monotonic):
+        self.window = float(window)
+        self.buckets = int(buckets)
+        self.width = self.window / self.buckets
+        self.clock = clock
+        self._shards = [_Shard() for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    def hit(self, key, now=None):
+        """Count one event for `key`; returns the key's total over the window."""
+        tick = int((self.clock() if now is None else now) / self.width)
+        n = self.buckets
+        shard = self._shards[hash(key) % len(self._shards)]
+        with shard.lock:
+            entries = shard.entries
+            # entry: [last tick, window total, bucket counts...]
+            entry = entries.get(key)
+            if entry is None:
+                entry = [tick, 0] + [0] * n
+                entries[key] = entry
+            else:
+                entries.move_to_end(key)
+                gap = tick - entry[0]
+                if gap >= n:
+                    entry[1:] = [0] * (n + 1)
+                elif gap > 0:
+                    for t in range(entry[0] + 1, tick + 1):
+                        slot = 2 + t % n
+                        entry[1] -= entry[slot]
+                        entry[slot] = 0
+                entry[0] = tick
+            entry[2 + tick % n] += 1
+            entry[1] += 1
+            total = entry[1]
+
+            # Evict from the least recently hit end: keys idle for a full window
+            # (their count is 0 anyway) and anything beyond the per-shard cap.
+            # At most two per hit keeps the cost O(1).
+            for _ in range(2):
+                oldest_key = next(iter(entries))
+                if oldest_key == key:
+                    break
+                if len(entries) > self._max_per_shard or tick - entries[oldest_key][0] >= n:
+                    entries.popitem(last=False)
+                else:
+                    break
+            return total
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+
+class RateTracker:
+    """Login velocity per client IP and per username, with alert thresholds.
+
+    ip_burst: requests from the IP over `burst_window` seconds; ip_window and
+    user_window: requests from the IP / attempts on the username over `window`.
+    """
+
+    def __init__(self, burst_window=10.0, window=60.0, ip_burst_limit=20, ip_limit=60, user_limit=10,
+                 max_keys=100000):
+        self.ip_burst = SlidingWindowCounter(burst_window, 10, max_keys=max_keys)
+        self.ip = SlidingWindowCounter(window, 12, max_keys=max_keys)
+        self.user = SlidingWindowCounter(window, 12, max_keys=max_keys)
+        self.ip_burst_limit = ip_burst_limit
+        self.ip_limit = ip_limit
+        self.user_limit = user_limit
+
+    def hit(self, ip, username, now=None):
+        """Count one login attempt; returns its Velocity."""
+        now = time.monotonic() if now is None else now
+        ip = ip or '-'
+        return Velocity(self.ip_burst.hit(ip, now), self.ip.hit(ip, now),
+                        self.user.hit(username, now) if username else 0)
+
+    def violations(self, ip, username, velocity):
+        """Alert notes for the limits this attempt just crossed (each fires once per crossing)."""
+        notes = []
+        # '==' rather than '>=': one alert when the limit is reached, not one per
+        # request after it, until the count has dropped back below the limit
+        if velocity.ip_burst == self.ip_burst_limit:
+            notes.append(f'ip {ip} made {velocity.ip_burst} requests in {self.ip_burst.window:g}s')
+        if velocity.ip_window == self.ip_limit:
+            notes.append(f'ip {ip} made {velocity.ip_window} requests in {self.ip.window:g}s')
+        if username and velocity.user_window == self.user_limit:
+            notes.append(f'user {username!r} got {velocity.user_window} attempts in {self.user.window:g}s')
+        return notes
@@ -0,0 +1,169 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import warnings
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app_logging
+
+# Multi-worker entry point: WORKERS pre-forked processes serving app.py on one
+# listening socket, so logins are scored on every core instead of one.
+#
+#   python serve.py --workers 4 --host 0.0.0.0 --port 5000
+#
+# The workers run Werkzeug's threaded server, which Werkzeug documents as a
+# development server. Deployments facing the internet should use gunicorn with
+# gunicorn.conf.py (same preload, shared counters and shutdown order):
+#
+#   gunicorn app:app
+#
+# app.py is imported once, here in the parent: the model, the n-gram weights,
+# the signature automaton and the dedup filter are loaded before fork, and
+# gc.freeze() keeps the collector from touching (and so copying) their pages,
+# which the workers then share copy-on-write. Each worker restarts the threads
+# fork leaves behind (app.worker_init) and runs a threaded WSGI server on the
+# inherited socket; the kernel hands each connection to one of them. The
+# dashboard counters are a shared-memory block with one slot per worker
+# (see shared_counters.py). The parent restarts workers that die, and on
+# SIGTERM or Ctrl+C stops them, waits for each to drain its log, then saves the
+# dashboard checkpoint and the dedup state.
+#
+# Still per worker: the /metrics counters and histograms, the verdict cache,
+# the login rate tracker, the dedup filter (a body can be admitted once per
+# worker) and the live stream (a dashboard only sees that worker's events
+# between counter updates). POST /api/model/reload reloads one worker; the file
+# watcher picks new artifacts up in all of them.
+HOST = os.environ.get('HOST', '127.0.0.1')
+PORT = int(os.environ.get('PORT', 5000))
+LISTEN_BACKLOG = int(os.environ.get('LISTEN_BACKLOG', 1024))
+# Seconds to wait before replacing a worker that died, so a crash loop does not spin
+RESPAWN_DELAY = 1.0
+
+LOG = app_logging.configure('serve', os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+def default_workers():
+    return int(os.environ.get('WORKERS', 0)) or getattr(os, 'process_cpu_count', os.cpu_count)() or 1
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Werkzeug's handler without the per-request access line; errors are still logged.
+
+    app.py logs requests itself at DEBUG, sampled (LOG_SAMPLE_RATE).
+    """
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+def _run_worker(application, sock, slot):
+    """Body of a forked worker; returns when the server has been shut down."""
+    application.worker_init(slot)
+    server = make_server(*sock.getsockname()[:2], application.app, threaded=True, fd=sock.fileno(),
+                         request_handler=QuietRequestHandler)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    finally:
+        application.worker_shutdown()
+
+
+def serve(host, port, workers):
+    # Sized before app.py is imported: it creates one counter slot per worker
+    os.environ['WORKERS'] = str(workers)
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    import app as application
+
+    gc.collect()
+    gc.freeze()
+    # app.py's background threads (log writer, logging, model watcher) are idle
+    # and every worker replaces them in worker_init, so forking here is safe
+    warnings.filterwarnings('ignore', message='This process .* is multi-threaded', category=DeprecationWarning)
+    children = {}  # pid -> slot
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            # The parent forwards SIGTERM; a terminal's Ctrl+C reaches everyone at once
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                _run_worker(application, sock, slot)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                # Skip the parent's atexit handlers (checkpoints are the parent's job)
+                os._exit(code)
+        children[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(1, workers + 1):
+        spawn(slot)
+    bundle = application.REGISTRY.current()
+    LOG.info('Serving on http://%s:%d with %d workers (model: %s)', host, port, workers,
+             bundle.source if bundle is not None else 'none')
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        LOG.warning('Worker %d (pid %d) exited with status %d; restarting it', slot, pid,
+                    os.waitstatus_to_exitcode(status))
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+    LOG.info('All workers stopped')
+    # app._shutdown (atexit) now saves the dashboard checkpoint and the dedup state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve app.py with pre-forked worker processes.')
+    parser.add_argument('--workers', type=int, default=default_workers(),
+                        help='worker processes (default: WORKERS or the number of CPUs)')
+    parser.add_argument('--host', default=HOST, help=f'address to listen on (default: {HOST})')
+    parser.add_argument('--port', type=int, default=PORT, help=f'port to listen on (default: {PORT})')
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        # Windows: no fork, so one process with a thread per request
+        LOG.warning('fork() is not available here; serving with a single process')
+        import app as application
+        make_server(args.host, args.port, application.app, threaded=True,
+                    request_handler=QuietRequestHandler).serve_forever()
+        return 0
+    serve(args.host, args.port, max(1, args.workers))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
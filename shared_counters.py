@@ -0,0 +1,41 @@
+import mmap
+
+import numpy as np
+
+# Counters that several forked worker processes add to and any of them can
+# read. The block is an anonymous shared mapping created before fork, so every
+# child inherits the same physical pages. Each process owns one row (slot) of
+# int64 cells and is the only writer of that row, so adding needs no lock
+# across processes; a read sums the rows. An aligned 8-byte store is never
+# seen half-written, and a reader at worst misses an increment in flight.
+
+
+class SharedCounters:
+    """Named int64 counters in shared memory, one row of cells per process slot."""
+
+    def __init__(self, names, slots=1):
+        self.names = tuple(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self.slots = max(1, int(slots))
+        self._mmap = mmap.mmap(-1, self.slots * len(self.names) * 8)
+        self._cells = np.frombuffer(self._mmap, dtype=np.int64).reshape(self.slots, len(self.names))
+        self._row = self._cells[0]
+
+    def select_slot(self, slot):
+        """Make this process add to row `slot` (call in each worker right after fork)."""
+        if not 0 <= slot < self.slots:
+            raise ValueError(f'slot {slot} out of range (0..{self.slots - 1})')
+        self._row = self._cells[slot]
+
+    def add(self, name, amount=1):
+        self._row[self._index[name]] += amount
+
+    def snapshot(self):
+        """{name: total over every slot}."""
+        return dict(zip(self.names, self._cells.sum(axis=0).tolist()))
+
+    def reset(self, values=None):
+        """Zero every slot, then store `values` ({name: count}) in slot 0."""
+        self._cells[:] = 0
+        for name, value in (values or {}).items():
+            self._cells[0, self._index[name]] = value
@@ -0,0 +1,146 @@
+from collections import namedtuple
+
+import numpy as np
+
+from normalize import normalize_text
+
+# Multi-pattern signature scanner. Rules are loaded from a plain text file and
+# compiled into one Aho-Corasick automaton, so a scan walks the normalized body
+# (see normalize.normalize_text) once and its cost grows with the body length,
+# not with the number of rules. A pattern may start and/or end with \b so it
+# does not match inside a longer word (\brlike\b skips "pearlike"); boundaries
+# are only checked when the automaton reports a hit.
+RULES_PATH = 'signatures.rules'
+
+Rule = namedtuple('Rule', ['rule_id', 'category', 'pattern'])
+Match = namedtuple('Match', ['rule_id', 'category', 'start', 'end'])
+
+_BOUNDARY = '\\b'
+
+
+def _split_boundaries(pattern):
+    """(text to match, needs a boundary before it, needs a boundary after it)"""
+    left = pattern.startswith(_BOUNDARY)
+    right = pattern.endswith(_BOUNDARY) and len(pattern) > len(_BOUNDARY) * left
+    text = pattern[len(_BOUNDARY) * left:len(pattern) - len(_BOUNDARY) * right]
+    return text, left, right
+
+
+def _is_word(ch):
+    return ch.isalnum() or ch == '_'
+
+
+def load_rules(path=RULES_PATH):
+    rules = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            parts = line.split('\t', 2)
+            if len(parts) != 3 or not parts[2] or not _split_boundaries(parts[2])[0]:
+                raise ValueError(f'{path}:{lineno}: expected "<id>\\t<category>\\t<pattern>"')
+            rules.append(Rule(parts[0], parts[1], parts[2]))
+    return rules
+
+
+class SignatureScanner:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.categories = sorted({r.category for r in self.rules})
+        self._category_index = {c: i for i, c in enumerate(self.categories)}
+        self._rule_index = {r.rule_id: i for i, r in enumerate(self.rules)}
+        self._build()
+
+    @classmethod
+    def from_file(cls, path=RULES_PATH):
+        return cls(load_rules(path))
+
+    def _build(self):
+        # Trie of all patterns
+        goto = [{}]
+        outputs = [[]]
+        patterns = [_split_boundaries(r.pattern) for r in self.rules]
+        for index, (text, _, _) in enumerate(patterns):
+            state = 0
+            for ch in text:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # Failure links in BFS order, folded into a full transition table (DFA)
+        # so scanning never has to follow failure links
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            trans = dict(delta[fail[state]])
+            trans.update(goto[state])
+            delta[state] = trans
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                queue.append(nxt)
+
+        self._delta = delta
+        self._outputs = [tuple(o) for o in outputs]
+        self._lengths = [len(text) for text, _, _ in patterns]
+        self._bounds = [(left, right) if left or right else None for _, left, right in patterns]
+
+    def scan_normalized(self, text):
+        """Return every rule hit in already-normalized text, with offsets into it."""
+        delta, outputs, lengths, bounds, rules = self._delta, self._outputs, self._lengths, self._bounds, self.rules
+        matches = []
+        state = 0
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for index in outputs[state]:
+                    start = i + 1 - lengths[index]
+                    if bounds[index] is not None:
+                        left, right = bounds[index]
+                        if left and start > 0 and _is_word(text[start - 1]) and _is_word(text[start]):
+                            continue
+                        if right and i + 1 < len(text) and _is_word(text[i + 1]) and _is_word(ch):
+                            continue
+                    rule = rules[index]
+                    matches.append(Match(rule.rule_id, rule.category, start, i + 1))
+        return matches
+
+    def scan(self, body):
+        return self.scan_normalized(normalize_text(body))
+
+    def hit_vector(self, matches):
+        """Per-rule 0/1 vector in rule-file order."""
+        vector = np.zeros(len(self.rules), dtype=np.int8)
+        for m in matches:
+            vector[self._rule_index[m.rule_id]] = 1
+        return vector
+
+    def category_counts(self, matches):
+        """Number of distinct rules hit per category, in self.categories order."""
+        counts = np.zeros(len(self.categories), dtype=np.int32)
+        for rule_id, category in {(m.rule_id, m.category) for m in matches}:
+            counts[self._category_index[category]] += 1
+        return counts
+
+
+def describe(matches, limit=5):
+    """Short alert note such as 'sqli-001@9, sqli-023@9 (+3 more)'."""
+    seen = []
+    for m in matches:
+        tag = f'{m.rule_id}@{m.start}'
+        if tag not in seen:
+            seen.append(tag)
+    note = ', '.join(seen[:limit])
+    if len(seen) > limit:
+        note += f' (+{len(seen) - limit} more)'
+    return note
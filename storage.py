@@ -0,0 +1,290 @@
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from log_tail import read_tail
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, batches are still single writes
+    fcntl = None
+
+# Storage behind the event log writer, the dashboard and the Streamlit app.
+# Both backends serve the same small API:
+#   append(table, rows)                   batched insert (called by EventLogWriter)
+#   recent(table, limit, before=None)     newest rows, paged with an opaque cursor
+#   query(table, since, until, limit, **equals) / count(...)   filtered reads
+# CsvStorage keeps the original CSV files, so its queries are linear scans.
+# SqliteStorage keeps the tables in one WAL-mode database with indexes on
+# timestamp, classification and endpoint, so a question like "bad logins in the
+# last hour" is an index range lookup, and readers never block the writer.
+STORAGE_DB_PATH = 'events.db'
+
+# table -> columns; timestamps are datetime.isoformat() strings, which sort as text
+TABLES = {
+    'requests': ['timestamp', 'method', 'url', 'body'],
+    'alerts': ['timestamp', 'endpoint', 'raw_body', 'classification', 'notes'],
+    'dataset': ['method', 'endpoint', 'body', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'label'],
+}
+# The CSV files of these tables start with a header line (login_dataset.csv does not)
+CSV_HEADERS = {'requests', 'alerts'}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY, timestamp TEXT, method TEXT, url TEXT, body TEXT);
+CREATE INDEX IF NOT EXISTS requests_timestamp ON requests (timestamp);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY, timestamp TEXT, endpoint TEXT, raw_body TEXT, classification TEXT, notes TEXT);
+CREATE INDEX IF NOT EXISTS alerts_timestamp ON alerts (timestamp);
+CREATE INDEX IF NOT EXISTS alerts_classification ON alerts (classification, timestamp);
+CREATE INDEX IF NOT EXISTS alerts_endpoint ON alerts (endpoint, timestamp);
+CREATE TABLE IF NOT EXISTS dataset (
+    id INTEGER PRIMARY KEY, method TEXT, endpoint TEXT, body TEXT,
+    f1 INTEGER, f2 INTEGER, f3 INTEGER, f4 INTEGER, f5 INTEGER, f6 INTEGER, label TEXT);
+CREATE INDEX IF NOT EXISTS dataset_label ON dataset (label);
+'''
+
+
+def _check_filters(table, since, until, equals):
+    unknown = set(equals) - set(TABLES[table])
+    if unknown:
+        raise ValueError(f'Unknown {table} column(s): {", ".join(sorted(unknown))}')
+    if (since is not None or until is not None) and TABLES[table][0] != 'timestamp':
+        raise ValueError(f'{table} rows have no timestamp')
+
+
+class CsvStorage:
+    """Legacy backend: one CSV file per table, appended in batches under flock."""
+
+    indexed = False
+
+    def __init__(self, paths, fsync=False):
+        self.paths = dict(paths)
+        self.tables = set(self.paths)
+        self.fsync = fsync
+        self._files = {}
+        for table, path in self.paths.items():
+            if not os.path.exists(path):
+                with open(path, 'w', newline='', encoding='utf-8') as f:
+                    if table in CSV_HEADERS:
+                        csv.writer(f).writerow(TABLES[table])
+            self._files[table] = open(path, 'a', newline='', encoding='utf-8')
+
+    def after_fork(self):
+        """Reopen the files in a forked child.
+
+        A flock belongs to the open file description, which fork shares: without
+        reopening, parent and children would all hold "the same" lock and could
+        write at once.
+        """
+        for table, f in list(self._files.items()):
+            f.close()  # every append flushes, so nothing buffered is written twice
+            self._files[table] = open(self.paths[table], 'a', newline='', encoding='utf-8')
+
+    def append(self, table, rows):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        f = self._files[table]
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            f.write(buf.getvalue())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def recent(self, table, limit, before=None):
+        """(records oldest first, cursor) for the last `limit` rows; cursor is a byte offset."""
+        return read_tail(self.paths[table], limit, before=before, has_header=table in CSV_HEADERS)
+
+    def _scan(self, table, since=None, until=None, **equals):
+        _check_filters(table, since, until, equals)
+        path = self.paths[table]
+        if not os.path.exists(path):
+            return
+        columns = TABLES[table]
+        checks = [(columns.index(name), str(value)) for name, value in equals.items()]
+        with open(path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+            reader = csv.reader(f)
+            if table in CSV_HEADERS:
+                next(reader, None)
+            for row in reader:
+                if len(row) != len(columns):
+                    continue
+                if since is not None and row[0] < since or until is not None and row[0] >= until:
+                    continue
+                if all(row[i] == value for i, value in checks):
+                    yield row
+
+    def query(self, table, since=None, until=None, limit=100, **equals):
+        """Matching rows newest first, as dicts (a full pass over the file)."""
+        rows = deque(self._scan(table, since, until, **equals), maxlen=limit)
+        columns = TABLES[table]
+        return [dict(zip(columns, row)) for row in reversed(rows)]
+
+    def count(self, table, since=None, until=None, **equals):
+        return sum(1 for _ in self._scan(table, since, until, **equals))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+class SqliteStorage:
+    """Indexed backend: one SQLite database in WAL mode.
+
+    Each thread gets its own connection, so readers (dashboard requests, the
+    Streamlit app, other processes) run concurrently with the log writer; WAL
+    lets them read the last committed state while a batch is being inserted.
+    """
+
+    indexed = True
+
+    def __init__(self, path=STORAGE_DB_PATH, tables=None, fsync=False):
+        self.path = path
+        self.tables = set(tables or TABLES)
+        # NORMAL only syncs at checkpoints; a crash may lose the last batches
+        # but never corrupts the database. FULL syncs every commit.
+        self.synchronous = 'FULL' if fsync else 'NORMAL'
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+        self._inherited = []
+
+    def after_fork(self):
+        """Drop the parent's connections in a forked child; each thread reconnects on first use.
+
+        SQLite connections must not be used across fork. They are not closed
+        either (closing one in the child could release or checkpoint what the
+        parent still holds), only kept referenced so they are never finalized.
+        """
+        self._inherited.extend(self._connections)
+        self._connections = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def append(self, table, rows):
+        """Insert the whole batch in one transaction."""
+        columns = TABLES[table]
+        placeholders = ', '.join('?' * len(columns))
+        conn = self._connect()
+        with conn:
+            conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})',
+                             [tuple(row) for row in rows])
+
+    def recent(self, table, limit, before=None):
+        """(records oldest first, cursor) for the last `limit` rows; cursor is a row id."""
+        if limit <= 0:
+            return [], None
+        sql = f'SELECT id, {", ".join(TABLES[table])} FROM {table}'
+        params = []
+        if before is not None:
+            sql += ' WHERE id < ?'
+            params.append(int(before))
+        # One extra row tells whether there is an older page
+        rows = self._connect().execute(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+        cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [[str(v) for v in row[1:]] for row in reversed(rows[:limit])], cursor
+
+    def _where(self, table, since, until, equals):
+        _check_filters(table, since, until, equals)
+        clauses, params = [], []
+        for name, value in equals.items():
+            clauses.append(f'{name} = ?')
+            params.append(value)
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def query(self, table, since=None, until=None, limit=100, **equals):
+        """Matching rows newest first, as dicts."""
+        columns = TABLES[table]
+        where, params = self._where(table, since, until, equals)
+        order = 'timestamp DESC, id DESC' if 'timestamp' in columns else 'id DESC'
+        rows = self._connect().execute(f'SELECT {", ".join(columns)} FROM {table}{where} ORDER BY {order} LIMIT ?',
+                                       params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def count(self, table, since=None, until=None, **equals):
+        where, params = self._where(table, since, until, equals)
+        return self._connect().execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+
+    def import_csv(self, table, path, batch_rows=50000):
+        """Copy an existing CSV log into the table; returns the number of rows."""
+        columns = TABLES[table]
+        total = 0
+        with open(path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+            reader = csv.reader(f)
+            if table in CSV_HEADERS:
+                next(reader, None)
+            batch = []
+            for row in reader:
+                if len(row) == len(columns):
+                    batch.append(row)
+                if len(batch) >= batch_rows:
+                    self.append(table, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                self.append(table, batch)
+                total += len(batch)
+        return total
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def open_storage(backend, paths, db_path=STORAGE_DB_PATH, fsync=False):
+    """Storage for the tables in `paths` ({table: csv path}) on the 'csv' or 'sqlite' backend."""
+    if backend == 'csv':
+        return CsvStorage(paths, fsync=fsync)
+    if backend == 'sqlite':
+        return SqliteStorage(db_path, tables=paths, fsync=fsync)
+    raise ValueError(f'Unknown storage backend: {backend!r} (expected csv or sqlite)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the CSV request and alert logs into the SQLite store '
+                                                 '(run once: rows are appended, not merged).')
+    parser.add_argument('--db', default=STORAGE_DB_PATH)
+    parser.add_argument('--requests', default='http_requests.csv')
+    parser.add_argument('--alerts', default='detected_alerts.csv')
+    args = parser.parse_args()
+
+    storage = SqliteStorage(args.db)
+    for table, path in (('requests', args.requests), ('alerts', args.alerts)):
+        if os.path.exists(path):
+            print(f'{table}: imported {storage.import_csv(table, path):,} rows from {path}')
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from compiled_forest import CompiledForest, dataset_features, export_forest, verify  # noqa: E402
+
+joblib = pytest.importorskip('joblib')
+pytest.importorskip('sklearn')
+pytest.importorskip('pandas')
+
+
+@pytest.fixture(scope='module')
+def trained():
+    """The committed model, its feature columns and the features of the whole dataset."""
+    model = joblib.load(os.path.join(ROOT, 'login_classifier.pkl'))
+    feature_cols = list(joblib.load(os.path.join(ROOT, 'feature_columns.pkl')))
+    return model, feature_cols, dataset_features(feature_cols, os.path.join(ROOT, 'login_dataset.csv'))
+
+
+def test_committed_forest_matches_sklearn(trained):
+    model, feature_cols, X = trained
+    compiled = CompiledForest.load(os.path.join(ROOT, 'login_classifier.npz'))
+    assert list(compiled.feature_columns) == feature_cols
+    assert verify(model, compiled, X) <= 1e-12
+
+
+def test_export_round_trip(trained, tmp_path):
+    model, feature_cols, X = trained
+    path = str(tmp_path / 'forest.npz')
+    export_forest(model, feature_cols, path)
+    compiled = CompiledForest.load(path)
+    assert verify(model, compiled, X) <= 1e-12
+
+
+def test_deep_forest_level_walk(tmp_path):
+    # Fully grown trees take the level-by-level batch walk instead of the node split
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(3000, 4))
+    y = (X[:, 0] * X[:, 1] + rng.normal(size=3000) * 0.5 > 0).astype(int)
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    path = str(tmp_path / 'deep.npz')
+    export_forest(model, ['a', 'b', 'c', 'd'], path)
+    compiled = CompiledForest.load(path)
+    assert not compiled.fast_batches
+    assert verify(model, compiled, X) <= 1e-12
@@ -4,62 +4,225 @@ from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 import joblib
+import json
 import os
+import time
 
-# Load dataset
-df = pd.read_csv('login_dataset.csv', header=None)
-df.columns = ['method', 'endpoint', 'body', 'f1', 'f2', 'f3', 'f4', 'f5', 'f6', 'label']
-
-# Display dataset info
-print(f"Dataset shape: {df.shape}")
-print(f"Label distribution:\n{df['label'].value_counts()}")
-
-# Feature engineering
-# We'll create features from the body (login credentials)
-def extract_features(body):
-    features = {
-        'body_length': len(str(body)),
-        'has_special_chars': 1 if any(c in str(body) for c in ["'", '"', '-', ';', '*']) else 0,
-        'has_sql_keywords': 1 if any(kw in str(body).lower() for kw in ['union', 'select', 'drop', 'insert', 'update', 'delete', 'exec', 'script']) else 0,
-        'has_path_traversal': 1 if '..' in str(body) else 0,
-        'body_contains_slash': str(body).count('/'),
-    }
-    return features
-
-# Extract features for each row
-feature_list = []
-for idx, row in df.iterrows():
-    features = extract_features(row['body'])
-    features['f1'] = row['f1']
-    features['f2'] = row['f2']
-    features['f3'] = row['f3']
-    feature_list.append(features)
-
-features_df = pd.DataFrame(feature_list)
-
-# Prepare X and y
-X = features_df
-y = (df['label'] == 'bad').astype(int)  # 1 for bad, 0 for good
-
-print(f"\nFeatures shape: {X.shape}")
-print(f"Target distribution:\n{y.value_counts()}")
-
-# Split data
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Train model
-print("\nTraining model...")
-model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
-model.fit(X_train, y_train)
+from columnar_store import DATASET_COLUMNS, DATASET_STORE, LABELS, ColumnarDataset
+from dataset_stream import StratifiedReservoir, budget_rows, iter_chunks, peak_rss_mb, stage
+from compiled_forest import COMPILED_MODEL_PATH, CompiledForest, export_forest, verify
+from features import (FEATURE_COLUMNS, NGRAM_COLUMN, VELOCITY_COLUMNS, dataset_extra, extract_features_batch,
+                      signature_columns)
+from model_search import CANDIDATES, print_results, search, select
+from ngram_hashing import NGRAM_MODEL_PATH, fit_ngram_scorer
+
+DATASET_CSV = 'login_dataset.csv'
+
+# USE_SIGNATURE_FEATURES=1 adds one sig_<category> column per signature category
+# (see signatures.rules) to the base feature columns
+TRAIN_COLUMNS = list(FEATURE_COLUMNS)
+if os.environ.get('USE_SIGNATURE_FEATURES') == '1':
+    TRAIN_COLUMNS += signature_columns()
+# USE_VELOCITY_FEATURES=1 adds the per-IP/per-username login counts app.py
+# records in the dataset's f4..f6 fields
+if os.environ.get('USE_VELOCITY_FEATURES') == '1':
+    TRAIN_COLUMNS += VELOCITY_COLUMNS
+# USE_NGRAM_FEATURES=1 adds the ngram_score column: the probability a logistic
+# regression over hashed character n-grams of the body gives (ngram_hashing.py).
+# The regression is saved to ngram_model.npz next to the model.
+USE_NGRAM_FEATURES = os.environ.get('USE_NGRAM_FEATURES') == '1'
+if USE_NGRAM_FEATURES:
+    TRAIN_COLUMNS.append(NGRAM_COLUMN)
+
+# TRAIN_MODE picks how the dataset is loaded:
+#   memory       whole dataset in RAM (default, fine up to a few million rows)
+#   sample       one streaming pass keeping a stratified reservoir sample that
+#                fits TRAIN_MEMORY_MB, then a normal fit on the sample
+#   incremental  one streaming pass adding TRAIN_TREES_PER_CHUNK trees per chunk
+#   search       whole dataset in RAM; cross-validates and times the candidate
+#                models in model_search.py and keeps the fastest one whose recall
+#                reaches SEARCH_MIN_RECALL
+# Both streaming modes read TRAIN_CHUNK_ROWS rows at a time.
+TRAIN_MODE = os.environ.get('TRAIN_MODE', 'memory')
+TRAIN_CHUNK_ROWS = int(os.environ.get('TRAIN_CHUNK_ROWS', 1000000))
+TRAIN_MEMORY_MB = float(os.environ.get('TRAIN_MEMORY_MB', 1024))
+TRAIN_TREES_PER_CHUNK = int(os.environ.get('TRAIN_TREES_PER_CHUNK', 10))
+if TRAIN_MODE not in ('memory', 'sample', 'incremental', 'search'):
+    raise SystemExit(f"Unknown TRAIN_MODE '{TRAIN_MODE}' (expected memory, sample, incremental or search)")
+if USE_NGRAM_FEATURES and TRAIN_MODE not in ('memory', 'search'):
+    raise SystemExit('USE_NGRAM_FEATURES=1 needs TRAIN_MODE memory or search')
+
+# Search mode: folds, worker processes (0 = one per CPU) and the recall floor
+SEARCH_FOLDS = int(os.environ.get('SEARCH_FOLDS', 5))
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', 0))
+SEARCH_MIN_RECALL = float(os.environ.get('SEARCH_MIN_RECALL', 0.95))
+
+# Test scores of the saved model (and the search table), shown by app_streamlit.py
+MODEL_REPORT_PATH = 'model_report.json'
+
+store = None
+if os.path.isdir(DATASET_STORE) and set(TRAIN_COLUMNS) <= set(FEATURE_COLUMNS):
+    # Columnar copy (see columnar_store.py): bring it up to date with the CSV, then
+    # read only the precomputed feature and label columns instead of every string
+    with stage('sync columnar store'):
+        store = ColumnarDataset(DATASET_STORE)
+        store.sync(DATASET_CSV)
+    print(f"Dataset rows: {len(store)} (columnar store '{DATASET_STORE}', {len(store.segments)} segments)")
+    print(f"Label distribution: {store.label_counts()}")
+
+if TRAIN_MODE == 'sample':
+    # Stream the dataset once, keeping a stratified reservoir sample that fits
+    # TRAIN_MEMORY_MB, then fit the usual forest on the sample
+    capacity = budget_rows(TRAIN_MEMORY_MB, len(TRAIN_COLUMNS)) // 2
+    reservoir = StratifiedReservoir(capacity, len(TRAIN_COLUMNS))
+    with stage('stream + sample'):
+        for X_chunk, y_chunk in iter_chunks(TRAIN_COLUMNS, TRAIN_CHUNK_ROWS, DATASET_CSV, store):
+            reservoir.add(X_chunk, y_chunk)
+    X, y = reservoir.arrays()
+    print(f"Rows seen per class (good, bad): {reservoir.seen}; sampled {len(X)} (at most {capacity} per class)")
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    print("\nTraining model...")
+    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+    with stage('fit'):
+        model.fit(X_train, y_train)
+
+elif TRAIN_MODE == 'incremental':
+    # One pass over the dataset, growing the forest by TRAIN_TREES_PER_CHUNK trees
+    # fitted on each chunk (warm_start). Every 5th row is held out for testing,
+    # itself reservoir-sampled so the test set stays within the memory budget.
+    holdout = StratifiedReservoir(budget_rows(TRAIN_MEMORY_MB, len(TRAIN_COLUMNS)) // 10, len(TRAIN_COLUMNS))
+    model = RandomForestClassifier(n_estimators=0, warm_start=True, random_state=42, n_jobs=-1)
+    carry = None  # rows of chunks that lacked one of the classes
+    row = 0
+    print("\nTraining model...")
+    with stage('stream + fit'):
+        for X_chunk, y_chunk in iter_chunks(TRAIN_COLUMNS, TRAIN_CHUNK_ROWS, DATASET_CSV, store):
+            test_mask = (np.arange(row, row + len(y_chunk)) % 5) == 0
+            row += len(y_chunk)
+            holdout.add(X_chunk[test_mask], y_chunk[test_mask])
+            X_train, y_train = X_chunk[~test_mask], y_chunk[~test_mask]
+            if carry is not None:
+                X_train = np.concatenate([carry[0], X_train])[-TRAIN_CHUNK_ROWS:]
+                y_train = np.concatenate([carry[1], y_train])[-TRAIN_CHUNK_ROWS:]
+            if len(np.unique(y_train)) < 2:
+                # Every tree must see both classes; fold these rows into the next chunk
+                carry = (X_train.copy(), y_train.copy())
+                continue
+            carry = None
+            model.n_estimators += TRAIN_TREES_PER_CHUNK
+            model.fit(X_train, y_train)
+        if carry is not None and not model.n_estimators:
+            raise ValueError('The dataset needs both good and bad rows to train')
+    print(f"Fitted {model.n_estimators} trees over {row} rows")
+    X_test, y_test = holdout.arrays()
+
+else:
+    if store is not None:
+        features_df = pd.DataFrame(store.features(TRAIN_COLUMNS), columns=TRAIN_COLUMNS)
+        y = pd.Series((store.labels() == LABELS.index('bad')).astype(int))  # 1 for bad, 0 for good
+        bodies = store.strings('body')
+    else:
+        # Load dataset
+        df = pd.read_csv(DATASET_CSV, header=None)
+        df.columns = DATASET_COLUMNS
+
+        # Display dataset info
+        print(f"Dataset shape: {df.shape}")
+        print(f"Label distribution:\n{df['label'].value_counts()}")
+
+        y = (df['label'] == 'bad').astype(int)  # 1 for bad, 0 for good
+        bodies = df['body'].astype(str).tolist()  # str() like the feature extraction: NaN -> 'nan'
+        extra = dataset_extra(df)
+        if USE_NGRAM_FEATURES:
+            # Out-of-fold scores, so the model trains on what the regression says
+            # about rows it has not seen
+            with stage('n-gram model'):
+                ngram_scorer, extra[NGRAM_COLUMN] = fit_ngram_scorer(bodies, y)
+
+        # Feature engineering
+        # We'll create features from the body (login credentials) in one vectorized pass
+        X_values = extract_features_batch(bodies, TRAIN_COLUMNS, extra=extra)
+        features_df = pd.DataFrame(X_values, columns=TRAIN_COLUMNS)
+
+    # Prepare X and y
+    X = features_df
+
+    print(f"\nFeatures shape: {X.shape}")
+    print(f"Target distribution:\n{y.value_counts()}")
+
+    if TRAIN_MODE == 'search':
+        # Candidates are compared on the training split only; the test split
+        # scores the winner below, like in the other modes
+        X_train, X_test, y_train, y_test, bodies_train, _ = train_test_split(
+            X.to_numpy(), y.to_numpy(), list(bodies), test_size=0.2, random_state=42, stratify=y)
+        print(f"\nComparing {len(CANDIDATES)} models ({SEARCH_FOLDS}-fold CV, recall floor {SEARCH_MIN_RECALL})...")
+        with stage('search'):
+            search_results, search_models = search(X_train, y_train, bodies_train, folds=SEARCH_FOLDS,
+                                                   workers=SEARCH_WORKERS or None)
+        selected, met_floor = select(search_results, SEARCH_MIN_RECALL)
+        print_results(search_results, selected['name'])
+        if not met_floor:
+            print(f"\nWarning: no model reached recall {SEARCH_MIN_RECALL}; keeping the best recall")
+        model = search_models[selected['name']]
+    else:
+        # Split data
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+        # Train model
+        print("\nTraining model...")
+        model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
+        with stage('fit'):
+            model.fit(X_train, y_train)
 
 # Evaluate
-train_score = model.score(X_train, y_train)
+train_score = model.score(X_train, y_train)  # last chunk only in incremental mode
 test_score = model.score(X_test, y_test)
+# Share of the bad test rows that were flagged
+test_bad = np.asarray(y_test) == 1
+test_recall = float(np.mean(np.asarray(model.predict(X_test))[test_bad] == 1)) if test_bad.any() else 1.0
 print(f"\nTrain Accuracy: {train_score:.4f}")
 print(f"Test Accuracy: {test_score:.4f}")
+print(f"Test Recall (bad): {test_recall:.4f}")
 
 # Save model and feature list
 joblib.dump(model, 'login_classifier.pkl')
-joblib.dump(features_df.columns.tolist(), 'feature_columns.pkl')
+joblib.dump(list(TRAIN_COLUMNS), 'feature_columns.pkl')
 print("\nModel saved as 'login_classifier.pkl'")
 print("Feature columns saved as 'feature_columns.pkl'")
+if USE_NGRAM_FEATURES:
+    ngram_scorer.save(NGRAM_MODEL_PATH)
+    print(f"N-gram model saved as '{NGRAM_MODEL_PATH}' ({ngram_scorer.n_features} buckets)")
+
+# Export the forest as flat node arrays for the sklearn-free scorer in app.py,
+# and check it reproduces predict_proba on the whole dataset (the held-out rows
+# in the streaming modes, where the dataset is never in memory at once)
+X_check = X if TRAIN_MODE == 'memory' else X_test
+if isinstance(model, RandomForestClassifier):
+    export_forest(model, list(TRAIN_COLUMNS), COMPILED_MODEL_PATH)
+    max_diff = verify(model, CompiledForest.load(COMPILED_MODEL_PATH), X_check)
+    print(f"Compiled forest saved as '{COMPILED_MODEL_PATH}' (matches predict_proba on {len(X_check)} rows, max diff {max_diff:.2e})")
+elif os.path.exists(COMPILED_MODEL_PATH):
+    # Only forests compile; remove the old export so app.py loads the new pickle
+    os.remove(COMPILED_MODEL_PATH)
+    print(f"Removed '{COMPILED_MODEL_PATH}': {type(model).__name__} is served from the pickle")
+
+report = {
+    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'mode': TRAIN_MODE,
+    'model': type(model).__name__,
+    'feature_columns': list(TRAIN_COLUMNS),
+    'train_accuracy': float(train_score),
+    'test_accuracy': float(test_score),
+    'test_recall': test_recall,
+}
+if TRAIN_MODE == 'search':
+    report['search'] = {'folds': SEARCH_FOLDS, 'min_recall': SEARCH_MIN_RECALL, 'selected': selected['name'],
+                        'met_floor': met_floor, 'candidates': search_results}
+with open(MODEL_REPORT_PATH, 'w', encoding='utf-8') as f:
+    json.dump(report, f, indent=2)
+print(f"Model report saved as '{MODEL_REPORT_PATH}'")
+
+rss = peak_rss_mb()
+if rss is not None:
+    print(f"Peak RSS: {rss:.0f} MB")